@@ -8,29 +8,82 @@
 # This file is copyright under the latest version of the EUPL.
 # Please see LICENSE file for your rights under this license.
 
-# Retrieve stats from FTL engine
-pihole-FTL() {
-  ftl_port=$(cat /var/run/pihole-FTL.port 2> /dev/null)
-  if [[ -n "$ftl_port" ]]; then
-    # Open connection to FTL
-    exec 3<>"/dev/tcp/localhost/$ftl_port"
-
-    # Test if connection is open
-    if { "true" >&3; } 2> /dev/null; then
-      # Send command to FTL
-      echo -e ">$1" >&3
-
-      # Read input
-      read -r -t 1 LINE <&3
-      until [[ ! $? ]] || [[ "$LINE" == *"EOM"* ]]; do
-         echo "$LINE" >&1
-         read -r -t 1 LINE <&3
+# Snapshot of the metrics served to Prometheus, and the statistics gravity leaves for it
+metricsFile="/var/run/pihole/metrics.txt"
+metricsPid="/var/run/pihole/metrics.pid"
+gravityMetrics="/etc/pihole/gravity.metrics"
+
+# The connection to FTL (fd 3) is kept open across refreshes
+ftl_port=""
+# Cleared when FTL only answers the first of several commands sent at once
+ftl_pipeline=true
+
+ftl_disconnect() {
+  if [[ -n "${ftl_port}" ]]; then
+    exec 3>&-
+    ftl_port=""
+  fi
+}
+
+ftl_connect() {
+  local port
+  port=$(cat /var/run/pihole-FTL.port 2> /dev/null)
+  # Reuse the open connection, unless FTL has moved to another port
+  if [[ -n "${ftl_port}" ]] && [[ "${port}" == "${ftl_port}" ]]; then
+    return 0
+  fi
+  ftl_disconnect
+  if [[ -z "${port}" ]]; then
+    return 1
+  fi
+  { exec 3<>"/dev/tcp/localhost/${port}"; } 2> /dev/null || return 1
+  ftl_port="${port}"
+}
+
+ftl_send() {
+  # Send the commands in one go and collect one reply per command into ftl_replies
+  local line reply=""
+  ftl_replies=()
+  printf ">%s\n" "$@" >&3 2> /dev/null || return 1
+  while [[ "${#ftl_replies[@]}" -lt "$#" ]]; do
+    read -r -t 1 line <&3 || return 1
+    if [[ "${line}" == *"EOM"* ]]; then
+      ftl_replies+=("${reply}")
+      reply=""
+    else
+      reply="${reply:+${reply}$'\n'}${line}"
+    fi
+  done
+}
+
+ftl_query() {
+  # Retrieve the replies to one or more commands from FTL into ftl_replies
+  local attempt cmd replies
+  for attempt in 1 2; do
+    ftl_connect || return 1
+    if [[ "${ftl_pipeline}" == true ]]; then
+      ftl_send "$@" && return 0
+      # FTL answered, but not to every command it was sent at once
+      [[ "${#ftl_replies[@]}" -gt 0 ]] && ftl_pipeline=false
+    else
+      replies=()
+      for cmd in "$@"; do
+        ftl_send "${cmd}" || break
+        replies+=("${ftl_replies[0]}")
       done
+      ftl_replies=("${replies[@]}")
+      [[ "${#ftl_replies[@]}" -eq "$#" ]] && return 0
+    fi
+    # The connection is gone (e.g. FTL restarted) or out of step, start over once
+    ftl_disconnect
+  done
+  return 1
+}
 
-      # Close connection
-      exec 3>&-
-      exec 3<&-
-   fi
+# Retrieve stats from FTL engine
+pihole-FTL() {
+  if ftl_query "$1"; then
+    echo "${ftl_replies[0]}"
   else
     echo -e "${COL_LIGHT_RED}FTL offline${COL_NC}"
   fi
@@ -88,12 +141,16 @@ get_init_stats() {
     }' <<< "$1";
   }
 
-  # Convert seconds to human-readable format
+  # Convert seconds to human-readable format, into the variable named by $2 if given
   hrSecs() { 
     day=$(( $1/60/60/24 )); hrs=$(( $1/3600%24 )); mins=$(( ($1%3600)/60 )); secs=$(( $1%60 ))
     [[ "$day" -ge "2" ]] && plu="s"
     [[ "$day" -ge "1" ]] && days="$day day${plu}, " || days=""
-    printf "%s%02d:%02d:%02d\n" "$days" "$hrs" "$mins" "$secs"
+    if [[ -n "$2" ]]; then
+      printf -v "$2" "%s%02d:%02d:%02d" "$days" "$hrs" "$mins" "$secs"
+    else
+      printf "%s%02d:%02d:%02d\n" "$days" "$hrs" "$mins" "$secs"
+    fi
   }
 
   # Set Colour Codes
@@ -161,8 +218,6 @@ get_init_stats() {
 
 get_sys_stats() {
   local ph_ver_raw
-  local cpu_raw
-  local ram_raw
   local disk_raw
 
   # Update every 12 refreshes (Def: every 60s)
@@ -215,32 +270,66 @@ get_sys_stats() {
     fi
   fi
   
-  sys_uptime=$(hrSecs "$(cut -d. -f1 /proc/uptime)")
-  sys_loadavg=$(cut -d " " -f1,2,3 /proc/loadavg)
+  # Everything below runs on every refresh, so it only reads /proc and /sys with
+  # shell builtins instead of starting a process for each value
+  # (uptime_raw and sys_loadavg_raw are kept for the metrics)
+  local cpu_stat cpu_total cpu_idle cpu_mhz_raw key value temp_raw leases
+  read -r uptime_raw _ < /proc/uptime
+  hrSecs "${uptime_raw%.*}" sys_uptime
+  # The fourth field of loadavg is "running/total" scheduling entities
+  read -r -a sys_loadavg_raw < /proc/loadavg
+  sys_loadavg="${sys_loadavg_raw[*]:0:3}"
+  cpu_taskact="${sys_loadavg_raw[3]%/*}"
+  cpu_tasks="${sys_loadavg_raw[3]#*/}"
   
-  # Get CPU usage, only counting processes over 1% CPU as active
-  cpu_raw=$(ps -eo pcpu,rss --no-headers | grep -E -v "    0")
-  cpu_tasks=$(wc -l <<< "$cpu_raw")
-  cpu_taskact=$(sed -r "/(^ 0.)/d" <<< "$cpu_raw" | wc -l)
-  cpu_perc=$(awk '{sum+=$1} END {printf "%.0f\n", sum/'"$sys_cores"'}' <<< "$cpu_raw")
+  # Get CPU usage since the previous refresh from the jiffies in /proc/stat
+  read -r _ cpu_stat < /proc/stat
+  cpu_stat=(${cpu_stat})
+  cpu_total=0
+  for value in "${cpu_stat[@]:0:8}"; do
+    cpu_total=$((cpu_total + value))
+  done
+  # idle + iowait
+  cpu_idle=$((cpu_stat[3] + cpu_stat[4]))
+  if [[ "$cpu_total" -gt "${cpu_total_prev:-0}" ]]; then
+    cpu_perc=$(( (100 * ((cpu_total - ${cpu_total_prev:-0}) - (cpu_idle - ${cpu_idle_prev:-0})) + (cpu_total - ${cpu_total_prev:-0}) / 2) / (cpu_total - ${cpu_total_prev:-0}) ))
+  fi
+  cpu_total_prev="$cpu_total"
+  cpu_idle_prev="$cpu_idle"
   
   # Get CPU clock speed
+  cpu_mhz=""
   if [[ -n "$scaling_freq_file" ]]; then
-    cpu_mhz=$(( $(< /sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq) / 1000 ))
+    read -r cpu_mhz_raw < "$scaling_freq_file"
+    cpu_mhz=$(( cpu_mhz_raw / 1000 ))
   else
-    cpu_mhz=$(lscpu | awk -F "[ .]+" '/MHz/ {print $4;exit}')
+    while IFS=":" read -r key value; do
+      if [[ "$key" == "cpu MHz"* ]]; then
+        cpu_mhz_raw="${value# }"
+        cpu_mhz="${cpu_mhz_raw%.*}"
+        break
+      fi
+    done < /proc/cpuinfo
   fi
   
   # Determine correct string format for CPU clock speed
   if [[ -n "$cpu_mhz" ]]; then
-    [[ "$cpu_mhz" -le "999" ]] && cpu_freq="$cpu_mhz MHz" || cpu_freq="$(calcFunc "$cpu_mhz"/1000) Ghz"
+    if [[ "$cpu_mhz" -le "999" ]]; then
+      cpu_freq="$cpu_mhz MHz"
+    else
+      # e.g. 1200 -> "1.2 Ghz", without trailing zeroes
+      printf -v value "%03d" $(( cpu_mhz % 1000 ))
+      while [[ "$value" == *0 ]]; do value="${value%0}"; done
+      cpu_freq="$(( cpu_mhz / 1000 ))${value:+.$value} Ghz"
+    fi
     [[ -n "$cpu_freq" ]] && cpu_freq_str=" @ $cpu_freq" || cpu_freq_str=""
   fi
   
-  # Determine colour for temperature
+  # Determine colour for temperature (rounded from millidegrees)
   if [[ -n "$temp_file" ]]; then
+    read -r temp_raw < "$temp_file"
     if [[ "$temp_unit" == "C" ]]; then
-      cpu_temp=$(printf "%'.0fc\n" "$(calcFunc "$(< $temp_file) / 1000")")
+      printf -v cpu_temp "%dc" $(( (temp_raw + 500) / 1000 ))
       
       case "${cpu_temp::-1}" in
         -*|[0-9]|[1-3][0-9]) cpu_col="$COL_LIGHT_BLUE";;
@@ -254,7 +343,7 @@ get_sys_stats() {
       cpu_temp_str=", $cpu_col$cpu_temp$COL_NC$COL_DARK_GRAY"
       
     elif [[ "$temp_unit" == "F" ]]; then
-      cpu_temp=$(printf "%'.0ff\n" "$(calcFunc "($(< $temp_file) / 1000) * 9 / 5 + 32")")
+      printf -v cpu_temp "%df" $(( (temp_raw * 9 / 5 + 32000 + 500) / 1000 ))
       
       case "${cpu_temp::-1}" in
         -*|[0-9]|[0-9][0-9]) cpu_col="$COL_LIGHT_BLUE";;
@@ -267,32 +356,79 @@ get_sys_stats() {
       cpu_temp_str=", $cpu_col$cpu_temp$COL_NC$COL_DARK_GRAY"
       
     else
-      cpu_temp_str=$(printf ", %'.0fk\n" "$(calcFunc "($(< $temp_file) / 1000) + 273.15")")
+      printf -v cpu_temp_str ", %dk" $(( (temp_raw + 273150 + 500) / 1000 ))
     fi
   else
     cpu_temp_str=""
   fi
   
-  ram_raw=($(awk '/MemTotal:/{total=$2} /MemFree:/{free=$2} /Buffers:/{buffers=$2} /^Cached:/{cached=$2} END {printf "%.0f %.0f %.0f", (total-free-buffers-cached)*100/total, (total-free-buffers-cached)*1024, total*1024}' /proc/meminfo))
-  ram_perc="${ram_raw[0]}"
-  ram_used="${ram_raw[1]}"
-  ram_total="${ram_raw[2]}"
+  local mem_total=0 mem_free=0 mem_buffers=0 mem_cached=0 mem_used
+  while read -r key value _; do
+    case "$key" in
+      "MemTotal:") mem_total="$value";;
+      "MemFree:") mem_free="$value";;
+      "Buffers:") mem_buffers="$value";;
+      "Cached:") mem_cached="$value";;
+    esac
+  done < /proc/meminfo
+  mem_used=$(( mem_total - mem_free - mem_buffers - mem_cached ))
+  ram_perc=$(( (mem_used * 200 / mem_total + 1) / 2 ))
+  ram_used=$(( mem_used * 1024 ))
+  ram_total=$(( mem_total * 1024 ))
   
-  if [[ "$(pihole status web 2> /dev/null)" == "1" ]]; then
+  if get_ph_status; then
     ph_status="${COL_LIGHT_GREEN}Active"
   else
     ph_status="${COL_LIGHT_RED}Inactive"
   fi
   
   if [[ "$DHCP_ACTIVE" == "true" ]]; then
-    ph_dhcp_num=$(wc -l 2> /dev/null < "/etc/pihole/dhcp.leases")
+    leases=()
+    mapfile -t leases 2> /dev/null < "/etc/pihole/dhcp.leases"
+    ph_dhcp_num="${#leases[@]}"
   fi
 }
 
+# Same as "pihole status web" returning 1: dnsmasq is running and the lists are enabled
+get_ph_status() {
+  local pid comm line key value
+  # Find dnsmasq again only when the process seen last has gone
+  if [[ -z "$dnsmasq_pid" ]] || [[ ! -d "/proc/$dnsmasq_pid" ]]; then
+    dnsmasq_pid=""
+    for pid in /proc/[0-9]*; do
+      read -r comm 2> /dev/null < "$pid/comm" || continue
+      if [[ "$comm" == "dnsmasq" ]]; then
+        dnsmasq_pid="${pid#/proc/}"
+        break
+      fi
+    done
+  fi
+  [[ -n "$dnsmasq_pid" ]] || return 1
+  # pihole enable and disable record the state here, as readBlockingState in pihole reads it
+  if [[ -f /etc/pihole/blocking.state ]]; then
+    while IFS="=" read -r key value; do
+      [[ "$key" == "BLOCKING" ]] && [[ "$value" == "disabled" ]] && return 1
+    done < /etc/pihole/blocking.state
+    return 0
+  fi
+  # Blocking disabled before the state file was kept has the lists commented out
+  [[ -f /etc/dnsmasq.d/01-pihole.conf ]] || return 1
+  while read -r line; do
+    [[ "$line" == "addn-hosts=/"* ]] && return 0
+  done < /etc/dnsmasq.d/01-pihole.conf
+  return 1
+}
+
 get_ftl_stats() {
   local stats_raw
   
-  stats_raw=($(pihole-FTL "stats"))
+  # All stats are retrieved with a single round trip to FTL
+  if [[ -z "$1" ]]; then
+    ftl_query "stats" "recentBlocked" "top-ads (1)" "top-domains (1)" "top-clients (1)"
+  else
+    ftl_query "stats"
+  fi || ftl_replies=()
+  stats_raw=(${ftl_replies[0]})
   domains_being_blocked_raw="${stats_raw[1]}"
   dns_queries_today_raw="${stats_raw[3]}"
   ads_blocked_today_raw="${stats_raw[5]}"
@@ -310,10 +446,10 @@ get_ftl_stats() {
     ads_blocked_today=$(printf "%'.0f\n" "${ads_blocked_today_raw}")
     ads_percentage_today=$(printf "%'.0f\n" "${ads_percentage_today_raw}")
     
-    recent_blocked_raw=$(pihole-FTL recentBlocked)
-    top_ad_raw=($(pihole-FTL "top-ads (1)"))
-    top_domain_raw=($(pihole-FTL "top-domains (1)"))
-    top_client_raw=($(pihole-FTL "top-clients (1)"))
+    recent_blocked_raw="${ftl_replies[1]}"
+    top_ad_raw=(${ftl_replies[2]})
+    top_domain_raw=(${ftl_replies[3]})
+    top_client_raw=(${ftl_replies[4]})
     
     # Limit strings to 40 characters to prevent overflow
     recent_blocked="${recent_blocked_raw:0:40}"
@@ -402,6 +538,81 @@ jsonFunc() {
   echo "{\"domains_being_blocked\":${domains_being_blocked_raw},\"dns_queries_today\":${dns_queries_today_raw},\"ads_blocked_today\":${ads_blocked_today_raw},\"ads_percentage_today\":${ads_percentage_today_raw}}"
 }
 
+# Print a gauge with its help and type lines, a value per remaining argument ("labels value")
+metricFunc() {
+  local name="$1" value
+  printf "# HELP pihole_%s %s\n# TYPE pihole_%s gauge\n" "$name" "$2" "$name"
+  shift 2
+  for value in "$@"; do
+    printf "pihole_%s%s\n" "$name" "$value"
+  done
+}
+
+# Write every metric of one refresh
+metricsSnapshot() {
+  local line key value temp_raw active=0 temp
+  
+  metricFunc "up" "Whether FTL answered the last refresh" " ${#ftl_replies[@]}"
+  # Every counter of FTL's stats, whatever this version of FTL reports
+  while read -r key value; do
+    [[ "$value" =~ ^-?[0-9.]+$ ]] && metricFunc "$key" "FTL stats: $key" " $value"
+  done <<< "${ftl_replies[0]}"
+  
+  get_ph_status && active=1
+  metricFunc "status" "Whether blocking is active" " $active"
+  metricFunc "uptime_seconds" "System uptime" " $uptime_raw"
+  metricFunc "load_average" "System load average" "{period=\"1m\"} ${sys_loadavg_raw[0]}" \
+    "{period=\"5m\"} ${sys_loadavg_raw[1]}" "{period=\"15m\"} ${sys_loadavg_raw[2]}"
+  metricFunc "tasks" "Scheduling entities" "{state=\"running\"} $cpu_taskact" "{state=\"total\"} $cpu_tasks"
+  metricFunc "cpu_usage_percent" "CPU usage since the last refresh" " $cpu_perc"
+  metricFunc "cpu_cores" "Number of CPU cores" " $sys_cores"
+  metricFunc "cpu_frequency_mhz" "CPU clock speed" " ${cpu_mhz:-0}"
+  if [[ -n "$temp_file" ]]; then
+    read -r temp_raw < "$temp_file"
+    printf -v temp "%d.%03d" $((temp_raw / 1000)) $((temp_raw % 1000))
+    metricFunc "cpu_temperature_celsius" "CPU temperature" " $temp"
+  fi
+  metricFunc "memory_used_bytes" "RAM used, without buffers and cache" " $ram_used"
+  metricFunc "memory_total_bytes" "Total RAM" " $ram_total"
+  metricFunc "disk_used_bytes" "Storage used on /" " ${disk_used:-0}"
+  metricFunc "disk_total_bytes" "Storage size of /" " ${disk_total:-0}"
+  if [[ "$DHCP_ACTIVE" == "true" ]]; then
+    metricFunc "dhcp_leases" "Active DHCP leases" " $ph_dhcp_num"
+    metricFunc "dhcp_leases_max" "Size of the DHCP range" " $ph_dhcp_max"
+  fi
+  
+  # The statistics gravity wrote after its last run
+  if [[ -f "$gravityMetrics" ]]; then
+    while IFS= read -r line; do
+      printf "%s\n" "$line"
+    done < "$gravityMetrics"
+  fi
+}
+
+# Refresh the metrics snapshot every interval, a scrape only reads the file
+metricsFunc() {
+  local interval="${1:-10}" pid
+  
+  mkdir -p "${metricsFile%/*}"
+  read -r pid 2> /dev/null < "$metricsPid"
+  # The pid may be taken by another process by now, or be one that has exited but not been reaped
+  if [[ -n "$pid" ]] && [[ "$pid" != "$$" ]] && grep -q -a "chronometer" "/proc/$pid/cmdline" 2> /dev/null; then
+    echo "::: Metrics are already being collected (PID $pid)"
+    exit 1
+  fi
+  echo "$$" > "$metricsPid"
+  
+  get_init_stats
+  for (( ; ; )); do
+    get_sys_stats
+    get_ftl_stats "json"
+    # Replace the snapshot in one go, so a scrape never reads half of it
+    metricsSnapshot > "${metricsFile}.tmp"
+    mv "${metricsFile}.tmp" "$metricsFile"
+    sleep "$interval"
+  done
+}
+
 helpFunc() {
     if [[ "$1" == "?" ]]; then
       echo "Unknown option. Please view 'pihole -c --help' for more information"
@@ -414,12 +625,19 @@ Options:
   -j, --json          Output stats as JSON formatted string
   -r, --refresh       Set update frequency (in seconds)
   -e, --exit          Output stats and exit witout refreshing
+  -m, --metrics       Keep ${metricsFile} up to date in Prometheus format
+                      (optionally followed by the interval in seconds, default 10)
   -h, --help          Display this help text"
   fi
   
   exit 0
 }
 
+# Sourcing the script only provides its functions
+if [[ "${BASH_SOURCE[0]}" != "${0}" ]]; then
+  return 0
+fi
+
 if [[ $# = 0 ]]; then
   chronoFunc
 fi
@@ -430,6 +648,7 @@ for var in "$@"; do
     "-h" | "--help"    ) helpFunc;;
     "-r" | "--refresh" ) chronoFunc "$2";;
     "-e" | "--exit"    ) chronoFunc "exit";;
+    "-m" | "--metrics" ) metricsFunc "$2";;
     *                  ) helpFunc "?";;
   esac
 done
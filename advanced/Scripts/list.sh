@@ -15,11 +15,14 @@ whitelist=${piholeDir}/whitelist.txt
 blacklist=${piholeDir}/blacklist.txt
 readonly wildcardlist="/etc/dnsmasq.d/03-pihole-wildcard.conf"
 reload=false
+noReload=false
 addmode=true
 verbose=true
 
 domList=()
 domToRemoveList=()
+domInput=""
+editedLists=()
 
 listMain=""
 listAlt=""
@@ -41,6 +44,8 @@ Example: 'pihole -${param} site.com', or 'pihole -${param} site1.com site2.com'
 ${type^}list one or more domains
 
 Options:
+  -                   Read the domains from stdin, one per line
+  --input=<file>      Read the domains from a file, one per line
   -d, --delmode       Remove domain(s) from the ${type}list
   -nr, --noreload     Update ${type}list without refreshing dnsmasq
   -q, --quiet         Make output less verbose
@@ -50,23 +55,96 @@ Options:
   exit 0
 }
 
-EscapeRegexp() {
-  # This way we may safely insert an arbitrary
-  # string in our regular expressions
-  # Also remove leading "." if present
-  echo $* | sed 's/^\.*//' | sed "s/[]\.|$(){}?+*^]/\\\\&/g" | sed "s/\\//\\\\\//g"
+HandleOther() {
+  # Domains are validated all at once by ValidateDomains
+  domList=("${domList[@]}" "$1")
 }
 
-HandleOther() {
-  # First, convert everything to lowercase
-  domain=$(sed -e "y/ABCDEFGHIJKLMNOPQRSTUVWXYZ/abcdefghijklmnopqrstuvwxyz/" <<< "$1")
+ValidateDomains() {
+  # Lowercase and check the validity of every domain in a single pass
+  # ${1}: file to write the valid domains to, one per line
+  perl -e '
+    open(my $out, ">", shift) or die "::: Unable to write the domains: $!\n";
+    while (<STDIN>) {
+      s/#.*//;
+      for my $arg (split) {
+        my $domain = lc $arg;
+        if ($domain =~ /(?!.*[^a-z0-9-\.].*)^((?=[a-z0-9-]{1,63}\.)(xn--)?[a-z0-9-]+\.)*[a-z]{2,63}/) {
+          print $out "$domain\n";
+        } else {
+          print "::: $arg is not a valid argument or domain name\n";
+        }
+      }
+    }' "${1}"
+}
 
-  # Check validity of domain
-  validDomain=$(echo "${domain}" | perl -lne 'print if /(?!.*[^a-z0-9-\.].*)^((?=[a-z0-9-]{1,63}\.)(xn--)?[a-z0-9-]+\.)*[a-z]{2,63}/')
-  if [[ -z "${validDomain}" ]]; then
-    echo "::: $1 is not a valid argument or domain name"
+EditList() {
+  # Load a list once, apply every change in memory and move the result into place
+  # ${1}: list, ${2}: add or remove, ${3}: file with the domains, one per line
+  local list="${1}"
+  if [[ ! -s "${3}" ]] || { [[ ! -f "${list}" ]] && [[ "${2}" == "remove" ]]; }; then
+    return
+  fi
+  touch "${list}"
+  truncate -s 0 "${list}.tmp"
+  if [[ "${list}" == "${wildcardlist}" ]] && [[ "${2}" == "add" ]]; then
+    source "${piholeDir}/setupVars.conf"
+    # Remove the /* from the end of the IPv4addr.
+    IPV4_ADDRESS=${IPV4_ADDRESS%/*}
+  fi
+  # Wildcards are matched on the domain of their address=/domain/IP lines
+  if awk -v list="${list}" -v mode="${2}" -v verbose="${verbose}" -v out="${list}.tmp" \
+    -v wildcard="$([[ "${list}" == "${wildcardlist}" ]] && echo 1)" \
+    -v ipv4="${IPV4_ADDRESS}" -v ipv6="${IPV6_ADDRESS}" '
+    function key(line, fields) {
+      if (!wildcard) return tolower(line)
+      split(line, fields, "/")
+      return (fields[1] == "address=") ? tolower(fields[2]) : ""
+    }
+    NR == FNR {
+      if (!($0 in wanted)) order[++n] = $0
+      wanted[$0]
+      next
+    }
+    {
+      domain = key($0)
+      if (domain in wanted) {
+        if (mode == "remove") {
+          if (!(domain in found)) print "::: Removing " domain " from " list "..."
+          found[domain]
+          changes++
+          next
+        }
+        found[domain]
+      }
+      print > out
+    }
+    END {
+      for (i = 1; i <= n; i++) {
+        domain = order[i]
+        if (mode == "add" && !(domain in found)) {
+          if (verbose == "true") print "::: Adding " domain " to " (wildcard ? "wildcard blacklist" : list) "..."
+          if (!wildcard) {
+            print domain > out
+          } else {
+            print "address=/" domain "/" ipv4 > out
+            if (ipv6 != "") print "address=/" domain "/" ipv6 > out
+          }
+          changes++
+        } else if (verbose == "true" && mode == "add") {
+          print "::: " domain " already exists in " (wildcard ? "wildcard blacklist" : list) ", no need to add!"
+        } else if (verbose == "true" && !(domain in found)) {
+          print "::: " domain " does not exist in " list ", no need to remove!"
+        }
+      }
+      close(out)
+      exit (changes ? 0 : 1)
+    }' "${3}" "${list}"; then
+    mv "${list}.tmp" "${list}"
+    editedLists+=("${list}")
+    reload=true
   else
-    domList=("${domList[@]}" ${validDomain})
+    rm -f "${list}.tmp"
   fi
 }
 
@@ -76,109 +154,39 @@ PoplistFile() {
     touch ${whitelist}
   fi
 
-  for dom in "${domList[@]}"; do
-      # Logic: If addmode then add to desired list and remove from the other; if delmode then remove from desired list but do not add to the other
-    if ${addmode}; then
-      AddDomain "${dom}" "${listMain}"
-      RemoveDomain "${dom}" "${listAlt}"
-      if [[ "${listMain}" == "${whitelist}" || "${listMain}" == "${blacklist}" ]]; then
-        RemoveDomain "${dom}" "${wildcardlist}"
-      fi
-    else
-      RemoveDomain "${dom}" "${listMain}"
+  # Every list is read and written once, no matter how many domains are given
+  domFile=$(mktemp)
+  {
+    printf "%s\n" "${domList[@]}"
+    if [[ -n "${domInput}" ]]; then
+      cat "${domInput}"
     fi
-  done
-}
+  } | ValidateDomains "${domFile}"
 
-AddDomain() {
-  list="$2"
-  domain=$(EscapeRegexp "$1")
-
-  if [[ "${list}" == "${whitelist}" || "${list}" == "${blacklist}" ]]; then
-    bool=true
-    # Is the domain in the list we want to add it to?
-    grep -Ex -q "${domain}" "${list}" > /dev/null 2>&1 || bool=false
-
-    if [[ "${bool}" == false ]]; then
-      # Domain not found in the whitelist file, add it!
-      if [[ "${verbose}" == true ]]; then
-      echo "::: Adding $1 to $list..."
-      fi
-      reload=true
-      # Add it to the list we want to add it to
-      echo "$1" >> "${list}"
-    else
-      if [[ "${verbose}" == true ]]; then
-        echo "::: ${1} already exists in ${list}, no need to add!"
-      fi
+  # Logic: If addmode then add to desired list and remove from the other; if delmode then remove from desired list but do not add to the other
+  if ${addmode}; then
+    EditList "${listMain}" add "${domFile}"
+    if [[ -n "${listAlt}" ]]; then
+      EditList "${listAlt}" remove "${domFile}"
     fi
-  elif [[ "${list}" == "${wildcardlist}" ]]; then
-    source "${piholeDir}/setupVars.conf"
-    # Remove the /* from the end of the IPv4addr.
-    IPV4_ADDRESS=${IPV4_ADDRESS%/*}
-    IPV6_ADDRESS=${IPV6_ADDRESS}
-
-    bool=true
-    # Is the domain in the list?
-    grep -e "address=\/${domain}\/" "${wildcardlist}" > /dev/null 2>&1 || bool=false
-
-    if [[ "${bool}" == false ]]; then
-      if [[ "${verbose}" == true ]]; then
-      echo "::: Adding $1 to wildcard blacklist..."
-      fi
-      reload=true
-      echo "address=/$1/${IPV4_ADDRESS}" >> "${wildcardlist}"
-      if [[ "${#IPV6_ADDRESS}" > 0 ]]; then
-        echo "address=/$1/${IPV6_ADDRESS}" >> "${wildcardlist}"
-      fi
-    else
-      if [[ "${verbose}" == true ]]; then
-        echo "::: ${1} already exists in wildcard blacklist, no need to add!"
-      fi
+    if [[ "${listMain}" == "${whitelist}" || "${listMain}" == "${blacklist}" ]]; then
+      EditList "${wildcardlist}" remove "${domFile}"
     fi
+  else
+    EditList "${listMain}" remove "${domFile}"
   fi
-}
-
-RemoveDomain() {
-    list="$2"
-    domain=$(EscapeRegexp "$1")
-
-    if [[ "${list}" == "${whitelist}" || "${list}" == "${blacklist}" ]]; then
-      bool=true
-      # Is it in the list? Logic follows that if its whitelisted it should not be blacklisted and vice versa
-      grep -Ex -q "${domain}" "${list}" > /dev/null 2>&1 || bool=false
-      if [[ "${bool}" == true ]]; then
-        # Remove it from the other one
-        echo "::: Removing $1 from $list..."
-        # /I flag: search case-insensitive
-        sed -i "/${domain}/Id" "${list}"
-        reload=true
-      else
-        if [[ "${verbose}" == true ]]; then
-          echo "::: ${1} does not exist in ${list}, no need to remove!"
-        fi
-      fi
-    elif [[ "${list}" == "${wildcardlist}" ]]; then
-      bool=true
-      # Is it in the list?
-      grep -e "address=\/${domain}\/" "${wildcardlist}" > /dev/null 2>&1 || bool=false
-      if [[ "${bool}" == true ]]; then
-        # Remove it from the other one
-        echo "::: Removing $1 from $list..."
-        # /I flag: search case-insensitive
-        sed -i "/address=\/${domain}/Id" "${list}"
-        reload=true
-      else
-        if [[ "${verbose}" == true ]]; then
-          echo "::: ${1} does not exist in ${list}, no need to remove!"
-        fi
-      fi
-    fi
+  rm -f "${domFile}"
 }
 
 Reload() {
-  # Reload hosts file
-  pihole -g -sd
+  # Reload hosts file, only rebuilding what the edited lists are part of
+  if [[ " ${editedLists[*]} " == *" ${wildcardlist} "* ]]; then
+    pihole -g -sd
+  elif [[ " ${editedLists[*]} " == *" ${whitelist} "* ]]; then
+    pihole -g -w
+  else
+    pihole -g -b
+  fi
 }
 
 Displaylist() {
@@ -202,12 +210,14 @@ for var in "$@"; do
     "-w" | "whitelist"   ) listMain="${whitelist}"; listAlt="${blacklist}";;
     "-b" | "blacklist"   ) listMain="${blacklist}"; listAlt="${whitelist}";;
     "-wild" | "wildcard" ) listMain="${wildcardlist}";;
-    "-nr"| "--noreload"  ) reload=false;;
+    "-nr"| "--noreload"  ) noReload=true;;
     "-d" | "--delmode"   ) addmode=false;;
     "-f" | "--force"     ) force=true;;
     "-q" | "--quiet"     ) verbose=false;;
     "-h" | "--help"      ) helpFunc;;
     "-l" | "--list"      ) Displaylist;;
+    "-"                  ) domInput=/dev/stdin;;
+    "--input="*          ) domInput="${var#*=}";;
     *                    ) HandleOther "${var}";;
   esac
 done
@@ -218,8 +228,13 @@ if [[ $# = 0 ]]; then
   helpFunc
 fi
 
+if [[ -n "${domInput}" ]] && [[ ! -r "${domInput}" ]]; then
+  echo "::: Unable to read domains from ${domInput}"
+  exit 1
+fi
+
 PoplistFile
 
-if ${reload}; then
+if ${reload} && ! ${noReload}; then
   Reload
 fi
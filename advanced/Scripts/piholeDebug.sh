@@ -30,21 +30,33 @@ WHITELISTMATCHES="/tmp/whitelistmatches.list"
 readonly FTLLOG="/var/log/pihole-FTL.log"
 
 TIMEOUT=60
-# Header info and introduction
-cat << EOM
-::: Beginning Pi-hole debug at $(date)!
-:::
-::: This process collects information from your Pi-hole, and optionally uploads
-::: it to a unique and random directory on tricorder.pi-hole.net.
-:::
-::: NOTE: All log files auto-delete after 48 hours and ONLY the Pi-hole developers
-::: can access your data via the given token. We have taken these extra steps to
-::: secure your data and will work to further reduce any personal information gathered.
-:::
-::: Please read and note any issues, and follow any directions advised during this process.
-EOM
-
-source ${VARSFILE}
+# Longest a single check may take, checks that run over are cut short
+CHECK_TIMEOUT=30
+DEBUG_SCRIPT="$(readlink -f "${BASH_SOURCE[0]}")"
+
+# Checks that do not depend on each other, in the order of their sections in the log
+DEBUG_CHECKS=(
+  'version_check || echo "REQUIRED FILES MISSING"'
+  'source_file "/etc/pihole/setupVars.conf"'
+  'distro_check || echo "Distro Check soft fail"'
+  'processor_check || echo "Processor Check soft fail"'
+  'ip_check 6 ${IPV6_ADDRESS}'
+  'ip_check 4 ${IPV4_ADDRESS}'
+  'daemon_check lighttpd http'
+  'daemon_check dnsmasq domain'
+  'daemon_check pihole-FTL 4711'
+  'checkProcesses'
+  'testResolver 4 "${IPV4_ADDRESS%/*}"'
+  '[[ -z "${IPV6_ADDRESS}" ]] || testResolver 6 "${IPV6_ADDRESS%/*}"'
+  'testChaos'
+  'debugLighttpd'
+  'files_check "${DNSMASQFILE}"'
+  'dir_check "${DNSMASQCONFDIR}"'
+  'files_check "${WHITELISTFILE}"'
+  'files_check "${BLACKLISTFILE}"'
+  'files_check "${ADLISTFILE}"'
+  'logs_check'
+)
 
 ### Private functions exist here ###
 log_write() {
@@ -312,6 +324,9 @@ testResolver() {
   local localdig
   local piholedig
   local remotedig
+  local localfd
+  local piholefd
+  local remotefd
 
   if [[ ${protocol} == "6" ]]; then
     g_addr="2001:4860:4860::8888"
@@ -328,9 +343,14 @@ testResolver() {
 
 	testurl="${url:-doubleclick.com}"
 
+	# All three lookups are sent at once, a server that does not answer only
+	# holds up its own result
+	exec {localfd}< <(dig_status -"${protocol}" "${testurl}" @${l_addr} +short "${r_type}")
+	exec {piholefd}< <(dig_status -"${protocol}" "${testurl}" @"${IP}" +short "${r_type}")
+	exec {remotefd}< <(dig_status -"${protocol}" "${testurl}" @${g_addr} +short "${r_type}")
 
 	log_write "Resolution of ${testurl} from Pi-hole (${l_addr}):"
-	if localdig=$(dig -"${protocol}" "${testurl}" @${l_addr} +short "${r_type}"); then
+	if localdig=$(dig_result <&${localfd}); then
 		log_write "${localdig}"
 	else
 		log_write "Failed to resolve ${testurl} on Pi-hole (${l_addr})"
@@ -338,7 +358,7 @@ testResolver() {
 	log_write ""
 
 	log_write "Resolution of ${testurl} from Pi-hole (${IP}):"
-	if piholedig=$(dig -"${protocol}" "${testurl}" @"${IP}" +short "${r_type}"); then
+	if piholedig=$(dig_result <&${piholefd}); then
 		log_write "${piholedig}"
 	else
 		log_write "Failed to resolve ${testurl} on Pi-hole (${IP})"
@@ -347,23 +367,45 @@ testResolver() {
 
 
 	log_write "Resolution of ${testurl} from ${g_addr}:"
-	if remotedig=$(dig -"${protocol}" "${testurl}" @${g_addr} +short "${r_type}"); then
+	if remotedig=$(dig_result <&${remotefd}); then
 		log_write "${remotedig:-NXDOMAIN}"
 	else
 		log_write "Failed to resolve ${testurl} on upstream server ${g_addr}"
 	fi
 	log_write ""
+	exec {localfd}<&- {piholefd}<&- {remotefd}<&-
+}
+
+# Run dig and print its exit status after its output
+dig_status() {
+  dig "$@"
+  echo "$?"
+}
+
+# Print the output of dig_status and return the exit status it ends with
+dig_result() {
+  local output
+  local status
+  output=$(cat)
+  status=${output##*$'\n'}
+  if [[ "${output}" == *$'\n'* ]]; then
+    echo "${output%$'\n'*}"
+  fi
+  return "${status:-1}"
 }
 
 testChaos(){
   # Check Pi-hole specific records
+  local serversfd
 
+	exec {serversfd}< <(dig +short chaos txt servers.bind)
 	log_write "Pi-hole dnsmasq specific records lookups"
 	log_write "Cache Size:"
 	log_write $(dig +short chaos txt cachesize.bind)
 	log_write "Upstream Servers:"
-	log_write $(dig +short chaos txt servers.bind)
+	log_write $(cat <&${serversfd})
 	log_write ""
+	exec {serversfd}<&-
 
 }
 checkProcesses() {
@@ -419,6 +461,67 @@ dumpPiHoleLog() {
 	fi
 }
 
+logs_check() {
+  header_write "Analyzing gravity.list"
+
+  gravity_length=$(grep -c ^ "${GRAVITYFILE}") \
+  && log_write "${GRAVITYFILE} is ${gravity_length} lines long." \
+  || log_echo "Warning: No gravity.list file found!"
+
+  header_write "Analyzing pihole.log"
+
+  pihole_length=$(grep -c ^ "${PIHOLELOG}") \
+  && log_write "${PIHOLELOG} is ${pihole_length} lines long." \
+  || log_echo "Warning: No pihole.log file found!"
+
+  pihole_size=$(du -h "${PIHOLELOG}" | awk '{ print $1 }') \
+  && log_write "${PIHOLELOG} is ${pihole_size}." \
+  || log_echo "Warning: No pihole.log file found!"
+
+  header_write "Analyzing pihole-FTL.log"
+
+  FTL_length=$(grep -c ^ "${FTLLOG}") \
+  && log_write "${FTLLOG} is ${FTL_length} lines long." \
+  || log_echo "Warning: No pihole-FTL.log file found!"
+
+  FTL_size=$(du -h "${FTLLOG}" | awk '{ print $1 }') \
+  && log_write "${FTLLOG} is ${FTL_size}." \
+  || log_echo "Warning: No pihole-FTL.log file found!"
+
+  tail -n50 "${FTLLOG}" >&3
+}
+
+# Run checks at the same time, each in a shell of its own that is stopped after
+# CHECK_TIMEOUT seconds, then add what they printed and logged in the order given
+run_checks() {
+  local dir
+  local i
+  local pids
+  local status
+  dir=$(mktemp -d /tmp/pihole_checks.XXXXXX)
+  pids=()
+  i=0
+  for check in "$@"; do
+    timeout "${CHECK_TIMEOUT}" bash -c 'source "${1}"; source "${2}" 2> /dev/null; eval "${3}"' \
+      check "${DEBUG_SCRIPT}" "${VARSFILE}" "${check}" < /dev/null > "${dir}/${i}.out" 2>&1 3> "${dir}/${i}.log" &
+    pids+=($!)
+    i=$(( i + 1 ))
+  done
+  i=0
+  for check in "$@"; do
+    wait "${pids[$i]}"
+    status=$?
+    cat "${dir}/${i}.out"
+    cat "${dir}/${i}.log" >&3
+    # timeout exits with 124 when the check ran over
+    if [[ "${status}" -eq 124 ]]; then
+      log_echo "Check did not finish within ${CHECK_TIMEOUT} seconds: ${check}"
+    fi
+    i=$(( i + 1 ))
+  done
+  rm -rf "${dir}"
+}
+
 # Anything to be done after capturing of pihole.log terminates
 finalWork() {
   local tricorder
@@ -461,6 +564,27 @@ finalWork() {
 }
 
 ### END FUNCTIONS ###
+# Sourcing the script only provides its functions
+if [[ "${BASH_SOURCE[0]}" != "${0}" ]]; then
+  return 0
+fi
+
+# Header info and introduction
+cat << EOM
+::: Beginning Pi-hole debug at $(date)!
+:::
+::: This process collects information from your Pi-hole, and optionally uploads
+::: it to a unique and random directory on tricorder.pi-hole.net.
+:::
+::: NOTE: All log files auto-delete after 48 hours and ONLY the Pi-hole developers
+::: can access your data via the given token. We have taken these extra steps to
+::: secure your data and will work to further reduce any personal information gathered.
+:::
+::: Please read and note any issues, and follow any directions advised during this process.
+EOM
+
+source ${VARSFILE}
+
 # Create temporary file for log
 TEMPLOG=$(mktemp /tmp/pihole_temp.XXXXXX)
 # Open handle 3 for templog
@@ -473,68 +597,9 @@ DUMPLOG=$(mktemp /tmp/pihole_temp.XXXXXX)
 exec 4>"$DUMPLOG"
 rm "$DUMPLOG"
 
-# Gather version of required packages / repositories
-version_check || echo "REQUIRED FILES MISSING"
-# Check for newer setupVars storage file
-source_file "/etc/pihole/setupVars.conf"
-# Gather information about the running distribution
-distro_check || echo "Distro Check soft fail"
-# Gather processor type
-processor_check || echo "Processor Check soft fail"
-
-ip_check 6 ${IPV6_ADDRESS}
-ip_check 4 ${IPV4_ADDRESS}
-
-daemon_check lighttpd http
-daemon_check dnsmasq domain
-daemon_check pihole-FTL 4711
-checkProcesses
-
-# Check local/IP/Google for IPv4 Resolution
-testResolver 4 "${IPV4_ADDRESS%/*}"
-# If IPv6 enabled, check resolution
-if [[ "${IPV6_ADDRESS}" ]]; then
-  testResolver 6 "${IPV6_ADDRESS%/*}"
-fi
-# Poll dnsmasq Pi-hole specific queries
-testChaos
-
-debugLighttpd
-
-files_check "${DNSMASQFILE}"
-dir_check "${DNSMASQCONFDIR}"
-files_check "${WHITELISTFILE}"
-files_check "${BLACKLISTFILE}"
-files_check "${ADLISTFILE}"
-
-
-header_write "Analyzing gravity.list"
-
-	gravity_length=$(grep -c ^ "${GRAVITYFILE}") \
-	&& log_write "${GRAVITYFILE} is ${gravity_length} lines long." \
-	|| log_echo "Warning: No gravity.list file found!"
-
-header_write "Analyzing pihole.log"
-
-  pihole_length=$(grep -c ^ "${PIHOLELOG}") \
-  && log_write "${PIHOLELOG} is ${pihole_length} lines long." \
-  || log_echo "Warning: No pihole.log file found!"
-
-  pihole_size=$(du -h "${PIHOLELOG}" | awk '{ print $1 }') \
-  && log_write "${PIHOLELOG} is ${pihole_size}." \
-  || log_echo "Warning: No pihole.log file found!"
-
-header_write "Analyzing pihole-FTL.log"
-
-  FTL_length=$(grep -c ^ "${FTLLOG}") \
-  && log_write "${FTLLOG} is ${FTL_length} lines long." \
-  || log_echo "Warning: No pihole-FTL.log file found!"
-
-  FTL_size=$(du -h "${FTLLOG}" | awk '{ print $1 }') \
-  && log_write "${FTLLOG} is ${FTL_size}." \
-  || log_echo "Warning: No pihole-FTL.log file found!"
-
-tail -n50 "${FTLLOG}" >&3
+# All checks run at once, the slowest one decides how long this takes
+echo "::: Running ${#DEBUG_CHECKS[@]} checks, each one for at most ${CHECK_TIMEOUT} seconds..."
+run_checks "${DEBUG_CHECKS[@]}"
 
 trap finalWork EXIT
 
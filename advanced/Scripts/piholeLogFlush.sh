@@ -8,36 +8,66 @@
 # This file is copyright under the latest version of the EUPL.
 # Please see LICENSE file for your rights under this license.
 
+logFile="/var/log/pihole.log"
+# pihole.log.1 is kept as it is, pihole.log.2.gz up to this one are archives
+keepLogs=5
+
+archiveLog() {
+  local i
+  # The oldest archive goes, the others move up by one
+  rm -f "${logFile}.${keepLogs}.gz" "${logFile}.${keepLogs}.gz.idx"
+  for (( i = keepLogs - 1; i > 1; i-- )); do
+    if [[ -f "${logFile}.${i}.gz" ]]; then
+      mv "${logFile}.${i}.gz" "${logFile}.$(( i + 1 )).gz"
+    fi
+    if [[ -f "${logFile}.${i}.gz.idx" ]]; then
+      mv "${logFile}.${i}.gz.idx" "${logFile}.$(( i + 1 )).gz.idx"
+    fi
+  done
+  # Compressed in independent blocks, so searches only decompress what they need
+  /opt/pihole/queryLog.sh --archive "${logFile}.1" "${logFile}.2.gz"
+}
+
+rotateLog() {
+  # Roll up what is left in the log before it goes out of sight. The ingest only
+  # follows the log one rotation back, so it runs before every rotation.
+  /opt/pihole/queryLog.sh --ingest --quiet
+
+  # Like logrotate's notifempty, empty logs are not archived
+  if [[ -s "${logFile}.1" ]]; then
+    archiveLog
+  fi
+  rm -f "${logFile}.1"
+
+  # Hand the log over without copying it: dnsmasq keeps writing to the moved
+  # file until it is told to reopen its log, nothing gets lost in between
+  if [[ -f "${logFile}" ]]; then
+    mv "${logFile}" "${logFile}.1"
+    touch "${logFile}"
+    chown --reference="${logFile}.1" "${logFile}"
+    chmod --reference="${logFile}.1" "${logFile}"
+    dnsmasqPid=$(pidof dnsmasq)
+    if [[ "${dnsmasqPid}" ]]; then
+      kill -USR2 ${dnsmasqPid}
+    fi
+  fi
+}
+
 if [[ "$@" != *"quiet"* ]]; then
-  echo -n "::: Flushing /var/log/pihole.log ..."
+  echo -n "::: Flushing ${logFile} ..."
 fi
 if [[ "$@" == *"once"* ]]; then
-  # Nightly logrotation
-  if command -v /usr/sbin/logrotate >/dev/null; then
-    # Logrotate once
-    /usr/sbin/logrotate --force /etc/pihole/logrotate
-  else
-    # Copy pihole.log over to pihole.log.1
-    # and empty out pihole.log
-    # Note that moving the file is not an option, as
-    # dnsmasq would happily continue writing into the
-    # moved file (it will have the same file handler)
-    cp /var/log/pihole.log /var/log/pihole.log.1
-    echo " " > /var/log/pihole.log
-  fi
+  # Nightly rotation
+  rotateLog
 else
   # Manual flushing
-  if command -v /usr/sbin/logrotate >/dev/null; then
-    # Logrotate twice to move all data out of sight of FTL
-    /usr/sbin/logrotate --force /etc/pihole/logrotate; sleep 3
-    /usr/sbin/logrotate --force /etc/pihole/logrotate
-  else
-    # Flush both pihole.log and pihole.log.1 (if existing)
-    echo " " > /var/log/pihole.log
-    if [ -f /var/log/pihole.log.1 ]; then
-      echo " " > /var/log/pihole.log.1
-    fi
-  fi
+  # Rotate twice to move all data out of sight of FTL
+  rotateLog; sleep 3
+  rotateLog
+fi
+# logrotate still takes care of pihole-FTL.log
+if command -v /usr/sbin/logrotate >/dev/null; then
+  /usr/sbin/logrotate --force /etc/pihole/logrotate
 fi
 
 if [[ "$@" != *"quiet"* ]]; then
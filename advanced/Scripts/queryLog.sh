@@ -0,0 +1,472 @@
+#!/usr/bin/env bash
+# Pi-hole: A black hole for Internet advertisements
+# (c) 2017 Pi-hole, LLC (https://pi-hole.net)
+# Network-wide ad blocking via your own hardware.
+#
+# Rolls the queries in the Pi-hole log up per minute, hour and day and reports on them
+#
+# This file is copyright under the latest version of the EUPL.
+# Please see LICENSE file for your rights under this license.
+
+logFile="/var/log/pihole.log"
+setupVars="/etc/pihole/setupVars.conf"
+# One file of rollups for the current hour, named YYYYMMDDHH, holding lines of
+# minute (YYYYMMDDHHMM) <tab> kind <tab> key <tab> queries <tab> blocked
+# kind t: the totals of the minute, followed by <tab> forwarded <tab> cached
+# kind c: a client, kind d: a domain
+# Once an hour is over it is summed up in YYYYMMDDHH.hour, and once a day is
+# over its hours in YYYYMMDD.day, in lines of the same form starting with the
+# hour or the day instead of the minute
+rollupDir="/etc/pihole/querylog"
+# Inode of the log, how far it was read and a checksum of its first bytes
+stateFile="${rollupDir}/ingest.state"
+lockFile="${rollupDir}/ingest.lock"
+# The checksum tells a rotated log from the one that was being read
+fingerprintBytes=1024
+keepDays=30
+# Archives of rotated logs are gzip members of this many lines each, with an
+# index of the time span, domains and clients of every member in <archive>.idx
+blockLines=50000
+# pihole.log.1 is kept as it is, pihole.log.2.gz up to this one are archives
+keepLogs=5
+topCount=10
+quiet=false
+
+# Turns the "Mmm dd HH:MM:SS" a log line starts with into YYYYMMDDHHMMSS, the
+# year is the current one unless that would put the line in the future
+stampAwk='
+  BEGIN {
+    split("Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec", names, " ")
+    for (i = 1; i <= 12; i++) months[names[i]] = i
+  }
+  function stampOf(   m) {
+    m = months[$1]
+    return sprintf("%04d%02d%02d%s%s%s", m > month + 0 ? year - 1 : year, m, $2, substr($3, 1, 2), substr($3, 4, 2), substr($3, 7, 2))
+  }'
+
+fingerprint() {
+  # Checksum of the first bytes of a log
+  # ${1}: log, ${2}: bytes read from it so far
+  local length=$(( ${2} < fingerprintBytes ? ${2} : fingerprintBytes ))
+  head -c "${length}" "${1}" 2> /dev/null | cksum | tr ' ' ':'
+}
+
+isIngested() {
+  # Whether a log is the one the state describes, read up to ${offset}
+  # ${1}: log, ${2}: its inode, or empty when it may be a copy
+  local inode size
+  read -r inode size < <(stat -c '%i %s' "${1}" 2> /dev/null)
+  [[ -n "${size}" ]] && [[ "${size}" -ge "${offset}" ]] || return 1
+  [[ -z "${2}" ]] || [[ "${inode}" == "${2}" ]] || return 1
+  [[ "$(fingerprint "${1}" "${offset}")" == "${savedFingerprint}" ]]
+}
+
+ingestRange() {
+  # Roll up the complete lines of a log between two offsets, prints up to where they go
+  # ${1}: log, ${2}: offset to start at, ${3}: offset to stop at
+  # Offsets are in bytes, so length() has to count bytes as well, not the characters of a locale
+  tail -c +$(( ${2} + 1 )) "${1}" | head -c $(( ${3} - ${2} )) | LC_ALL=C awk -v dir="${rollupDir}" \
+    -v size=$(( ${3} - ${2} )) -v year="$(date +%Y)" -v month="$(date +%m)" \
+    -v addresses="${IPV4_ADDRESS%/*} ${IPV6_ADDRESS%/*}" "${stampAwk}"'
+    BEGIN {
+      n = split(addresses, address, " ")
+      for (i = 1; i <= n; i++) blockingAddress[address[i]]
+    }
+    # Append the counts of the minute to the file of its hour
+    function flush(   key) {
+      if (minute == "") return
+      if (substr(minute, 1, 10) != hour) {
+        if (hour != "") close(file)
+        hour = substr(minute, 1, 10)
+        file = dir "/" hour
+      }
+      printf "%s\tt\t-\t%d\t%d\t%d\t%d\n", minute, queries, blocked, forwarded, cached >> file
+      for (key in clientQueries) printf "%s\tc\t%s\t%d\t%d\n", minute, key, clientQueries[key], clientBlocked[key] >> file
+      for (key in clientBlocked) if (!(key in clientQueries)) printf "%s\tc\t%s\t0\t%d\n", minute, key, clientBlocked[key] >> file
+      for (key in domainQueries) printf "%s\td\t%s\t%d\t%d\n", minute, key, domainQueries[key], domainBlocked[key] >> file
+      for (key in domainBlocked) if (!(key in domainQueries)) printf "%s\td\t%s\t0\t%d\n", minute, key, domainBlocked[key] >> file
+      delete clientQueries; delete clientBlocked; delete domainQueries; delete domainBlocked
+      queries = blocked = forwarded = cached = 0
+    }
+    {
+      # A line still being written at the end is left for the next run
+      if (read + length($0) + 1 > size + 0) exit
+      read += length($0) + 1
+      # Lines start with the time as "Mmm dd HH:MM:SS", the minute changes rarely
+      if (substr($0, 1, 12) != prefix) {
+        if (!($1 in months)) next
+        prefix = substr($0, 1, 12)
+        flush()
+        minute = substr(stampOf(), 1, 12)
+      }
+    }
+    substr($5, 1, 6) == "query[" {
+      domain = tolower($6)
+      queries++
+      clientQueries[$8]++
+      domainQueries[domain]++
+      lastClient[domain] = $8
+      next
+    }
+    $5 == "forwarded" { forwarded++; next }
+    $5 == "cached" { cached++ }
+    # Answered from the block lists, or by a wildcard with the address of the Pi-hole.
+    # Local records of the dnsmasq config (host-record, address=) are answered by "config" as well
+    $5 == "/etc/pihole/gravity.list" || $5 == "/etc/pihole/black.list" || ($5 == "config" && ($8 in blockingAddress)) {
+      domain = tolower($6)
+      blocked++
+      domainBlocked[domain]++
+      if (domain in lastClient) clientBlocked[lastClient[domain]]++
+    }
+    # The query is answered, the answer may be logged in the minute after it
+    $7 == "is" { delete lastClient[tolower($6)] }
+    END {
+      flush()
+      print read + 0
+    }'
+}
+
+ingestFunc() {
+  local savedInode offset savedFingerprint inode size consumed
+  mkdir -p "${rollupDir}"
+  # Blocked domains are answered with the addresses of the Pi-hole
+  if [[ -f "${setupVars}" ]]; then
+    source "${setupVars}"
+  fi
+  exec 9> "${lockFile}"
+  if ! flock -n 9; then
+    [[ "${quiet}" == true ]] || echo "::: The log is already being ingested"
+    return 0
+  fi
+
+  read -r savedInode offset savedFingerprint 2> /dev/null < "${stateFile}"
+  offset=${offset:-0}
+  read -r inode size < <(stat -c '%i %s' "${logFile}" 2> /dev/null)
+  if [[ -z "${size}" ]]; then
+    [[ "${quiet}" == true ]] || echo "::: ${logFile} does not exist"
+    return 0
+  fi
+
+  if [[ "${offset}" -gt 0 ]] && ! isIngested "${logFile}" "${savedInode}"; then
+    # Rotated since the last run, copytruncate left the rest of it in pihole.log.1
+    if isIngested "${logFile}.1" ""; then
+      ingestRange "${logFile}.1" "${offset}" "$(stat -c %s "${logFile}.1")" > /dev/null
+    fi
+    offset=0
+  fi
+  consumed=$(ingestRange "${logFile}" "${offset}" "${size}")
+  offset=$(( offset + consumed ))
+
+  echo "${inode} ${offset} $(fingerprint "${logFile}" "${offset}")" > "${stateFile}.tmp"
+  mv "${stateFile}.tmp" "${stateFile}"
+  summariseFunc
+  pruneFunc
+}
+
+sumRollups() {
+  # Sum rollups up under one hour or day, adding to what the sum already holds
+  # ${1}: YYYYMMDDHH or YYYYMMDD, ${2}: the sum, remaining arguments: the rollups
+  local time="${1}" sum="${2}" previous=()
+  shift 2
+  if [[ -f "${sum}" ]]; then
+    previous=("${sum}")
+  fi
+  awk -F '\t' -v time="${time}" '
+    $2 == "t" { queries += $4; blocked += $5; forwarded += $6; cached += $7; next }
+    { count[$2 "\t" $3] += $4; blockedCount[$2 "\t" $3] += $5 }
+    END {
+      printf "%s\tt\t-\t%d\t%d\t%d\t%d\n", time, queries, blocked, forwarded, cached
+      for (key in count) printf "%s\t%s\t%d\t%d\n", time, key, count[key], blockedCount[key]
+    }' "${previous[@]}" "$@" > "${sum}.tmp"
+  mv "${sum}.tmp" "${sum}"
+  rm -f "$@"
+}
+
+summariseFunc() {
+  # Sum up the minutes of every hour that is over, and the hours of every day that is over.
+  # Lines ingested late for either are added to the sum
+  local current rollup day
+  local -A days=()
+  current=$(date +%Y%m%d%H)
+  for rollup in "${rollupDir}"/[0-9]*[0-9]; do
+    if [[ -f "${rollup}" ]] && [[ "${rollup##*/}" < "${current}" ]]; then
+      sumRollups "${rollup##*/}" "${rollup}.hour" "${rollup}"
+    fi
+  done
+  for rollup in "${rollupDir}"/[0-9]*.hour; do
+    day="${rollup##*/}"
+    day="${day:0:8}"
+    if [[ -f "${rollup}" ]] && [[ "${day}" < "${current:0:8}" ]]; then
+      days["${day}"]=1
+    fi
+  done
+  for day in "${!days[@]}"; do
+    sumRollups "${day}" "${rollupDir}/${day}.day" "${rollupDir}/${day}"[0-9][0-9].hour
+  done
+}
+
+pruneFunc() {
+  # Remove the days older than keepDays
+  local oldest rollup
+  oldest=$(date -d "-${keepDays} days" +%Y%m%d)
+  for rollup in "${rollupDir}"/[0-9]*; do
+    if [[ -f "${rollup}" ]] && [[ "${rollup##*/}" < "${oldest}" ]]; then
+      rm -f "${rollup}"
+    fi
+  done
+}
+
+archiveFunc() {
+  # Compress a log into an archive of independently compressed blocks and index them
+  # ${1}: log, ${2}: archive
+  local archive="${2}"
+  rm -f "${archive}.tmp" "${archive}.idx.tmp"
+  awk -v archive="${archive}.tmp" -v idx="${archive}.idx.tmp" -v lines="${blockLines}" \
+    -v year="$(date +%Y)" -v month="$(date +%m)" "${stampAwk}"'
+    # Every block is a gzip member of its own, the archive is a valid gzip file as a whole
+    function endBlock(   size, command) {
+      if (!count) return
+      close(compress)
+      command = "stat -c %s \"" archive "\""
+      command | getline size
+      close(command)
+      printf "b\t%d\t%d\t%s\t%s\n", start, size - start, first, last > idx
+      start = size
+      count = 0
+      first = last = "-"
+      block++
+    }
+    BEGIN {
+      compress = "gzip -c >> \"" archive "\""
+      first = last = "-"
+      block = 0
+    }
+    {
+      print | compress
+      if ($1 in months) {
+        if (substr($0, 1, 15) != prefix) {
+          prefix = substr($0, 1, 15)
+          stamp = stampOf()
+        }
+        if (first == "-") first = stamp
+        last = stamp
+      }
+      if (substr($5, 1, 6) == "query[") {
+        domain = tolower($6)
+        if (domainBlock[domain] != block + 1) {
+          domains[domain] = domains[domain] "," block
+          domainBlock[domain] = block + 1
+        }
+        if (clientBlock[$8] != block + 1) {
+          clients[$8] = clients[$8] "," block
+          clientBlock[$8] = block + 1
+        }
+      }
+      if (++count == lines) endBlock()
+    }
+    END {
+      endBlock()
+      for (domain in domains) printf "d\t%s\t%s\n", domain, substr(domains[domain], 2) > idx
+      for (client in clients) printf "c\t%s\t%s\n", client, substr(clients[client], 2) > idx
+    }' "${1}" || return 1
+  touch "${archive}.tmp" "${archive}.idx.tmp"
+  mv "${archive}.tmp" "${archive}"
+  mv "${archive}.idx.tmp" "${archive}.idx"
+}
+
+spans() {
+  # Whether the first and last line of a log leave room for lines from ${2} to ${3}
+  { head -n 1 "${1}"; tail -n 1 "${1}"; } | awk -v from="${2}" -v to="${3}" \
+    -v year="$(date +%Y)" -v month="$(date +%m)" "${stampAwk}"'
+    !($1 in months) { unknown = 1; exit }
+    NR == 1 { first = stampOf() }
+    { last = stampOf() }
+    END { exit !unknown && (first > to || last < from) }'
+}
+
+searchFunc() {
+  # Print the lines logged from ${1} to ${2}, both YYYYMMDDHHMM
+  # Only queries of client ${3} and domain ${4} and their answers, when given
+  local from="${1}00" to="${2}59" client="${3}" domain="${4,,}" log i logs=()
+  for (( i = keepLogs; i > 1; i-- )); do
+    logs+=("${logFile}.${i}.gz")
+  done
+  for log in "${logs[@]}" "${logFile}.1" "${logFile}"; do
+    [[ -f "${log}" ]] || continue
+    if [[ "${log}" != *.gz ]] && ! spans "${log}" "${from}" "${to}"; then
+      continue
+    fi
+    if [[ -f "${log}.idx" ]]; then
+      # Only the blocks that can hold matching lines are decompressed
+      awk -F '\t' -v from="${from}" -v to="${to}" -v client="${client}" -v domain="${domain}" \
+        -v archive="${log##*/}" -v quiet="${quiet}" '
+        BEGIN { blocks = 0 }
+        $1 == "b" {
+          if ($4 != "-" && $4 <= to && $5 >= from) {
+            candidate[blocks] = 1
+            span[blocks] = $2 " " $3
+          }
+          blocks++
+          next
+        }
+        ($1 == "c" && $2 == client) || ($1 == "d" && $2 == domain) {
+          n = split($3, ids, ",")
+          for (i = 1; i <= n; i++) match_[$1, ids[i]] = 1
+        }
+        END {
+          for (i = 0; i < blocks; i++) {
+            if (candidate[i] && (client == "" || match_["c", i]) && (domain == "" || match_["d", i])) {
+              print span[i]
+              read++
+            }
+          }
+          if (quiet != "true") printf "::: %s: %d of %d blocks read\n", archive, read, blocks > "/dev/stderr"
+        }' "${log}.idx" | while read -r offset length; do
+          tail -c +$(( offset + 1 )) "${log}" | head -c "${length}" | gzip -dc
+        done
+    elif [[ "${log}" == *.gz ]]; then
+      gzip -dc "${log}"
+    else
+      cat "${log}"
+    fi | awk -v from="${from}" -v to="${to}" -v client="${client}" -v domain="${domain}" \
+      -v year="$(date +%Y)" -v month="$(date +%m)" "${stampAwk}"'
+      !($1 in months) { next }
+      substr($0, 1, 15) != prefix {
+        prefix = substr($0, 1, 15)
+        stamp = stampOf()
+      }
+      stamp < from || stamp > to { next }
+      client == "" && domain == "" { print; next }
+      substr($5, 1, 6) == "query[" {
+        name = tolower($6)
+        asker[name] = $8
+        if ((client == "" || $8 == client) && (domain == "" || name == domain)) print
+        next
+      }
+      # The answers to the queries shown
+      (domain == "" || tolower($6) == domain) && (client == "" || asker[tolower($6)] == client)'
+  done
+}
+
+minuteOf() {
+  # Turn YYYY-MM-DD [HH[:MM]] into YYYYMMDDHHMM, the missing part is taken from ${2}
+  local digits="${1//[^0-9]/}"
+  if [[ "${#digits}" -lt 8 ]] || [[ "${#digits}" -gt 12 ]] || [[ $(( ${#digits} % 2 )) -ne 0 ]]; then
+    echo "::: Invalid time ${1}, please use YYYY-MM-DD [HH[:MM]]" >&2
+    return 1
+  fi
+  echo "${digits}${2:${#digits}}"
+}
+
+reportFunc() {
+  # Summarise the minutes from ${1} to ${2}, both YYYYMMDDHHMM
+  local from="${1}" to="${2}" rollup name first last rollups=()
+  for rollup in "${rollupDir}"/[0-9]*; do
+    name="${rollup##*/}"
+    # Hours and days that are over only have their sum, they count in full when the range touches them
+    case "${name}" in
+      *[0-9] | *.hour ) first="${name:0:10}00"; last="${name:0:10}59";;
+      *.day           ) first="${name:0:8}0000"; last="${name:0:8}2359";;
+      *               ) continue;;
+    esac
+    if [[ -f "${rollup}" ]] && [[ ! "${last}" < "${from}" ]] && [[ ! "${first}" > "${to}" ]]; then
+      rollups+=("${rollup}")
+    fi
+  done
+
+  echo "::: Queries from ${from:0:4}-${from:4:2}-${from:6:2} ${from:8:2}:${from:10:2} to ${to:0:4}-${to:4:2}-${to:6:2} ${to:8:2}:${to:10:2}"
+  if [[ "${#rollups[@]}" -eq 0 ]]; then
+    echo ":::     No queries were logged"
+    return 0
+  fi
+  awk -F '\t' -v from="${from}" -v to="${to}" '
+    length($1) == 12 && ($1 < from || $1 > to) { next }
+    $2 == "t" { queries += $4; blocked += $5; forwarded += $6; cached += $7; next }
+    { count[$2, $3] += $4; blockedCount[$2, $3] += $5 }
+    END {
+      printf "0\t%d\t%d\t%d\t%d\n", queries, blocked, forwarded, cached
+      for (key in count) {
+        split(key, part, SUBSEP)
+        if (part[1] == "d") {
+          printf "1\t%d\t%s\n", count[key], part[2]
+          if (blockedCount[key]) printf "2\t%d\t%s\n", blockedCount[key], part[2]
+        } else {
+          printf "3\t%d\t%s\n", count[key], part[2]
+        }
+      }
+    }' "${rollups[@]}" | LC_ALL=C sort -t $'\t' -k1,1 -k2,2nr -k3,3 | awk -F '\t' -v top="${topCount}" '
+    # Sections are numbered in the order they are shown: totals, domains, blocked domains, clients
+    $1 == 0 {
+      printf ":::     Total queries: %d\n", $2
+      printf ":::     Blocked:       %d (%.1f%%)\n", $3, $2 ? $3 * 100 / $2 : 0
+      printf ":::     Forwarded:     %d\n", $4
+      printf ":::     Cached:        %d\n", $5
+      next
+    }
+    $1 != section {
+      section = $1
+      shown = 0
+      print (section == 1 ? "::: Top domains" : section == 2 ? "::: Top blocked domains" : "::: Top clients")
+    }
+    shown++ < top { printf ":::     %8d %s\n", $2, $3 }'
+}
+
+helpFunc() {
+  echo "Usage: pihole querylog [options] [from [to]]
+Example: 'pihole querylog 2017-06-17', or 'pihole querylog \"2017-06-17 10:00\" \"2017-06-17 12:30\"'
+Summarise the queries in ${logFile} from rollups
+
+Times are given as YYYY-MM-DD [HH[:MM]], from defaults to an hour ago and to to now.
+Queries of the current hour are counted by the minute, those of earlier hours
+of today by the hour and those of earlier days by the day
+
+Options:
+  -i, --ingest        Only roll up what was logged since the last run
+  -n, --top <count>   Number of domains and clients to list (default ${topCount})
+  -s, --search        Print the lines logged in the time range instead, from the
+                        rotated logs as well
+  -c, --client <ip>   Only search for the queries of a client and their answers
+  -d, --domain <name> Only search for the queries of a domain and their answers
+  --archive <log> <archive>
+                      Compress a rotated log into an indexed archive
+  -q, --quiet         Make output less verbose
+  -h, --help          Show this help dialog"
+  exit 0
+}
+
+# Sourcing the script only provides its functions
+if [[ "${BASH_SOURCE[0]}" != "${0}" ]]; then
+  return 0
+fi
+
+ingestOnly=false
+search=false
+client=""
+domain=""
+range=()
+while [[ $# -gt 0 ]]; do
+  case "${1}" in
+    "-i" | "--ingest" ) ingestOnly=true;;
+    "-n" | "--top"    ) topCount="${2}"; shift;;
+    "-s" | "--search" ) search=true;;
+    "-c" | "--client" ) client="${2}"; search=true; shift;;
+    "-d" | "--domain" ) domain="${2}"; search=true; shift;;
+    "--archive"       ) archiveFunc "${2}" "${3}"; exit $?;;
+    "-q" | "--quiet"  ) quiet=true;;
+    "-h" | "--help"   ) helpFunc;;
+    *                 ) range+=("${1}");;
+  esac
+  shift
+done
+
+from=$(minuteOf "${range[0]:-$(date -d '-1 hour' '+%F %H:%M')}" "000000000000") || exit 1
+to=$(minuteOf "${range[1]:-$(date '+%F %H:%M')}" "000000002359") || exit 1
+if [[ "${search}" == true ]]; then
+  searchFunc "${from}" "${to}" "${client}" "${domain}"
+  exit 0
+fi
+ingestFunc
+if [[ "${ingestOnly}" == true ]]; then
+  exit 0
+fi
+reportFunc "${from}" "${to}"
@@ -52,17 +52,18 @@ GitCheckUpdateAvail() {
   # defaults to the current one.
   REMOTE="$(git rev-parse "@{upstream}")"
 
+  # Errors return 2, checkResult stops the update on them
   if [[ ${#LOCAL} == 0 ]]; then
     echo "::: Error: Local revision could not be obtained, ask Pi-hole support."
     echo "::: Additional debugging output:"
     git status
-    exit
+    return 2
   fi
   if [[ ${#REMOTE} == 0 ]]; then
     echo "::: Error: Remote revision could not be obtained, ask Pi-hole support."
     echo "::: Additional debugging output:"
     git status
-    exit
+    return 2
   fi
 
   # Change back to original directory
@@ -93,9 +94,26 @@ FTLcheckUpdate() {
 	fi
 }
 
+checkResult() {
+  # Wait for the check running as ${1}, show what it printed to ${2} and
+  # return its result. Checks that failed end the update.
+  local status
+  status=0
+  wait "${1}" || status=$?
+  cat "${2}"
+  if [[ "${status}" -gt 1 ]]; then
+    exit 1
+  fi
+  return "${status}"
+}
+
 main() {
   local pihole_version_current
   local web_version_current
+  local checkDir
+  local corePid
+  local FTLpid
+  local webPid
   #shellcheck disable=1090,2154
   source "${setupVars}"
 
@@ -108,7 +126,19 @@ main() {
 
   echo "::: Checking for updates..."
 
-  if GitCheckUpdateAvail "${PI_HOLE_FILES_DIR}" ; then
+  # Each check waits on the network, so they all run at the same time
+  checkDir=$(mktemp -d)
+  trap 'rm -rf "${checkDir}"' EXIT
+  GitCheckUpdateAvail "${PI_HOLE_FILES_DIR}" > "${checkDir}/core" 2>&1 &
+  corePid=$!
+  FTLcheckUpdate > "${checkDir}/FTL" 2>&1 &
+  FTLpid=$!
+  if [[ ${INSTALL_WEB} == true ]] && is_repo "${ADMIN_INTERFACE_DIR}" ; then
+    GitCheckUpdateAvail "${ADMIN_INTERFACE_DIR}" > "${checkDir}/web" 2>&1 &
+    webPid=$!
+  fi
+
+  if checkResult "${corePid}" "${checkDir}/core" ; then
     core_update=true
     echo "::: Pi-hole Core:   update available"
   else
@@ -116,7 +146,7 @@ main() {
     echo "::: Pi-hole Core:   up to date"
   fi
 
-  if FTLcheckUpdate ; then
+  if checkResult "${FTLpid}" "${checkDir}/FTL" ; then
     FTL_update=true
     echo "::: FTL:            update available"
   else
@@ -141,7 +171,7 @@ main() {
       exit 1;
     fi
 
-    if GitCheckUpdateAvail "${ADMIN_INTERFACE_DIR}" ; then
+    if checkResult "${webPid}" "${checkDir}/web" ; then
       web_update=true
       echo "::: Web Interface:  update available"
     else
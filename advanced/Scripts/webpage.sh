@@ -13,6 +13,17 @@ readonly dnsmasqconfig="/etc/dnsmasq.d/01-pihole.conf"
 readonly dhcpconfig="/etc/dnsmasq.d/02-pihole-dhcp.conf"
 # 03 -> wildcards
 readonly dhcpstaticconfig="/etc/dnsmasq.d/04-pihole-static-dhcp.conf"
+readonly adlists="/etc/pihole/adlists.list"
+
+# Settings are changed in memory and in a copy of the files, CommitSettings writes them once
+stageDir=""
+setupVarsLines=()
+# Keys LoadSetupVars has set, the actions of a batch all run in this shell
+setupVarsKeys=()
+dnsmasqLines=()
+dnsmasqSettings=""
+restartWanted=false
+restartForced=false
 
 helpFunc() {
   echo "Usage: pihole -a [options]
@@ -27,16 +38,120 @@ Options:
   -k, kelvin          Set Kelvin as preferred temperature unit
   -h, --help          Show this help dialog
   -i, interface       Specify dnsmasq's interface listening behavior
-                        Add '-h' for more info on interface usage" 
+                        Add '-h' for more info on interface usage
+  batch               Apply the settings read from stdin at once, one option
+                        with its arguments per line (e.g. 'setdns 8.8.8.8'),
+                        writing every file once and restarting dnsmasq at
+                        most once. Nothing is changed when one of them fails.
+                        Arguments are split at spaces and can not be quoted" 
 	exit 0
 }
 
+DnsmasqSettings() {
+	# The lines of the Pi-hole dnsmasq config files that set something
+	cat "${dnsmasqconfig}" "${dhcpconfig}" "${dhcpstaticconfig}" 2> /dev/null | grep -v -e '^[[:space:]]*#' -e '^[[:space:]]*$' || true
+}
+
+StagedFile() {
+	# Where the new version of ${1} is kept until CommitSettings
+	echo "${stageDir}/${1##*/}"
+}
+
+LoadSettings() {
+	# Read setupVars.conf and 01-pihole.conf once, and copy the other files settings are written to
+	local file
+	stageDir=$(mktemp -d)
+	for file in "${setupVars}" "${dnsmasqconfig}" "${dhcpconfig}" "${dhcpstaticconfig}" "${adlists}"; do
+		if [[ -e "${file}" ]]; then
+			cp -p "${file}" "$(StagedFile "${file}")"
+		fi
+	done
+	setupVarsLines=()
+	if [[ -e "${setupVars}" ]]; then
+		mapfile -t setupVarsLines < "${setupVars}"
+	fi
+	dnsmasqLines=()
+	if [[ -e "${dnsmasqconfig}" ]]; then
+		mapfile -t dnsmasqLines < "${dnsmasqconfig}"
+	fi
+	dnsmasqSettings=$(DnsmasqSettings)
+	restartWanted=false
+	restartForced=false
+}
+
+LoadSetupVars() {
+	# Source the settings as they are now, not as they were written.
+	# What an earlier action removed (e.g. PIHOLE_DNS_3) must not be left set
+	local line key
+	for key in "${setupVarsKeys[@]}"; do
+		unset "${key}"
+	done
+	setupVarsKeys=()
+	for line in "${setupVarsLines[@]}"; do
+		key=${line%%=*}
+		if [[ "${line}" == *=* ]] && [[ "${key}" =~ ^[A-Za-z_][A-Za-z0-9_]*$ ]]; then
+			setupVarsKeys+=("${key}")
+		fi
+	done
+	source <(printf "%s\n" "${setupVarsLines[@]}")
+}
+
+WriteLines() {
+	# ${1}: file, remaining arguments: its lines
+	local file="${1}"
+	shift
+	if [[ "$#" -gt 0 ]]; then
+		printf "%s\n" "$@" > "${file}"
+	else
+		: > "${file}"
+	fi
+}
+
+CommitFile() {
+	# Move the staged version of ${1} into place when it differs, or remove ${1} when it was removed
+	local staged
+	staged=$(StagedFile "${1}")
+	if [[ ! -e "${staged}" ]]; then
+		if [[ -e "${1}" ]]; then
+			rm "${1}"
+		fi
+	elif ! cmp -s "${staged}" "${1}"; then
+		cp -p "${staged}" "${1}.tmp"
+		mv "${1}.tmp" "${1}"
+	fi
+}
+
+CommitSettings() {
+	# Write every file that changed once, and restart dnsmasq when its configuration changed
+	local file
+	if [[ -e "$(StagedFile "${setupVars}")" ]] || [[ "${#setupVarsLines[@]}" -gt 0 ]]; then
+		WriteLines "$(StagedFile "${setupVars}")" "${setupVarsLines[@]}"
+	fi
+	if [[ -e "$(StagedFile "${dnsmasqconfig}")" ]] || [[ "${#dnsmasqLines[@]}" -gt 0 ]]; then
+		WriteLines "$(StagedFile "${dnsmasqconfig}")" "${dnsmasqLines[@]}"
+	fi
+	for file in "${setupVars}" "${dnsmasqconfig}" "${dhcpconfig}" "${dhcpstaticconfig}" "${adlists}"; do
+		CommitFile "${file}"
+	done
+	rm -rf "${stageDir}"
+	if [[ "${restartForced}" == true ]] || { [[ "${restartWanted}" == true ]] && [[ "$(DnsmasqSettings)" != "${dnsmasqSettings}" ]]; }; then
+		RestartDNSNow
+	fi
+}
+
 add_setting() {
-	echo "${1}=${2}" >> "${setupVars}"
+	setupVarsLines+=("${1}=${2}")
 }
 
 delete_setting() {
-	sed -i "/${1}/d" "${setupVars}"
+	# Every line starting with ${1}, so keys that merely contain it are kept
+	local line kept=()
+	for line in "${setupVarsLines[@]}"; do
+		if [[ "${line}" != "${1}"* ]]; then
+			kept+=("${line}")
+		fi
+	done
+	setupVarsLines=("${kept[@]}")
 }
 
 change_setting() {
@@ -46,14 +161,21 @@ change_setting() {
 
 add_dnsmasq_setting() {
 	if [[ "${2}" != "" ]]; then
-		echo "${1}=${2}" >> "${dnsmasqconfig}"
+		dnsmasqLines+=("${1}=${2}")
 	else
-		echo "${1}" >> "${dnsmasqconfig}"
+		dnsmasqLines+=("${1}")
 	fi
 }
 
 delete_dnsmasq_setting() {
-	sed -i "/${1}/d" "${dnsmasqconfig}"
+	# Every line starting with ${1}
+	local line kept=()
+	for line in "${dnsmasqLines[@]}"; do
+		if [[ "${line}" != "${1}"* ]]; then
+			kept+=("${line}")
+		fi
+	done
+	dnsmasqLines=("${kept[@]}")
 }
 
 SetTemperatureUnit() {
@@ -90,7 +212,7 @@ SetWebPassword() {
     if [ "${PASSWORD}" == "" ]; then
       change_setting "WEBPASSWORD" ""
       echo "Password Removed"
-      exit 0
+      return
     fi
 
     read -s -p "Confirm Password: " CONFIRM
@@ -109,7 +231,7 @@ SetWebPassword() {
 }
 
 ProcessDNSSettings() {
-	source "${setupVars}"
+	LoadSetupVars
 
 	delete_dnsmasq_setting "server"
 
@@ -139,9 +261,7 @@ ProcessDNSSettings() {
 	delete_dnsmasq_setting "trust-anchor="
 
 	if [[ "${DNSSEC}" == true ]]; then
-		echo "dnssec
-trust-anchor=.,19036,8,2,49AAC11D7B6F6446702E54A1607371607A1A41855200FD2CE1CDDE32F24E8FB5
-" >> "${dnsmasqconfig}"
+		dnsmasqLines+=("dnssec" "trust-anchor=.,19036,8,2,49AAC11D7B6F6446702E54A1607371607A1A41855200FD2CE1CDDE32F24E8FB5")
 	fi
 
 	delete_dnsmasq_setting "host-record"
@@ -152,6 +272,7 @@ trust-anchor=.,19036,8,2,49AAC11D7B6F6446702E54A1607371607A1A41855200FD2CE1CDDE3
 
 	# Setup interface listening behavior of dnsmasq
 	delete_dnsmasq_setting "interface"
+	delete_dnsmasq_setting "except-interface"
 	delete_dnsmasq_setting "local-service"
 
 	if [[ "${DNSMASQ_LISTENING}" == "all" ]]; then
@@ -213,6 +334,11 @@ Reboot() {
 }
 
 RestartDNS() {
+	# dnsmasq is restarted once all settings are written, if its configuration changed
+	restartWanted=true
+}
+
+RestartDNSNow() {
 	if [ -x "$(command -v systemctl)" ]; then
 		systemctl restart dnsmasq &> /dev/null
 	else
@@ -225,10 +351,12 @@ SetQueryLogOptions() {
 }
 
 ProcessDHCPSettings() {
-	source "${setupVars}"
+	local conf
+	LoadSetupVars
+	conf=$(StagedFile "${dhcpconfig}")
 
 	if [[ "${DHCP_ACTIVE}" == "true" ]]; then
-    interface=$(grep 'PIHOLE_INTERFACE=' /etc/pihole/setupVars.conf | sed "s/.*=//")
+    interface="${PIHOLE_INTERFACE}"
 
     # Use eth0 as fallback interface
     if [ -z ${interface} ]; then
@@ -259,10 +387,10 @@ dhcp-range=${DHCP_START},${DHCP_END},${leasetime}
 dhcp-option=option:router,${DHCP_ROUTER}
 dhcp-leasefile=/etc/pihole/dhcp.leases
 #quiet-dhcp
-" > "${dhcpconfig}"
+" > "${conf}"
 
   if [[ "${PIHOLE_DOMAIN}" != "none" ]]; then
-    echo "domain=${PIHOLE_DOMAIN}" >> "${dhcpconfig}"
+    echo "domain=${PIHOLE_DOMAIN}" >> "${conf}"
   fi
 
     if [[ "${DHCP_IPv6}" == "true" ]]; then
@@ -271,11 +399,11 @@ dhcp-leasefile=/etc/pihole/dhcp.leases
 dhcp-option=option6:dns-server,[::]
 dhcp-range=::100,::1ff,constructor:${interface},ra-names,slaac,${leasetime}
 ra-param=*,0,0
-" >> "${dhcpconfig}"
+" >> "${conf}"
     fi
 
 	else
-		rm "${dhcpconfig}" &> /dev/null
+		rm "${conf}" &> /dev/null
 	fi
 }
 
@@ -314,7 +442,7 @@ SetWebUILayout() {
 }
 
 CustomizeAdLists() {
-  list="/etc/pihole/adlists.list"
+  list=$(StagedFile "${adlists}")
 
 	if [[ "${args[2]}" == "enable" ]]; then
 		sed -i "\\@${args[3]}@s/^#http/http/g" "${list}"
@@ -351,25 +479,29 @@ ResolutionSettings() {
 }
 
 AddDHCPStaticAddress() {
+	local conf
+	conf=$(StagedFile "${dhcpstaticconfig}")
 	mac="${args[2]}"
 	ip="${args[3]}"
 	host="${args[4]}"
 
 	if [[ "${ip}" == "noip" ]]; then
 		# Static host name
-		echo "dhcp-host=${mac},${host}" >> "${dhcpstaticconfig}"
+		echo "dhcp-host=${mac},${host}" >> "${conf}"
 	elif [[ "${host}" == "nohost" ]]; then
 		# Static IP
-		echo "dhcp-host=${mac},${ip}" >> "${dhcpstaticconfig}"
+		echo "dhcp-host=${mac},${ip}" >> "${conf}"
 	else
 		# Full info given
-		echo "dhcp-host=${mac},${ip},${host}" >> "${dhcpstaticconfig}"
+		echo "dhcp-host=${mac},${ip},${host}" >> "${conf}"
 	fi
 }
 
 RemoveDHCPStaticAddress() {
+	local conf
+	conf=$(StagedFile "${dhcpstaticconfig}")
 	mac="${args[2]}"
-	sed -i "/dhcp-host=${mac}.*/d" "${dhcpstaticconfig}"
+	sed -i "/dhcp-host=${mac}.*/d" "${conf}"
 }
 
 SetHostRecord() {
@@ -388,7 +520,7 @@ SetHostRecord() {
 }
 
 SetListeningMode() {
-	source "${setupVars}"
+	LoadSetupVars
   
   if [[ "$3" == "-h" ]] || [[ "$3" == "--help" ]]; then
     echo "Usage: pihole -a -i [interface]
@@ -428,9 +560,7 @@ Teleporter() {
 	php /var/www/html/admin/scripts/pi-hole/php/teleporter.php > "pi-hole-teleporter_${datetimestamp}.zip"
 }
 
-main() {
-	args=("$@")
-
+RunAction() {
 	case "${args[1]}" in
 		"-p" | "password"   ) SetWebPassword;;
 		"-c" | "celsius"    ) unit="C"; SetTemperatureUnit;;
@@ -440,7 +570,7 @@ main() {
 		"setexcludedomains" ) SetExcludeDomains;;
 		"setexcludeclients" ) SetExcludeClients;;
 		"reboot"            ) Reboot;;
-		"restartdns"        ) RestartDNS;;
+		"restartdns"        ) restartForced=true;;
 		"setquerylog"       ) SetQueryLogOptions;;
 		"enabledhcp"        ) EnableDHCP;;
 		"disabledhcp"       ) DisableDHCP;;
@@ -451,11 +581,53 @@ main() {
 		"addstaticdhcp"     ) AddDHCPStaticAddress;;
 		"removestaticdhcp"  ) RemoveDHCPStaticAddress;;
 		"hostrecord"        ) SetHostRecord;;
-		"-i" | "interface"  ) SetListeningMode "$@";;
+		"-i" | "interface"  ) SetListeningMode "${args[@]}";;
 		"-t" | "teleporter" ) Teleporter;;
 		"adlist"            ) CustomizeAdLists;;
+		"batch"             ) Batch;;
 		*                   ) helpFunc;;
 	esac
+}
+
+Batch() {
+	# Check every line before any of them is applied
+	local line action actions=()
+	while IFS= read -r line || [[ -n "${line}" ]]; do
+		read -r -a action <<< "${line}"
+		if [[ "${#action[@]}" -eq 0 ]] || [[ "${action[0]}" == "#"* ]]; then
+			continue
+		fi
+		# Lines are split at every space, quoting would not keep an argument together
+		if [[ "${line}" == *[\"\'\\]* ]]; then
+			echo "::: '${line}' has quotes, arguments with spaces can not be used in a batch, nothing was changed"
+			exit 1
+		fi
+		case "${action[0]}" in
+			"-c" | "celsius" | "-f" | "fahrenheit" | "-k" | "kelvin" | "setdns" | "setexcludedomains" | \
+			"setexcludeclients" | "restartdns" | "setquerylog" | "enabledhcp" | "disabledhcp" | "layout" | \
+			"privacymode" | "resolve" | "addstaticdhcp" | "removestaticdhcp" | "hostrecord" | "-i" | \
+			"interface" | "adlist" ) actions+=("${line}");;
+			* ) echo "::: ${action[0]} can not be used in a batch, nothing was changed"
+			    exit 1;;
+		esac
+	done
+	for line in "${actions[@]}"; do
+		read -r -a action <<< "${line}"
+		args=("-a" "${action[@]}")
+		if ! RunAction; then
+			echo "::: '${line}' failed, nothing was changed"
+			exit 1
+		fi
+	done
+}
+
+main() {
+	args=("$@")
+
+	LoadSettings
+	trap 'rm -rf "${stageDir}"' EXIT
+	RunAction
+	CommitSettings
 
 	shift
 
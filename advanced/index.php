@@ -9,6 +9,189 @@ function validIP($address){
 	return !filter_var($address, FILTER_VALIDATE_IP) === false;
 }
 
+// Values kept between requests: in APCu when it is there, else in a file of the
+// web server's own, so the page does not parse or run anything it did last time
+function cacheFetch($key)
+{
+	if (function_exists("apcu_fetch"))
+	{
+		return apcu_fetch($key);
+	}
+	$file = sys_get_temp_dir()."/".$key.".cache";
+	// Only trust files this process wrote itself
+	if (!function_exists("posix_geteuid") || @fileowner($file) !== posix_geteuid())
+	{
+		return false;
+	}
+	$value = json_decode(@file_get_contents($file), true);
+	return $value === null ? false : $value;
+}
+
+function cacheStore($key, $value)
+{
+	if (function_exists("apcu_store"))
+	{
+		apcu_store($key, $value);
+		return;
+	}
+	$file = sys_get_temp_dir()."/".$key.".cache";
+	$tmp = @tempnam(sys_get_temp_dir(), $key);
+	if ($tmp !== false && (@file_put_contents($tmp, json_encode($value)) === false || !@rename($tmp, $file)))
+	{
+		@unlink($tmp);
+	}
+}
+
+// Modification times and sizes of files, to tell if what was cached from them is stale
+function fileStamp($files)
+{
+	$stamp = "";
+	foreach ($files as $file)
+	{
+		$stamp .= @filemtime($file)."-".@filesize($file)."/";
+	}
+	return $stamp;
+}
+
+// What the page needs from setupVars.conf and git, cached until one of the
+// files they come from changes
+function blockPageContext()
+{
+	$stamp = fileStamp(array("/etc/pihole/setupVars.conf", "/etc/.pihole/.git/HEAD", "/etc/.pihole/.git/index"));
+	$context = cacheFetch("pihole-blockpage");
+	if ($context !== false && $context["stamp"] === $stamp)
+	{
+		return $context;
+	}
+	$setupVars = parse_ini_file("/etc/pihole/setupVars.conf");
+	$context = array(
+		"stamp" => $stamp,
+		"ipv4" => isset($setupVars["IPV4_ADDRESS"]) ? explode("/", $setupVars["IPV4_ADDRESS"])[0] : null,
+		"ipv6" => isset($setupVars["IPV6_ADDRESS"]) ? explode("/", $setupVars["IPV6_ADDRESS"])[0] : null,
+		"version" => exec('cd /etc/.pihole/ && git describe --tags --abbrev=0'));
+	cacheStore("pihole-blockpage", $context);
+	return $context;
+}
+
+// First complete line at or after an offset
+function indexLineAt($fh, $offset)
+{
+	fseek($fh, $offset > 0 ? $offset - 1 : 0);
+	if ($offset > 0)
+	{
+		fgets($fh);
+	}
+	return fgets($fh);
+}
+
+// Values of the lines of a file sorted on its first (tab separated) column
+// that have key in it, found by a binary search like pihole -q does
+function indexLookup($file, $key)
+{
+	$values = array();
+	$fh = @fopen($file, "r");
+	if ($fh === false)
+	{
+		return $values;
+	}
+	$low = 0;
+	$high = filesize($file);
+	while ($low < $high)
+	{
+		$mid = (int)(($low + $high) / 2);
+		$line = indexLineAt($fh, $mid);
+		if ($line !== false && strcmp(strstr($line, "\t", true), $key) < 0)
+		{
+			$low = $mid + 1;
+		}
+		else
+		{
+			$high = $mid;
+		}
+	}
+	for ($line = indexLineAt($fh, $low); $line !== false; $line = fgets($fh))
+	{
+		// The lines of the gravity index end in the offsets pihole -q prints the lines from
+		$fields = explode("\t", rtrim($line, "\n"), 3);
+		if ($fields[0] !== $key)
+		{
+			break;
+		}
+		$values[] = $fields[1];
+	}
+	fclose($fh);
+	return $values;
+}
+
+// Lists and wildcards that block a domain, answered from the index gravity
+// builds. Null when the index is missing or was built from other lists.
+function blockingLists($domain)
+{
+	$domain = strtolower($domain);
+	$index = "/etc/pihole/gravity.index";
+	$wildcardList = "/etc/dnsmasq.d/03-pihole-wildcard.conf";
+	$stamp = fileStamp(array($index, $index.".sources", $index.".wildcards", $wildcardList, "/etc/pihole/blacklist.txt"));
+	// Domains that are in no list are cached too, pages with many blocked
+	// frames ask for the same few domains over and over. Only in APCu, a file
+	// for each domain would pile up.
+	$cached = function_exists("apcu_fetch") ? apcu_fetch("pihole-blocking-".$domain) : false;
+	if ($cached !== false && $cached["stamp"] === $stamp)
+	{
+		return $cached["lists"];
+	}
+
+	$sources = @file($index.".sources", FILE_IGNORE_NEW_LINES);
+	if ($sources === false)
+	{
+		return null;
+	}
+	$listed = array();
+	foreach ($sources as $source)
+	{
+		$listed[] = strstr($source."\t", "\t", true);
+	}
+	$lists = array_diff(glob("/etc/pihole/list.*"), array("/etc/pihole/list.preEventHorizon"));
+	sort($lists);
+	$indexed = $listed;
+	sort($indexed);
+	if ($lists !== $indexed)
+	{
+		return null;
+	}
+
+	$result = array("lists" => array(), "wildcards" => array());
+	foreach (indexLookup($index, $domain) as $ids)
+	{
+		foreach (explode(",", $ids) as $id)
+		{
+			$result["lists"][] = $listed[$id - 1];
+		}
+	}
+	$blacklist = @file("/etc/pihole/blacklist.txt", FILE_IGNORE_NEW_LINES);
+	if ($blacklist !== false && in_array($domain, array_map("strtolower", $blacklist), true))
+	{
+		$result["lists"][] = "/etc/pihole/blacklist.txt";
+	}
+	// Wildcards, with those gravity promoted from the lists, are indexed by
+	// their labels in reverse order, every parent domain of this one is looked up
+	if (is_file($index.".wildcards") && @filemtime($wildcardList) <= filemtime($index.".wildcards"))
+	{
+		$labels = array_reverse(explode(".", $domain));
+		for ($i = 1; $i <= count($labels); $i++)
+		{
+			if (count(indexLookup($index.".wildcards", implode(".", array_slice($labels, 0, $i)))) > 0)
+			{
+				$result["wildcards"][] = implode(".", array_reverse(array_slice($labels, 0, $i)));
+			}
+		}
+	}
+	if (function_exists("apcu_store"))
+	{
+		apcu_store("pihole-blocking-".$domain, array("stamp" => $stamp, "lists" => $result));
+	}
+	return $result;
+}
+
 $uri = escapeshellcmd($_SERVER['REQUEST_URI']);
 $serverName = escapeshellcmd($_SERVER['SERVER_NAME']);
 
@@ -28,9 +211,9 @@ $uriExt = pathinfo($uri, PATHINFO_EXTENSION);
 $webExt = array('asp', 'htm', 'html', 'php', 'rss', 'xml');
 
 // Get IPv4 and IPv6 addresses from setupVars.conf (if available)
-$setupVars = parse_ini_file("/etc/pihole/setupVars.conf");
-$ipv4 = isset($setupVars["IPV4_ADDRESS"]) ? explode("/", $setupVars["IPV4_ADDRESS"])[0] : $_SERVER['SERVER_ADDR'];
-$ipv6 = isset($setupVars["IPV6_ADDRESS"]) ? explode("/", $setupVars["IPV6_ADDRESS"])[0] : $_SERVER['SERVER_ADDR'];
+$context = blockPageContext();
+$ipv4 = isset($context["ipv4"]) ? $context["ipv4"] : $_SERVER['SERVER_ADDR'];
+$ipv6 = isset($context["ipv6"]) ? $context["ipv6"] : $_SERVER['SERVER_ADDR'];
 
 $AUTHORIZED_HOSTNAMES = array(
 	$ipv4,
@@ -78,7 +261,10 @@ if (!$showPage)
 }
 
 // Get Pi-hole version
-$piHoleVersion = exec('cd /etc/.pihole/ && git describe --tags --abbrev=0');
+$piHoleVersion = $context["version"];
+
+// Lists blocking the domain, without the adlist search the page would run otherwise
+$blocking = blockingLists($serverName);
 
 // Don't show the URI if it is the root directory
 if($uri == "/")
@@ -109,7 +295,24 @@ if($uri == "/")
 	<input id="quiet" type="hidden" value="yes">
 	<button id="btnSearch" class="buttons blocked" type="button" style="visibility: hidden;"></button>
 	This page is blocked because it is explicitly contained within the following block list(s):
+<?php if ($blocking === null) { ?>
 	<pre id="output" style="width: 100%; height: 100%;" hidden="true"></pre><br/>
+<?php } else { ?>
+	<pre id="output" style="width: 100%; height: 100%;"><?php
+	foreach ($blocking["wildcards"] as $wildcard)
+	{
+		echo "Wildcard blocking ".htmlspecialchars($wildcard)."\n";
+	}
+	foreach ($blocking["lists"] as $list)
+	{
+		echo htmlspecialchars($list)."\n";
+	}
+	if (empty($blocking["wildcards"]) && empty($blocking["lists"]))
+	{
+		echo "None of the block lists contains this domain\n";
+	}
+	?></pre><br/>
+<?php } ?>
 	<div class='buttons blocked'>
 		<a class='safe33' href='javascript:history.back()'>Go back</a>
 		<a class='safe33' id="whitelisting">Whitelist this page</a>
@@ -141,7 +344,9 @@ if($uri == "/")
     };
 })(jQuery);
 </script>
+<?php if ($blocking === null) { ?>
 <script src="http://pi.hole/admin/scripts/pi-hole/js/queryads.js"></script>
+<?php } ?>
 <script>
 function inIframe () {
     try {
@@ -160,9 +365,9 @@ if(inIframe())
     // remove background
     document.body.style.backgroundImage = "none";
 }
-else
+else if (<?php echo $blocking === null ? "true" : "false"; ?>)
 {
-    // Query adlists
+    // Query adlists, when the page could not tell which ones block the domain
     $( "#btnSearch" ).click();
 }
 
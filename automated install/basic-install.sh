@@ -29,6 +29,14 @@ piholeGitUrl="https://github.com/pi-hole/pi-hole.git"
 PI_HOLE_LOCAL_REPO="/etc/.pihole"
 PI_HOLE_FILES=(chronometer list piholeDebug piholeLogFlush setupLCD update version gravity uninstall webpage)
 PI_HOLE_INSTALL_DIR="/opt/pihole"
+FTLreleasesUrl="https://github.com/pi-hole/FTL/releases"
+# FTL binaries and snapshots of the repos are kept here for the installs after
+# this one. Served over HTTP, the directory is a mirror for other installs.
+artifactCache="/var/cache/pihole"
+# Base URL of such a mirror, tried before GitHub when set. Mirrors are not
+# trusted: FTL releases and their checksums are still taken from GitHub, and
+# repos are restored without their hooks and config.
+mirrorUrl="${PIHOLE_MIRROR:-}"
 useUpdateVars=false
 
 IPV4_ADDRESS=""
@@ -105,7 +113,7 @@ if command -v apt-get &> /dev/null; then
     phpVer="php5"
   fi
   # #########################################
-  INSTALLER_DEPS=(apt-utils dialog debconf dhcpcd5 git ${iproute_pkg} whiptail)
+  INSTALLER_DEPS=(apt-utils curl dialog debconf dhcpcd5 git ${iproute_pkg} whiptail)
   PIHOLE_DEPS=(bc cron curl dnsmasq dnsutils iputils-ping lsof netcat sudo unzip wget)
   PIHOLE_WEB_DEPS=(lighttpd ${phpVer}-common ${phpVer}-cgi)
   LIGHTTPD_USER="www-data"
@@ -136,7 +144,7 @@ elif command -v rpm &> /dev/null; then
   UPDATE_PKG_CACHE=":"
   PKG_INSTALL=(${PKG_MANAGER} install -y)
   PKG_COUNT="${PKG_MANAGER} check-update | egrep '(.i686|.x86|.noarch|.arm|.src)' | wc -l"
-  INSTALLER_DEPS=(dialog git iproute net-tools newt procps-ng)
+  INSTALLER_DEPS=(curl dialog git iproute net-tools newt procps-ng)
   PIHOLE_DEPS=(bc bind-utils cronie curl dnsmasq findutils nmap-ncat sudo unzip wget)
   PIHOLE_WEB_DEPS=(lighttpd lighttpd-fastcgi php php-common php-cli)
   if ! grep -q 'Fedora' /etc/redhat-release; then
@@ -203,6 +211,83 @@ update_repo() {
   return 0
 }
 
+fetch_artifact() {
+  # Copy ${1}, a path in the artifact cache, from the cache or else the mirror to ${2}
+  local artifact="${1}"
+  local target="${2}"
+  if [[ -f "${artifactCache}/${artifact}" ]]; then
+    cp "${artifactCache}/${artifact}" "${target}"
+  elif [[ -n "${mirrorUrl}" ]]; then
+    curl -sSL --fail "${mirrorUrl%/}/${artifact}" -o "${target}" &> /dev/null
+  else
+    return 1
+  fi
+}
+
+store_artifact() {
+  # Keep file ${1} in the artifact cache as ${2}, the cache is a nicety so this never fails
+  local artifact="${artifactCache}/${2}"
+  mkdir -p "$(dirname "${artifact}")" &> /dev/null \
+    && cp "${1}" "${artifact}.tmp" &> /dev/null \
+    && mv "${artifact}.tmp" "${artifact}" &> /dev/null \
+    || rm -f "${artifact}.tmp"
+}
+
+repo_snapshot() {
+  # Path in the artifact cache of the snapshot of repository ${1}
+  local name
+  name=$(basename "${1}" .git)
+  echo "repos/${name}.tar.gz"
+}
+
+configure_snapshot() {
+  # Write the config of repository ${2} restored in ${1}, as git clone would have
+  local branch
+  branch=$(sed -n 's|^ref: refs/heads/||p' "${1}/.git/HEAD" 2> /dev/null)
+  [[ -n "${branch}" ]] || return 1
+  (
+    cd "${1}" \
+      && git init --quiet \
+      && git remote add origin "${2}" \
+      && git config "branch.${branch}.remote" origin \
+      && git config "branch.${branch}.merge" "refs/heads/${branch}"
+  ) &> /dev/null
+}
+
+restore_repo() {
+  # Unpack the snapshot of repository ${2} an earlier install left into ${1}
+  local directory="${1}"
+  local snapshot
+  snapshot=$(mktemp)
+  if ! fetch_artifact "$(repo_snapshot "${2}")" "${snapshot}"; then
+    rm -f "${snapshot}"
+    return 1
+  fi
+  echo -n ":::    Restoring ${directory} from a snapshot..."
+  rm -rf "${directory}"
+  mkdir -p "${directory}"
+  # Hooks and config would have git run what the snapshot says, they are left
+  # out before git is run on it and the config is written again
+  if tar -xzf "${snapshot}" -C "${directory}" --exclude=.git/hooks --exclude=.git/config &> /dev/null \
+    && [[ -d "${directory}/.git" ]] && [[ ! -L "${directory}/.git" ]] \
+    && configure_snapshot "${directory}" "${2}" && is_repo "${directory}"; then
+    rm -f "${snapshot}"
+    echo " done!"
+    return 0
+  fi
+  rm -rf "${directory}" "${snapshot}"
+  echo " failed!"
+  return 1
+}
+
+save_repo() {
+  # Snapshot repository ${2} checked out in ${1} for the installs after this one
+  local snapshot
+  snapshot=$(mktemp)
+  tar -czf "${snapshot}" -C "${1}" . &> /dev/null && store_artifact "${snapshot}" "$(repo_snapshot "${2}")"
+  rm -f "${snapshot}"
+}
+
 getGitFiles() {
   # Setup git repos for directory and repository passed
   # as arguments 1 and 2
@@ -213,10 +298,15 @@ getGitFiles() {
   if is_repo "${directory}"; then
     update_repo "${directory}" || { echo "*** Error: Could not update local repository. Contact support."; exit 1; }
     echo " done!"
+  elif restore_repo "${directory}" "${remoteRepo}"; then
+    # Only what changed since the snapshot was taken is pulled
+    update_repo "${directory}" || { echo "*** Error: Could not update local repository. Contact support."; exit 1; }
+    echo " done!"
   else
     make_repo "${directory}" "${remoteRepo}" || { echo "Unable to clone repository, please contact support"; exit 1; }
     echo " done!"
   fi
+  save_repo "${directory}" "${remoteRepo}"
   return 0
 }
 
@@ -805,6 +895,23 @@ enable_service() {
   echo " done."
 }
 
+restart_metrics() {
+  # The collector of the version being replaced keeps the pid file, a new one would leave it running
+  local pid try
+  echo ":::"
+  echo -n "::: Restarting the metrics collector..."
+  read -r pid 2> /dev/null < /var/run/pihole/metrics.pid
+  if [[ -n "${pid}" ]] && grep -q -a "chronometer" "/proc/${pid}/cmdline" 2> /dev/null; then
+    kill "${pid}"
+    for try in {1..50}; do
+      grep -q -a "chronometer" "/proc/${pid}/cmdline" 2> /dev/null || break
+      sleep 0.1
+    done
+  fi
+  nohup /opt/pihole/chronometer.sh --metrics > /dev/null 2>&1 &
+  echo " done."
+}
+
 update_package_cache() {
   #Running apt-get update/upgrade with minimal output can cause some issues with
   #requiring user input (e.g password for phpmyadmin see #218)
@@ -1057,6 +1164,7 @@ finalExports() {
   # Look for DNS server settings which would have to be reapplied
   source "${setupVars}"
   source "${PI_HOLE_LOCAL_REPO}/advanced/Scripts/webpage.sh"
+  LoadSettings
 
   if [[ "${DNS_FQDN_REQUIRED}" != "" ]] ; then
     ProcessDNSSettings
@@ -1065,6 +1173,7 @@ finalExports() {
   if [[ "${DHCP_ACTIVE}" != "" ]] ; then
     ProcessDHCPSettings
   fi
+  CommitSettings
 }
 
 installLogrotate() {
@@ -1226,6 +1335,10 @@ update_dialogs() {
 }
 
 clone_or_update_repos() {
+  local tmpDir
+  local corePid
+  local webPid
+  local status
   if [[ "${reconfigure}" == true ]]; then
     echo "::: --reconfigure passed to install script. Resetting changes to local repos"
     resetRepo ${PI_HOLE_LOCAL_REPO} || \
@@ -1239,67 +1352,115 @@ clone_or_update_repos() {
         }
     fi
   else
-    # Get Git files for Core and Admin
-    getGitFiles ${PI_HOLE_LOCAL_REPO} ${piholeGitUrl} || \
-      { echo "!!! Unable to clone ${piholeGitUrl} into ${PI_HOLE_LOCAL_REPO}, unable to continue."; \
-        exit 1; \
-      }
+    # Get Git files for Core and Admin at the same time, what they print is
+    # shown in order once they are done
+    tmpDir=$(mktemp -d)
+    getGitFiles ${PI_HOLE_LOCAL_REPO} ${piholeGitUrl} > "${tmpDir}/core" 2>&1 &
+    corePid=$!
+    if [[ ${INSTALL_WEB} == true ]]; then
+      getGitFiles ${webInterfaceDir} ${webInterfaceGitUrl} > "${tmpDir}/web" 2>&1 &
+      webPid=$!
+    fi
+
+    status=0
+    wait "${corePid}" || status=$?
+    cat "${tmpDir}/core"
+    if [[ "${status}" -ne 0 ]]; then
+      echo "!!! Unable to clone ${piholeGitUrl} into ${PI_HOLE_LOCAL_REPO}, unable to continue."
+      wait
+      rm -rf "${tmpDir}"
+      exit 1
+    fi
 
     if [[ ${INSTALL_WEB} == true ]]; then
-      getGitFiles ${webInterfaceDir} ${webInterfaceGitUrl} || \
-      { echo "!!! Unable to clone ${webInterfaceGitUrl} into ${webInterfaceDir}, unable to continue."; \
-        exit 1; \
-      }
+      wait "${webPid}" || status=$?
+      cat "${tmpDir}/web"
+      if [[ "${status}" -ne 0 ]]; then
+        echo "!!! Unable to clone ${webInterfaceGitUrl} into ${webInterfaceDir}, unable to continue."
+        rm -rf "${tmpDir}"
+        exit 1
+      fi
     fi
+    rm -rf "${tmpDir}"
   fi
 }
 
-FTLinstall() {
-  # Download and install FTL binary
+FTLlatest() {
+  # Print the tag of the latest FTL release, as GitHub knows it.
+  # The tag of the last download is the fallback when GitHub can not be reached.
+  local tag
+  tag=$(curl -sI "${FTLreleasesUrl}/latest" | grep "Location" | awk -F '/' '{print $NF}' | tr -d '\r\n')
+  if [[ ! "${tag}" == v* ]]; then
+    tag=$(cat "${artifactCache}/FTL/latest" 2> /dev/null) || true
+  fi
+  # Tags should always start with v, check for that.
+  [[ "${tag}" == v* ]] || return 1
+  echo "${tag}"
+}
+
+FTLdownload() {
+  # Get FTL binary ${1} of the latest release into the artifact cache, and set
+  # FTLtag to the release and FTLbinary to the file. Cached binaries are not
+  # downloaded again, the ones of a mirror have to match the checksum of the
+  # release on GitHub.
   local binary="${1}"
-  local latesttag
-  local orig_dir
-  echo -n ":::  Installing FTL... "
+  local tmpDir
+  FTLtag=$(FTLlatest) || { echo "failed (error in getting latest release location from GitHub)"; return 1; }
+  FTLbinary="${artifactCache}/FTL/${FTLtag}/${binary}"
+  if [[ -f "${FTLbinary}" ]]; then
+    return 0
+  fi
 
-  orig_dir="${PWD}"
-  latesttag=$(curl -sI https://github.com/pi-hole/FTL/releases/latest | grep "Location" | awk -F '/' '{print $NF}')
-  # Tags should always start with v, check for that.
-  if [[ ! "${latesttag}" == v* ]]; then
-    echo "failed (error in getting latest release location from GitHub)"
+  tmpDir=$(mktemp -d)
+  # Get sha1 of the release for verification, whoever serves the binary
+  if ! curl -sSL --fail "${FTLreleasesUrl}/download/${FTLtag}/${binary}.sha1" -o "${tmpDir}/${binary}.sha1"; then
+    rm -rf "${tmpDir}"
+    echo "failed (URL not found.)"
     return 1
   fi
-  if curl -sSL --fail "https://github.com/pi-hole/FTL/releases/download/${latesttag%$'\r'}/${binary}" -o "/tmp/${binary}"; then
-    # Get sha1 of the binary we just downloaded for verification.
-    curl -sSL --fail "https://github.com/pi-hole/FTL/releases/download/${latesttag%$'\r'}/${binary}.sha1" -o "/tmp/${binary}.sha1"
-    # Check if we just downloaded text, or a binary file.
-    cd /tmp
-    if sha1sum --status --quiet -c "${binary}".sha1; then
-      echo -n "transferred... "
-      stop_service pihole-FTL &> /dev/null
-      install -T -m 0755 /tmp/${binary} /usr/bin/pihole-FTL
-      rm /tmp/${binary} /tmp/${binary}.sha1
-      cd "${orig_dir}"
-      install -T -m 0755 "${PI_HOLE_LOCAL_REPO}/advanced/pihole-FTL.service" "/etc/init.d/pihole-FTL"
-      echo "done."
-      return 0
-    else
-      echo "failed (download of binary from Github failed)"
-      cd "${orig_dir}"
+  if ! fetch_artifact "FTL/${FTLtag}/${binary}" "${tmpDir}/${binary}" \
+    || ! (cd "${tmpDir}" && sha1sum --status --quiet -c "${binary}.sha1") &> /dev/null; then
+    if ! curl -sSL --fail "${FTLreleasesUrl}/download/${FTLtag}/${binary}" -o "${tmpDir}/${binary}"; then
+      rm -rf "${tmpDir}"
+      echo "failed (URL not found.)"
       return 1
     fi
+  fi
+  # Check if we just downloaded text, or a binary file.
+  if ! (cd "${tmpDir}" && sha1sum --status --quiet -c "${binary}.sha1") &> /dev/null; then
+    rm -rf "${tmpDir}"
+    echo "failed (download of binary from Github failed)"
+    return 1
+  fi
+  store_artifact "${tmpDir}/${binary}" "FTL/${FTLtag}/${binary}"
+  store_artifact "${tmpDir}/${binary}.sha1" "FTL/${FTLtag}/${binary}.sha1"
+  echo "${FTLtag}" > "${tmpDir}/latest"
+  store_artifact "${tmpDir}/latest" "FTL/latest"
+  # Installs go on without the cache if it could not be written to
+  if [[ -f "${FTLbinary}" ]]; then
+    rm -rf "${tmpDir}"
   else
-    cd "${orig_dir}"
-    echo "failed (URL not found.)"
+    FTLbinary="${tmpDir}/${binary}"
   fi
 }
 
-FTLdetect() {
-  # Detect suitable FTL binary platform
-  echo ":::"
-  echo "::: Downloading latest version of FTL..."
+FTLinstall() {
+  # Download and install FTL binary
+  local binary="${1}"
+  echo -n ":::  Installing FTL... "
 
+  FTLdownload "${binary}" || return 1
+  echo -n "transferred... "
+  stop_service pihole-FTL &> /dev/null
+  install -T -m 0755 "${FTLbinary}" /usr/bin/pihole-FTL
+  install -T -m 0755 "${PI_HOLE_LOCAL_REPO}/advanced/pihole-FTL.service" "/etc/init.d/pihole-FTL"
+  echo "done."
+  return 0
+}
+
+FTLplatform() {
+  # Detect suitable FTL binary platform and set binary to its name
   local machine
-  local binary
 
   machine=$(uname -m)
 
@@ -1337,11 +1498,52 @@ FTLdetect() {
     fi
     binary="pihole-FTL-linux-x86_32"
   fi
+}
 
+FTLdetect() {
+  # Detect suitable FTL binary platform
+  echo ":::"
+  echo "::: Downloading latest version of FTL..."
+
+  local binary
+
+  FTLplatform
   FTLinstall "${binary}" || return 1
 
 }
 
+FTLprefetch() {
+  # Download the FTL binary for this platform ahead of FTLdetect
+  local binary
+
+  FTLplatform > /dev/null
+  FTLdownload "${binary}" > /dev/null
+}
+
+fetch_start() {
+  # Clone or update the repos and download FTL in the background,
+  # while the packages are installed
+  fetchDir=$(mktemp -d)
+  clone_or_update_repos > "${fetchDir}/repos" 2>&1 &
+  reposPid=$!
+  FTLprefetch &> /dev/null &
+  FTLprefetchPid=$!
+}
+
+fetch_finish() {
+  # Wait for what fetch_start started and show what it printed
+  local status
+  status=0
+  wait "${reposPid}" || status=$?
+  cat "${fetchDir}/repos"
+  # FTLdetect downloads FTL itself if this did not work out
+  wait "${FTLprefetchPid}" || true
+  rm -rf "${fetchDir}"
+  if [[ "${status}" -ne 0 ]]; then
+    exit 1
+  fi
+}
+
 main() {
 
   ######## FIRST CHECK ########
@@ -1431,8 +1633,8 @@ main() {
     setAdminFlag
     # Let the user decide if they want query logging enabled...
     setLogging
-    # Clone/Update the repos
-    clone_or_update_repos
+    # Clone/Update the repos and download FTL while the packages are installed
+    fetch_start
 
        # Install packages used by the Pi-hole
     if [[ ${INSTALL_WEB} == true ]]; then
@@ -1441,13 +1643,14 @@ main() {
       DEPS=("${PIHOLE_DEPS[@]}")
     fi
     install_dependent_packages DEPS[@]
+    fetch_finish
 
 
     # Install and log everything to a file
     installPihole | tee ${tmpLog}
   else
-    # Clone/Update the repos
-    clone_or_update_repos
+    # Clone/Update the repos and download FTL while the packages are installed
+    fetch_start
 
     # Source ${setupVars} for use in the rest of the functions.
     source ${setupVars}
@@ -1459,6 +1662,7 @@ main() {
       DEPS=("${PIHOLE_DEPS[@]}")
     fi
     install_dependent_packages DEPS[@]
+    fetch_finish
 
     updatePihole | tee ${tmpLog}
   fi
@@ -1491,6 +1695,9 @@ main() {
   start_service pihole-FTL
   enable_service pihole-FTL
 
+  # Collect metrics with the new version now rather than after the next reboot
+  restart_metrics
+
   echo "::: done."
 
   if [[ "${useUpdateVars}" == false ]]; then
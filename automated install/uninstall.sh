@@ -147,6 +147,7 @@ removeNoPurge() {
 
 	${SUDO} rm /etc/dnsmasq.d/adList.conf &> /dev/null
 	${SUDO} rm /etc/dnsmasq.d/01-pihole.conf &> /dev/null
+	${SUDO} rm /etc/dnsmasq.d/05-pihole-gravity-wildcard.conf &> /dev/null
 	${SUDO} rm -rf /var/log/*pihole* &> /dev/null
 	${SUDO} rm -rf /etc/pihole/ &> /dev/null
 	${SUDO} rm -rf /etc/.pihole/ &> /dev/null
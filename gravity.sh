@@ -20,8 +20,21 @@ helpFunc() {
 ::: Usage: pihole -g
 :::
 ::: Options:
-:::  -f, --force			Force lists to be downloaded, even if they don't need updating.
+:::  -f, --force			Force lists to be downloaded and rebuilt, even if they don't need updating.
 :::  -h, --help				Show this help dialog
+:::  -b, --blacklist-only		Only rebuild black.list
+:::  -w, --whitelist-only		Only apply whitelist changes to gravity.list and rebuild black.list
+:::  --profile			Measure every stage and download, appending a report to
+:::				${profileFile}
+:::
+::: Set GRAVITY_DOWNLOAD_JOBS in /etc/pihole/setupVars.conf to change how many
+::: lists are downloaded at the same time (default: 4, 1 downloads them one by one).
+::: Set GRAVITY_COMPACT=true to write gravity.list and black.list with up to
+::: ${compactWidth} domains per line, which makes them about half the size.
+:::
+::: Domains a wildcard blocks already are left out of gravity.list. Set
+::: GRAVITY_WILDCARD_FANOUT to a number to also block every listed domain with at
+::: least that many listed subdomains as a wildcard, unless one of them is whitelisted.
 EOM
 	exit 0
 }
@@ -35,6 +48,8 @@ whitelistScript="${PIHOLE_COMMAND} -w"
 whitelistFile=/etc/pihole/whitelist.txt
 blacklistFile=/etc/pihole/blacklist.txt
 readonly wildcardlist="/etc/dnsmasq.d/03-pihole-wildcard.conf"
+# Wildcards gravity promotes from the lists, see GRAVITY_WILDCARD_FANOUT
+readonly promotedList="/etc/dnsmasq.d/05-pihole-gravity-wildcard.conf"
 
 #Source the setupVars from install script for the IP
 setupVars=/etc/pihole/setupVars.conf
@@ -55,15 +70,54 @@ basename=pihole
 piholeDir=/etc/${basename}
 adList=${piholeDir}/gravity.list
 blackList=${piholeDir}/black.list
+# While blocking is disabled dnsmasq reads empty lists, and the lists are kept aside
+if grep -q "^BLOCKING=disabled$" ${piholeDir}/blocking.state 2> /dev/null; then
+	adList=${adList}.disabled
+	blackList=${blackList}.disabled
+fi
 localList=${piholeDir}/local.list
 justDomainsExtension=domains
-matterAndLight=${basename}.0.matterandlight.txt
-supernova=${basename}.1.supernova.txt
 preEventHorizon=list.preEventHorizon
 eventHorizon=${basename}.2.supernova.txt
 accretionDisc=${basename}.3.accretionDisc.txt
+# Normalised domains of every list, named after the SHA1 of the list they came from
+horizonCache=${piholeDir}/gravity.cache
+horizonExtension=horizon
+# Lowercased domains of every list with the offsets of the lines they are on, for the index
+linesExtension=lines
+horizonManifest=${horizonCache}/manifest
+horizonStamp=${horizonCache}/gravity.stamp
+# Copy of the whitelist gravity.list was last written with
+whitelistSnapshot=${horizonCache}/whitelist.snapshot
+# Lookup index for pihole -q: every domain with the numbers of the lists it is found in,
+# and the offsets of its lines in those lists (list 0 is the event horizon)
+indexFile=${piholeDir}/gravity.index
+indexSources=${indexFile}.sources
+wildcardIndex=${indexFile}.wildcards
+# Statistics of the last gravity run, in Prometheus text format for "pihole -c --metrics"
+gravityMetrics=${piholeDir}/gravity.metrics
+# Reports of the runs made with --profile, one JSON object per line
+profileFile=${piholeDir}/gravity.profile.jsonl
+profileRuns=100
 
 skipDownload=false
+profile=false
+
+# Maximum number of lists being transported at the same time
+downloadJobs=${GRAVITY_DOWNLOAD_JOBS:-4}
+if [[ ! "${downloadJobs}" =~ ^[0-9]+$ ]] || [[ "${downloadJobs}" -lt 1 ]]; then
+	downloadJobs=1
+fi
+
+# Compact hosts files list many domains after each sinkhole address instead of one per line
+compactFormat=${GRAVITY_COMPACT:-false}
+compactWidth=100
+
+# Listed domains with at least this many listed subdomains become wildcards (0: never)
+wildcardFanout=${GRAVITY_WILDCARD_FANOUT:-0}
+if [[ ! "${wildcardFanout}" =~ ^[0-9]+$ ]]; then
+	wildcardFanout=0
+fi
 
 # Warn users still using pihole.conf that it no longer has any effect (I imagine about 2 people use it)
 if [[ -r ${piholeDir}/pihole.conf ]]; then
@@ -147,8 +201,8 @@ gravity_transport() {
 		heisenbergCompensator="-z ${saveLocation}"
 	fi
 
-	# Silently curl url
-	err=$(curl -s -L ${cmd_ext} ${heisenbergCompensator} -w %{http_code} -A "${agent}" ${url} -o ${patternBuffer})
+	# Silently curl url, keeping how long the transport took and its size for the metrics
+	read -r err transportTime transportSize < <(curl -s -L ${cmd_ext} ${heisenbergCompensator} -w "%{http_code} %{time_total} %{size_download}" -A "${agent}" ${url} -o ${patternBuffer})
 
 	echo " done"
 	# Analyze http response
@@ -175,9 +229,28 @@ gravity_transport() {
         fi
 }
 
+# transportReport - print the output of finished transports in adlist order
+gravity_transportReport() {
+	# Stop at the first transport still in flight so lists are always reported in order
+	while [[ "${reportIndex}" -lt "${1}" ]]; do
+		if [[ -n "${transportPids[$reportIndex]}" ]] && kill -0 "${transportPids[$reportIndex]}" 2> /dev/null; then
+			break
+		fi
+		if [[ -f "${transportDir}/${reportIndex}" ]]; then
+			cat "${transportDir}/${reportIndex}"
+		fi
+		reportIndex=$((reportIndex+1))
+	done
+}
+
 # spinup - main gravity function
 gravity_spinup() {
 	echo ":::"
+	# Each transport writes its status into its own file, so several lists can
+	# be downloaded at once while their output is still reported in order
+	transportDir=$(mktemp -d)
+	transportPids=()
+	reportIndex=0
 	# Loop through domain list.  Download each one and remove commented lines (lines beginning with '# 'or '/') and	 		# blank lines
 	for ((i = 0; i < "${#sources[@]}"; i++)); do
 		url=${sources[$i]}
@@ -210,22 +283,44 @@ gravity_spinup() {
 		    *) cmd_ext=""
         esac
         if [[ "${skipDownload}" == false ]]; then
-            echo -n "::: Getting $domain list..."
-            gravity_transport "$url" "$cmd_ext" "$agent"
+            # Wait for a free slot before starting another transport
+            while [[ "$(jobs -pr | wc -l)" -ge "${downloadJobs}" ]]; do
+                sleep 0.1
+                gravity_transportReport "${i}"
+            done
+            # The subshell keeps its own copy of saveLocation, url, cmd_ext and agent
+            {
+                echo -n "::: Getting $domain list..."
+                profileList=${i}
+                gravity_stage "download" gravity_transport "$url" "$cmd_ext" "$agent"
+                echo "${err} ${transportTime} ${transportSize}" > "${transportDir}/${i}.stats"
+            } > "${transportDir}/${i}" 2>&1 &
+            transportPids[$i]=$!
+            gravity_transportReport "${i}"
         fi
 	done
+	wait
+	gravity_transportReport "${#sources[@]}"
+	# Status, seconds and bytes of every transport, by list number
+	transportStats=()
+	for ((i = 0; i < "${#sources[@]}"; i++)); do
+		if [[ -f "${transportDir}/${i}.stats" ]]; then
+			transportStats[$i]=$(<"${transportDir}/${i}.stats")
+		fi
+	done
+	rm -rf "${transportDir}"
 }
 
-# Schwarzchild - aggregate domains to one list and add blacklisted domains
+# Schwarzchild - gather the lists that will be pulled into the event horizon
 gravity_Schwarzchild() {
 	echo "::: "
-	# Find all active domains and compile them into one file and remove CRs
+	# Find all active domains, they are read directly from their cached files
 	echo -n "::: Aggregating list of domains..."
-	truncate -s 0 ${piholeDir}/${matterAndLight}
+	matter=()
 	for i in "${activeDomains[@]}"; do
 		# Only assimilate list if it is available (download might have faild permanently)
 		if [[ -r "${i}" ]]; then
-			cat "${i}" | tr -d '\r' >> ${piholeDir}/${matterAndLight}
+			matter+=("${i}")
 		fi
 	done
 	echo " done!"
@@ -244,7 +339,7 @@ gravity_Blacklist() {
 }
 
 gravity_Wildcard() {
-	# Return number of wildcards in output - don't actually handle wildcards
+	# Return number of wildcards in output - the domains they block are left out of gravity.list by gravity_eclipse
 	if [[ -f "${wildcardlist}" ]]; then
 	    numWildcards=$(grep -c ^ "${wildcardlist}")
 	    if [[ -n "${IPV4_ADDRESS}" && -n "${IPV6_ADDRESS}" ]];then
@@ -255,7 +350,183 @@ gravity_Wildcard() {
 	else
 	    echo "::: No wildcards used!"
 	fi
+	# Index the wildcards by their labels in reverse order (ads.example.com -> com.example.ads),
+	# so pihole -q looks up every parent domain of a query directly
+	truncate -s 0 "${wildcardIndex}.tmp"
+	gravity_dedupeWildcards "${wildcardlist}" "${promotedList}" | awk -F '/' -v sortCmd="LC_ALL=C sort -t '$(printf '\t')' -k1,1 > '${wildcardIndex}.tmp'" '
+	    {
+	        n = split(tolower($2), labels, ".")
+	        key = labels[n]
+	        for (i = n - 1; i > 0; i--) key = key "." labels[i]
+	        print key "\t" $0 | sortCmd
+	    }
+	    END { close(sortCmd) }'
+	mv "${wildcardIndex}.tmp" "${wildcardIndex}"
+}
+
+# dedupeWildcards - the wildcard lines of the files, without repeats and without those another wildcard covers
+gravity_dedupeWildcards() {
+	# The files are only read, 03-pihole-wildcard.conf is the user's and stays as it is
+	cat "$@" 2> /dev/null | awk -F '/' '
+		$1 == "address=" {
+			line[++count] = $0
+			wild[tolower($2)]
+		}
+		END {
+			for (i = 1; i <= count; i++) {
+				if (line[i] in seen) continue
+				seen[line[i]]
+				split(line[i], field, "/")
+				domain = tolower(field[2])
+				covered = 0
+				while (!covered && (dot = index(domain, ".")) > 0) {
+					domain = substr(domain, dot + 1)
+					covered = (domain in wild)
+				}
+				if (!covered) print line[i]
+			}
+		}'
+}
+
+# wildcardDomains - the domains of the address=/domain/IP lines of the wildcard files that exist
+gravity_wildcardDomains() {
+	cat "$@" 2> /dev/null | awk -F '/' '$1 == "address=" { print tolower($2) }'
+}
+
+# doEclipse - drop the domains a wildcard blocks already, its own domain and every subdomain
+gravity_doEclipse() {
+	# ${1}: domain list, ${2}: wildcard domains, one per line, ${3}: output, ${4}: "proper" to only drop subdomains
+	# Prints the number of domains dropped and the bytes their lines took in gravity.list
+	truncate -s 0 "${3}"
+	awk -v out="${3}" -v proper="${4}" -v addresses="${IPV4_ADDRESS} ${IPV6_ADDRESS}" -v compact="${compactFormat}" '
+		BEGIN {
+			# Every address takes a line of its own in the hosts format, a name after it in compact lines
+			count = split(addresses, address, " ")
+			for (i = 1; i <= count; i++) prefix += length(address[i]) + 2
+		}
+		FILENAME == ARGV[1] {
+			wild[$0]
+			next
+		}
+		{
+			domain = tolower($0)
+			covered = (proper != "proper" && (domain in wild))
+			while (!covered && (dot = index(domain, ".")) > 0) {
+				domain = substr(domain, dot + 1)
+				covered = (domain in wild)
+			}
+			if (!covered) {
+				print > out
+				next
+			}
+			dropped++
+			bytes += (compact == "true") ? count * (length($0) + 1) : prefix + count * length($0)
+		}
+		END {
+			close(out)
+			print dropped + 0, bytes + 0
+		}' "${2}" "${1}"
+}
+
+# promoteWildcards - block listed domains with many listed subdomains as wildcards
+gravity_promoteWildcards() {
+	# ${1}: domain list, writes the wildcards to promotedList
+	# Prints the number of wildcards promoted
+	local tmpDir
+	if [[ "${wildcardFanout}" -eq 0 ]]; then
+		rm -f "${promotedList}"
+		echo 0
+		return
+	fi
+	tmpDir=$(mktemp -d)
+	# Every parent domain of every domain, from the second level up
+	awk '{
+			domain = tolower($0)
+			while ((dot = index(domain, ".")) > 0) {
+				domain = substr(domain, dot + 1)
+				if (index(domain, ".")) print domain
+			}
+		}' "${1}" | LC_ALL=C sort | uniq -c | awk -v fanout="${wildcardFanout}" '$1 >= fanout { print $2 }' > "${tmpDir}/parents"
+	# Only parents that are listed themselves, and none of whose subdomains are whitelisted
+	awk -v whitelist="${whitelistFile}" -v out="${tmpDir}/listed" '
+		BEGIN {
+			while ((getline line < whitelist) > 0) {
+				domain = tolower(line)
+				allowed[domain]
+				while ((dot = index(domain, ".")) > 0) {
+					domain = substr(domain, dot + 1)
+					allowed[domain]
+				}
+			}
+		}
+		FILENAME == ARGV[1] {
+			if (!($0 in allowed)) parent[$0]
+			next
+		}
+		{
+			domain = tolower($0)
+			if ((domain in parent) && !(domain in seen)) {
+				seen[domain]
+				print domain > out
+			}
+		}' "${tmpDir}/parents" "${1}"
+	touch "${tmpDir}/listed"
+	# Neither below a wildcard of the user nor below another promoted one
+	gravity_wildcardDomains "${wildcardlist}" > "${tmpDir}/wildcards"
+	gravity_doEclipse "${tmpDir}/listed" "${tmpDir}/wildcards" "${tmpDir}/own" > /dev/null
+	cp "${tmpDir}/own" "${tmpDir}/parents"
+	gravity_doEclipse "${tmpDir}/own" "${tmpDir}/parents" "${tmpDir}/promoted" proper > /dev/null
+	LC_ALL=C sort "${tmpDir}/promoted" | awk -v ipv4="${IPV4_ADDRESS}" -v ipv6="${IPV6_ADDRESS}" '{
+			if (ipv4 != "") print "address=/" $0 "/" ipv4
+			if (ipv6 != "") print "address=/" $0 "/" ipv6
+		}' > "${tmpDir}/conf"
+	# dnsmasq only has to restart when the promoted wildcards changed
+	if ! cmp -s "${tmpDir}/conf" "${promotedList}"; then
+		mv "${tmpDir}/conf" "${promotedList}"
+	fi
+	wc -l < "${tmpDir}/promoted"
+	rm -rf "${tmpDir}"
+}
 
+# eclipse - leave the domains wildcards block out of the event horizon
+gravity_eclipse() {
+	local tmpDir
+	if [[ ! -f "${piholeDir}/${eventHorizon}" ]]; then
+		return
+	fi
+	tmpDir=$(mktemp -d)
+	numPromoted=$(gravity_promoteWildcards "${piholeDir}/${eventHorizon}")
+	if [[ "${numPromoted}" -gt 0 ]]; then
+		plural=; [[ "$numPromoted" != "1" ]] && plural=s
+		echo "::: Blocking ${numPromoted} domain${plural} with at least ${wildcardFanout} listed subdomains as wildcard${plural}"
+	fi
+	gravity_wildcardDomains "${wildcardlist}" "${promotedList}" > "${tmpDir}/wildcards"
+	if [[ ! -s "${tmpDir}/wildcards" ]]; then
+		numEclipsed=0
+		rm -rf "${tmpDir}"
+		return
+	fi
+	read -r numEclipsed eclipsedBytes < <(gravity_doEclipse "${piholeDir}/${eventHorizon}" "${tmpDir}/wildcards" "${piholeDir}/${eventHorizon}.tmp")
+	mv "${piholeDir}/${eventHorizon}.tmp" "${piholeDir}/${eventHorizon}"
+	plural=; [[ "$numEclipsed" != "1" ]] && plural=s
+	echo "::: ${numEclipsed} domain${plural} blocked by wildcards left out of gravity.list ($((eclipsedBytes / 1024)) KB smaller)"
+	rm -rf "${tmpDir}"
+}
+
+gravity_sortHorizon() {
+	# comm needs the event horizon sorted as LC_ALL=C sorts, like gravity_advanced
+	# writes it. One left by an older gravity.sh was sorted in the locale.
+	if ! LC_ALL=C sort -c -u "${piholeDir}/${preEventHorizon}" 2> /dev/null; then
+		LC_ALL=C sort -u "${piholeDir}/${preEventHorizon}" -o "${piholeDir}/${preEventHorizon}"
+	fi
+}
+
+gravity_doWhitelist() {
+	# ${1}: sorted domain list, ${2}: whitelist, ${3}: output
+	# The event horizon is already sorted (LC_ALL=C), so sorting the much smaller
+	# whitelist the same way lets comm drop whitelisted domains in a single merge
+	# pass, without building grep's pattern automaton from the whole whitelist
+	LC_ALL=C sort -u "${2}" | LC_ALL=C comm -23 "${1}" - > "${3}"
 }
 
 gravity_Whitelist() {
@@ -275,6 +546,13 @@ gravity_Whitelist() {
 	# Ensure adlist domains are in whitelist.txt
 	${whitelistScript} -nr -q "${urls[@]}" > /dev/null
 
+	# Nothing gravity.list depends on has changed since it was written
+	if [[ "${forceGrav}" != true ]] && [[ -f "${adList}" ]] && [[ "$(gravity_horizonStamp)" == "$(cat "${horizonStamp}" 2> /dev/null)" ]]; then
+		echo "::: Event horizon and whitelist unchanged, keeping gravity.list"
+		horizonUnchanged=true
+		return
+	fi
+
     # Check whitelist.txt exists.
 	if [[ -f "${whitelistFile}" ]]; then
         # Remove anything in whitelist.txt from the Event Horizon
@@ -282,22 +560,13 @@ gravity_Whitelist() {
         plural=; [[ "$numWhitelisted" != "1" ]] && plural=s
         echo -n "::: Whitelisting $numWhitelisted domain${plural}..."
         #print everything from preEventHorizon into eventHorizon EXCEPT domains in whitelist.txt
-        grep -F -x -v -f ${whitelistFile} ${piholeDir}/${preEventHorizon} > ${piholeDir}/${eventHorizon}
+        gravity_doWhitelist "${piholeDir}/${preEventHorizon}" "${whitelistFile}" "${piholeDir}/${eventHorizon}"
         echo " done!"
 	else
 	    echo "::: Nothing to whitelist!"
 	fi
 }
 
-gravity_unique() {
-	# Sort and remove duplicates
-	echo -n "::: Removing duplicate domains...."
-	sort -u  ${piholeDir}/${supernova} > ${piholeDir}/${preEventHorizon}
-	echo " done!"
-	numberOf=$(wc -l < ${piholeDir}/${preEventHorizon})
-	echo "::: $numberOf unique domains trapped in the event horizon."
-}
-
 gravity_doHostFormat() {
   # Check vars from setupVars.conf to see if we're using IPv4, IPv6, Or both.
   if [[ -n "${IPV4_ADDRESS}" && -n "${IPV6_ADDRESS}" ]];then
@@ -315,6 +584,36 @@ gravity_doHostFormat() {
   fi
 }
 
+gravity_doCompactFormat() {
+  # Format domain list as "192.168.x.x domain1.com domain2.com ...", once for every address
+  if [[ -z "${IPV4_ADDRESS}" && -z "${IPV6_ADDRESS}" ]];then
+      echo "::: No IP Values found! Please run 'pihole -r' and choose reconfigure to restore values"
+      exit 1
+  fi
+  awk -v addresses="${IPV4_ADDRESS} ${IPV6_ADDRESS}" -v width="${compactWidth}" '
+      function flush(i) {
+          for (i = 1; i <= count; i++) print address[i] names
+          names = ""
+          n = 0
+      }
+      BEGIN { count = split(addresses, address, " ") }
+      {
+          sub(/\r$/, "")
+          names = names " " $0
+          if (++n == width) flush()
+      }
+      END { if (n) flush() }' >> "${2}" < "${1}"
+}
+
+gravity_doBlockFormat() {
+  # gravity.list and black.list are written in the format chosen in setupVars.conf
+  if [[ "${compactFormat}" == true ]]; then
+    gravity_doCompactFormat "$@"
+  else
+    gravity_doHostFormat "$@"
+  fi
+}
+
 gravity_hostFormatLocal() {
 	# Format domain list as "192.168.x.x domain.com"
 
@@ -327,26 +626,97 @@ gravity_hostFormatLocal() {
 	fi
 
 	echo -e "${hostname}\npi.hole" > "${localList}.tmp"
-	# Copy the file over as /etc/pihole/local.list so dnsmasq can use it
-	rm "${localList}"
-	gravity_doHostFormat "${localList}.tmp" "${localList}"
+	# Move the file over as /etc/pihole/local.list so dnsmasq never reads a partial list
+	truncate -s 0 "${localList}.new"
+	gravity_doHostFormat "${localList}.tmp" "${localList}.new"
+	mv "${localList}.new" "${localList}"
 	rm "${localList}.tmp"
 }
 
 gravity_hostFormatGravity() {
 	# Format domain list as "192.168.x.x domain.com"
 	echo "" > "${piholeDir}/${accretionDisc}"
-	gravity_doHostFormat "${piholeDir}/${eventHorizon}" "${piholeDir}/${accretionDisc}"
-	# Copy the file over as /etc/pihole/gravity.list so dnsmasq can use it
+	gravity_doBlockFormat "${piholeDir}/${eventHorizon}" "${piholeDir}/${accretionDisc}"
+	# Move the file over as /etc/pihole/gravity.list so dnsmasq never reads a partial list
 	mv "${piholeDir}/${accretionDisc}" "${adList}"
+	gravity_snapshotWhitelist
+}
+
+# snapshotWhitelist - remember the whitelist gravity.list now reflects
+gravity_snapshotWhitelist() {
+	# The cache is only made by gravity_advanced, a run with --skip-download may come first
+	mkdir -p "${horizonCache}"
+	if [[ -f "${whitelistFile}" ]]; then
+		cp "${whitelistFile}" "${whitelistSnapshot}"
+	else
+		truncate -s 0 "${whitelistSnapshot}"
+	fi
+	gravity_horizonStamp > "${horizonStamp}"
+}
+
+# whitelistDelta - apply only what changed in the whitelist since gravity.list was written
+gravity_whitelistDelta() {
+	local tmpDir
+	# gravity.list has to be exactly what the snapshot says it is
+	if [[ ! -f "${adList}" ]] || [[ ! -f "${piholeDir}/${preEventHorizon}" ]] || [[ ! -f "${whitelistSnapshot}" ]] \
+		|| [[ "$(gravity_horizonStamp "${whitelistSnapshot}")" != "$(cat "${horizonStamp}" 2> /dev/null)" ]]; then
+		return 1
+	fi
+	gravity_sortHorizon
+	echo -n "::: Applying whitelist changes to gravity.list..."
+	tmpDir=$(mktemp -d)
+	LC_ALL=C sort -u "${whitelistSnapshot}" > "${tmpDir}/old"
+	cat "${whitelistFile}" 2> /dev/null | LC_ALL=C sort -u > "${tmpDir}/new"
+	LC_ALL=C comm -13 "${tmpDir}/old" "${tmpDir}/new" > "${tmpDir}/added"
+	LC_ALL=C comm -23 "${tmpDir}/old" "${tmpDir}/new" > "${tmpDir}/removed"
+	# A promoted wildcard would go on blocking a newly whitelisted subdomain, it has to go
+	if [[ -s "${tmpDir}/added" ]] && [[ -f "${promotedList}" ]]; then
+		gravity_wildcardDomains "${promotedList}" > "${tmpDir}/promoted"
+		if [[ "$(gravity_doEclipse "${tmpDir}/added" "${tmpDir}/promoted" "${tmpDir}/uncovered")" != "0 "* ]]; then
+			rm -rf "${tmpDir}"
+			echo " not possible, a promoted wildcard blocks a newly whitelisted domain"
+			return 1
+		fi
+	fi
+	# Domains taken off the whitelist come back when they are still in the event horizon
+	touch "${tmpDir}/restored"
+	if [[ -s "${tmpDir}/removed" ]]; then
+		LC_ALL=C comm -12 "${piholeDir}/${preEventHorizon}" "${tmpDir}/removed" > "${tmpDir}/returning"
+		# Unless a wildcard blocks them already
+		gravity_wildcardDomains "${wildcardlist}" "${promotedList}" > "${tmpDir}/wildcards"
+		gravity_doEclipse "${tmpDir}/returning" "${tmpDir}/wildcards" "${tmpDir}/restored" > /dev/null
+	fi
+	if [[ -s "${tmpDir}/added" ]] || [[ -s "${tmpDir}/restored" ]]; then
+		if [[ -s "${tmpDir}/added" ]] && [[ "${compactFormat}" == true ]]; then
+			# Drop the newly whitelisted domains from the lines they are on
+			awk 'NR == FNR { whitelisted[$0]; next }
+				{
+					line = $1
+					for (i = 2; i <= NF; i++) if (!($i in whitelisted)) line = line " " $i
+					if (line != $1) print line
+				}' "${tmpDir}/added" "${adList}" > "${adList}.tmp"
+		elif [[ -s "${tmpDir}/added" ]]; then
+			# Drop the exact lines gravity.list has for the newly whitelisted domains
+			gravity_doHostFormat "${tmpDir}/added" "${tmpDir}/lines"
+			grep -v -x -F -f "${tmpDir}/lines" "${adList}" > "${adList}.tmp"
+		else
+			cp "${adList}" "${adList}.tmp"
+		fi
+		gravity_doBlockFormat "${tmpDir}/restored" "${adList}.tmp"
+		mv "${adList}.tmp" "${adList}"
+	fi
+	gravity_snapshotWhitelist
+	rm -rf "${tmpDir}"
+	echo " done!"
 }
 
 gravity_hostFormatBlack() {
   if [[ -f "${blacklistFile}" ]]; then
     numBlacklisted=$(wc -l < "${blacklistFile}")
     # Format domain list as "192.168.x.x domain.com"
-    gravity_doHostFormat "${blacklistFile}" "${blackList}.tmp"
-    # Copy the file over as /etc/pihole/black.list so dnsmasq can use it
+    truncate -s 0 "${blackList}.tmp"
+    gravity_doBlockFormat "${blacklistFile}" "${blackList}.tmp"
+    # Move the file over as /etc/pihole/black.list so dnsmasq never reads a partial list
     mv "${blackList}.tmp" "${blackList}"
   else
     echo "::: Nothing to blacklist!"
@@ -364,30 +734,258 @@ gravity_blackbody() {
 			rm -f "${file}"
 		fi
 	done
+	# Drop cached horizons of lists that are no longer used
+	for file in "${horizonCache}"/*.${horizonExtension}; do
+		if [[ -f "${file}" ]] && ! grep -q -F -x "${file}" "${horizonManifest}" 2> /dev/null; then
+			rm -f "${file}"
+		fi
+	done
+	for file in "${horizonCache}"/*.${linesExtension}; do
+		if [[ -f "${file}" ]] && ! grep -q -F -x "${file%.*}.${horizonExtension}" "${horizonManifest}" 2> /dev/null; then
+			rm -f "${file}"
+		fi
+	done
+}
+
+# normalize - stream lists into a sorted, de-duplicated list of domains
+gravity_normalize() {
+	# ${1}: file to write the unique domains to, remaining arguments: lists to read
+	# Prints the number of domains found before removing duplicates
+	local output="${1}"
+	shift
+	# Never let awk fall back to reading stdin when no list is available
+	if [[ "$#" -eq 0 ]]; then
+		set -- /dev/null
+	fi
+	# sort only creates the output once the first domain arrives
+	truncate -s 0 "${output}"
+	# A single awk process replaces the former cat | tr | awk | awk | awk | sed chain:
+	# remove CRs, cut comments and anything after a '/' (URL fragments), take the
+	# domain from hosts file lines (IP address first) and squeeze repeated dots.
+	# Lines without a dot left in them are not domains and are dropped.
+	# Byte order (LC_ALL=C) keeps cached lists mergeable no matter which locale gravity runs in
+	awk -v sortCmd="LC_ALL=C sort -u > '${output}'" '
+		{
+			gsub(/\r/, "")
+			sub(/#.*/, "")
+			sub(/\/.*/, "")
+			domain = (NF > 1) ? $2 : $1
+			gsub(/\.\.+/, ".", domain)
+			if (domain ~ /\./) {
+				print domain | sortCmd
+				count++
+			}
+		}
+		END {
+			close(sortCmd)
+			print count + 0
+		}' "$@"
 }
 
 gravity_advanced() {
 	# Remove comments and print only the domain name
 	# Most of the lists downloaded are already in hosts file format but the spacing/formating is not contigious
-	# This helps with that and makes it easier to read
-	# It also helps with debugging so each stage of the script can be researched more in depth
+	# Only lists whose content changed since the last run are normalised again,
+	# every other list is taken from the horizon cache
 	echo -n "::: Formatting list of domains to remove comments...."
-	#awk '($1 !~ /^#/) { if (NF>1) {print $2} else {print $1}}' ${piholeDir}/${matterAndLight} | sed -nr -e 's/\.{2,}/./g' -e '/\./p' >  ${piholeDir}/${supernova}
-	#Above line does not correctly grab domains where comment is on the same line (e.g 'addomain.com #comment')
-	#Awk -F splits on given IFS, we grab the right hand side (chops trailing #coments and /'s to grab the domain only.
-	#Last awk command takes non-commented lines and if they have 2 fields, take the left field (the domain) and leave
-	#+ the right (IP address), otherwise grab the single field.
-	cat ${piholeDir}/${matterAndLight} | \
-	    awk -F '#' '{print $1}' | \
-	    awk -F '/' '{print $1}' | \
-	    awk '($1 !~ /^#/) { if (NF>1) {print $2} else {print $1}}' | \
-	    sed -nr -e 's/\.{2,}/./g' -e '/\./p' >  ${piholeDir}/${supernova}
+	mkdir -p "${horizonCache}"
+	horizons=()
+	numChanged=0
+	if [[ "${#matter[@]}" -gt 0 ]]; then
+		while read -r hash file; do
+			horizon="${horizonCache}/${hash}.${horizonExtension}"
+			if [[ ! -f "${horizon}" ]]; then
+				gravity_normalize "${horizon}.tmp" "${file}" > /dev/null
+				mv "${horizon}.tmp" "${horizon}"
+				numChanged=$((numChanged+1))
+			fi
+			horizons+=("${horizon}")
+		done < <(sha1sum "${matter[@]}")
+	fi
 	echo " done!"
 
-	numberOf=$(wc -l < ${piholeDir}/${supernova})
-	echo "::: ${numberOf} domains being pulled in by gravity..."
+	# One wc counts the domains of every list, by list number
+	sourceDomains=()
+	if [[ "${#horizons[@]}" -gt 0 ]]; then
+		i=0
+		while read -r count file; do
+			# The last line is the total when there is more than one list
+			[[ "${i}" -ge "${#horizons[@]}" ]] && break
+			file=${matter[$i]##*/list.}
+			sourceDomains[${file%%.*}]=${count}
+			i=$((i+1))
+		done < <(wc -l "${horizons[@]}")
+	fi
 
-	gravity_unique
+	# The domains pulled in are counted once the lists are merged, a domain on several lists is one domain
+	gravity_stage gravity_unique gravity_unique
+	gravity_stage gravity_index gravity_index
+}
+
+gravity_unique() {
+	# Merge the (already sorted) lists, only when one of them has changed
+	if [[ "${numChanged}" -eq 0 ]] && [[ -f "${piholeDir}/${preEventHorizon}" ]] \
+		&& [[ "$(printf "%s\n" "${horizons[@]}")" == "$(cat "${horizonManifest}" 2> /dev/null)" ]]; then
+		echo "::: No list has changed, keeping the event horizon..."
+	else
+		echo -n "::: Removing duplicate domains...."
+		if [[ "${#horizons[@]}" -gt 0 ]]; then
+			LC_ALL=C sort -m -u "${horizons[@]}" > "${piholeDir}/${preEventHorizon}"
+		else
+			truncate -s 0 "${piholeDir}/${preEventHorizon}"
+		fi
+		printf "%s\n" "${horizons[@]}" > "${horizonManifest}"
+		echo " done!"
+	fi
+	numberOf=$(wc -l < ${piholeDir}/${preEventHorizon})
+	echo "::: $numberOf unique domains trapped in the event horizon."
+}
+
+# lineOffsets - the lowercased domain of every line of a list with the offset of the line
+gravity_lineOffsets() {
+	# ${1}: list, ${2}: file to write "domain<tab>offset" to, sorted by domain
+	# The domain is taken from the line as gravity_normalize takes it, offsets are in bytes
+	LC_ALL=C awk '
+		{
+			offset = next_offset + 0
+			next_offset += length($0) + 1
+			gsub(/\r/, "")
+			sub(/#.*/, "")
+			sub(/\/.*/, "")
+			domain = (NF > 1) ? $2 : $1
+			gsub(/\.\.+/, ".", domain)
+			if (domain ~ /\./) print tolower(domain) "\t" offset
+		}' "${1}" | LC_ALL=C sort -t $'\t' -k1,1 > "${2}"
+}
+
+# index - map every domain to the lists and lines it is found in, so pihole -q does not scan them
+gravity_index() {
+	local sources tmpDir tab i lines
+	sources=$(for i in "${!matter[@]}"; do printf "%s\t%s\n" "${matter[$i]}" "${horizons[$i]}"; done)
+	if [[ "${numChanged}" -eq 0 ]] && [[ -f "${indexFile}" ]] && [[ "${sources}" == "$(cat "${indexSources}" 2> /dev/null)" ]]; then
+		# The lists may have been downloaded again as they were, the index still holds for them
+		touch "${indexFile}"
+		return
+	fi
+	echo -n "::: Indexing domains for list queries..."
+	tmpDir=$(mktemp -d)
+	tab=$'\t'
+	# Tag the lines of every list with its number, the lines of a list are cached with its horizon
+	for i in "${!horizons[@]}"; do
+		lines="${horizons[$i]%.*}.${linesExtension}"
+		if [[ ! -f "${lines}" ]]; then
+			gravity_lineOffsets "${matter[$i]}" "${lines}.tmp"
+			mv "${lines}.tmp" "${lines}"
+		fi
+		awk -F '\t' -v id="$((i+1))" '{ print $1 "\t" id ":" $2 }' "${lines}" > "${tmpDir}/${i}.tags"
+	done
+	touch "${tmpDir}/empty.tags" "${tmpDir}/upper"
+	# The event horizon is list 0, its domains are looked up in lower case and the few that are not get sorted again
+	LC_ALL=C awk -v sortCmd="LC_ALL=C sort -t '${tab}' -k1,1 > '${tmpDir}/upper'" '
+			{
+				line = tolower($0) "\t0:" (offset + 0)
+				offset += length($0) + 1
+			}
+			/[A-Z]/ { print line | sortCmd; next }
+			{ print line }
+			END { close(sortCmd) }' "${piholeDir}/${preEventHorizon}" > "${tmpDir}/lower"
+	# One line per domain, followed by the numbers of the lists it is found in and where
+	LC_ALL=C sort -m -t "${tab}" -k1,1 "${tmpDir}"/*.tags "${tmpDir}/lower" "${tmpDir}/upper" \
+		| awk -F '\t' '
+			function report() {
+				if (ids != "") print domain "\t" ids "\t" refs
+			}
+			$1 != domain {
+				report()
+				domain = $1
+				ids = ""
+				refs = ""
+				split("", seen)
+			}
+			{
+				refs = (refs == "") ? $2 : refs " " $2
+				split($2, ref, ":")
+				if (ref[1] != 0 && !(ref[1] in seen)) {
+					ids = (ids == "") ? ref[1] : ids "," ref[1]
+					seen[ref[1]]
+				}
+			}
+			END { report() }' > "${indexFile}.tmp"
+	mv "${indexFile}.tmp" "${indexFile}"
+	echo "${sources}" > "${indexSources}"
+	rm -rf "${tmpDir}"
+	echo " done!"
+}
+
+# horizonStamp - fingerprint of everything gravity.list is built from
+gravity_horizonStamp() {
+	# ${1}: whitelist to use instead of whitelist.txt
+	{
+		cat "${horizonManifest}" "${1:-${whitelistFile}}" 2> /dev/null
+		echo "${IPV4_ADDRESS} ${IPV6_ADDRESS} ${compactFormat} ${wildcardFanout}"
+		# Domains below a wildcard are left out of gravity.list
+		cat "${wildcardlist}" 2> /dev/null
+	} | sha1sum | cut -d ' ' -f 1
+}
+
+# metricHeader - print the help and type lines of a gauge
+gravity_metricHeader() {
+	echo "# HELP pihole_gravity_${1} ${2}"
+	echo "# TYPE pihole_gravity_${1} gauge"
+}
+
+# metrics - write the statistics of this run for the metrics collector of chronometer.sh
+gravity_metrics() {
+	local i url labels stats status seconds bytes
+	{
+		if [[ "${#transportStats[@]}" -eq 0 ]]; then
+			# The lists were not downloaded this time, their statistics still stand
+			grep "pihole_gravity_source_" "${gravityMetrics}" 2> /dev/null
+		else
+			labels=()
+			status=()
+			seconds=()
+			bytes=()
+			for ((i = 0; i < "${#sources[@]}"; i++)); do
+				url=${sources[$i]//\\/\\\\}
+				labels[$i]="{list=\"${i}\",url=\"${url//\"/\\\"}\"}"
+				stats=(${transportStats[$i]})
+				status[$i]=${stats[0]:-0}
+				seconds[$i]=${stats[1]:-0}
+				bytes[$i]=${stats[2]:-0}
+			done
+			gravity_metricHeader "source_domains" "Domains in the list"
+			for i in "${!labels[@]}"; do echo "pihole_gravity_source_domains${labels[$i]} ${sourceDomains[$i]:-0}"; done
+			gravity_metricHeader "source_http_status" "HTTP status of the last download of the list"
+			for i in "${!labels[@]}"; do echo "pihole_gravity_source_http_status${labels[$i]} ${status[$i]}"; done
+			gravity_metricHeader "source_download_seconds" "Duration of the last download of the list"
+			for i in "${!labels[@]}"; do echo "pihole_gravity_source_download_seconds${labels[$i]} ${seconds[$i]}"; done
+			gravity_metricHeader "source_download_bytes" "Size of the last download of the list"
+			for i in "${!labels[@]}"; do echo "pihole_gravity_source_download_bytes${labels[$i]} ${bytes[$i]}"; done
+		fi
+		gravity_metricHeader "unique_domains" "Unique domains pulled in from the lists"
+		echo "pihole_gravity_unique_domains $(cat "${piholeDir}/${preEventHorizon}" 2> /dev/null | wc -l)"
+		gravity_metricHeader "whitelisted_domains" "Domains in whitelist.txt"
+		echo "pihole_gravity_whitelisted_domains $(cat "${whitelistFile}" 2> /dev/null | wc -l)"
+		gravity_metricHeader "blacklisted_domains" "Domains in blacklist.txt"
+		echo "pihole_gravity_blacklisted_domains $(cat "${blacklistFile}" 2> /dev/null | wc -l)"
+		gravity_metricHeader "wildcard_domains" "Wildcard blocked domains"
+		echo "pihole_gravity_wildcard_domains ${numWildcards:-0}"
+		if [[ -z "${numEclipsed}" ]]; then
+			# gravity.list was kept as it was, and so were these
+			grep "pihole_gravity_eclipsed_\|pihole_gravity_promoted_" "${gravityMetrics}" 2> /dev/null
+		else
+			gravity_metricHeader "promoted_wildcards" "Listed domains blocked as wildcards for their many listed subdomains"
+			echo "pihole_gravity_promoted_wildcards ${numPromoted:-0}"
+			gravity_metricHeader "eclipsed_domains" "Domains left out of gravity.list as wildcards block them"
+			echo "pihole_gravity_eclipsed_domains ${numEclipsed}"
+			gravity_metricHeader "eclipsed_bytes" "Bytes gravity.list is smaller for the domains left out"
+			echo "pihole_gravity_eclipsed_bytes ${eclipsedBytes:-0}"
+		fi
+		gravity_metricHeader "last_update_timestamp_seconds" "Time of the last gravity run"
+		echo "pihole_gravity_last_update_timestamp_seconds $(date +%s)"
+	} > "${gravityMetrics}.tmp"
+	mv "${gravityMetrics}.tmp" "${gravityMetrics}"
 }
 
 gravity_reload() {
@@ -402,58 +1000,273 @@ gravity_reload() {
 	#Now replace the line in dnsmasq file
 #	sed -i "s/^addn-hosts.*/addn-hosts=$adList/" /etc/dnsmasq.d/01-pihole.conf
 
-	"${PIHOLE_COMMAND}" restartdns
+	# The lists are swapped in place, dnsmasq only restarts when its configuration changed
+	"${PIHOLE_COMMAND}" restartdns reload
 	echo " done!"
 }
 
-for var in "$@"; do
-	case "${var}" in
-		"-f" | "--force"     ) forceGrav=true;;
-		"-h" | "--help"      ) helpFunc;;
-		"-sd" | "--skip-download"    ) skipDownload=true;;
-		"-b" | "--blacklist-only"    ) blackListOnly=true;;
-	esac
-done
+# profileSample - wall clock, CPU time and I/O of this shell and the commands it has waited for
+gravity_profileSample() {
+	# Sets profileSample to: wall ms, CPU ms, bytes read, bytes written, bytes read from disk, bytes written to disk
+	local line stat io i ioFile="/proc/${BASHPID}/io"
+	local -A ioBytes=()
+	# The CPU time of this very shell (utime, stime, cutime, cstime), read without starting a process.
+	# A download runs in a subshell of its own, which starts out with none of gravity's time
+	read -r line 2> /dev/null < "/proc/${BASHPID}/stat"
+	# Skip the command name, it may contain spaces
+	stat=(${line##*) })
+	# The kernel adds the I/O of every child to its parent when it is waited for.
+	# The counters change while they are read, so read them in one go instead of line by line
+	io=($(cat "${ioFile}" 2> /dev/null))
+	for ((i = 0; i + 1 < "${#io[@]}"; i += 2)); do
+		ioBytes[${io[$i]%:}]=${io[$((i + 1))]}
+	done
+	profileSample=("$(date +%s%3N)" $(((stat[11] + stat[12] + stat[13] + stat[14]) * 1000 / profileTicks))
+		"${ioBytes[rchar]:-0}" "${ioBytes[wchar]:-0}" "${ioBytes[read_bytes]:-0}" "${ioBytes[write_bytes]:-0}")
+}
+
+# profileSampler - keep the peak RSS of every process tree being measured
+gravity_profileSampler() {
+	# Every ${profileDir}/<pid>-<depth>.peak holds the peak RSS (kB) of <pid> and its descendants.
+	# A tick takes one ps and one awk, few enough not to weigh on what is being measured
+	local peaks
+	while [[ -d "${profileDir}" ]]; do
+		peaks=("${profileDir}"/*.peak)
+		if [[ -f "${peaks[0]}" ]]; then
+			ps -e -o pid=,ppid=,rss= | awk '
+				NR == FNR {
+					parent[$1] = $2
+					rss[$1] = $3
+					next
+				}
+				{
+					root = FILENAME
+					sub(/.*\//, "", root)
+					sub(/-.*/, "", root)
+					owner[FILENAME] = root
+					peak[FILENAME] = $1 + 0
+					roots[root]
+				}
+				END {
+					# Every process counts for each measured process it descends from
+					for (pid in rss) {
+						for (node = pid; node > 1; node = parent[node]) {
+							if (node in roots) sum[node] += rss[pid]
+						}
+					}
+					for (file in peak) {
+						if (sum[owner[file]] > peak[file]) {
+							print sum[owner[file]] > file
+							close(file)
+						}
+					}
+				}' - "${peaks[@]}" 2> /dev/null
+		fi
+		sleep 0.25
+	done
+}
 
-if [[ "${forceGrav}" == true ]]; then
-	echo -n "::: Deleting exising list cache..."
-	rm /etc/pihole/list.*
+# profileStart - start measuring this run
+gravity_profileStart() {
+	profileOptions="$*"
+	profileDir=$(mktemp -d)
+	# Also stops the sampler when gravity exits early
+	trap 'rm -rf "${profileDir}"' EXIT
+	profileSeq=0
+	profileDepth=0
+	profilePageKb=$(($(getconf PAGESIZE 2> /dev/null || echo 4096) / 1024))
+	profileTicks=$(getconf CLK_TCK 2> /dev/null || echo 100)
+	echo 0 > "${profileDir}/${BASHPID}-0.peak"
+	# Started from a subshell so that it is not one of the jobs gravity_spinup waits for,
+	# the sampler stops once the profile directory is gone
+	( gravity_profileSampler > /dev/null 2>&1 & )
+	gravity_profileSample
+	profileStarted=("${profileSample[@]}")
+}
+
+# profileRecord - append the difference to a sample taken at the start of a stage
+gravity_profileRecord() {
+	# ${1}: name, ${2}: list number or empty, ${3}: peak file, remaining arguments: the starting sample
+	local name="${1}" list="${2}" peak="${3}" rss=0 statm
+	shift 3
+	gravity_profileSample
+	read -r rss 2> /dev/null < "${peak}"
+	rm -f "${peak}"
+	# A stage over before the sampler came round uses at least what this shell does
+	read -r -a statm 2> /dev/null < "/proc/${BASHPID}/statm"
+	if [[ "${rss:-0}" -lt $((${statm[1]:-0} * profilePageKb)) ]]; then
+		rss=$((statm[1] * profilePageKb))
+	fi
+	printf "%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" "${profileSeq}" "${name}" "${list}" \
+		$((profileSample[0] - ${1})) $((profileSample[1] - ${2})) "${rss:-0}" \
+		$((profileSample[2] - ${3})) $((profileSample[3] - ${4})) \
+		$((profileSample[4] - ${5})) $((profileSample[5] - ${6})) >> "${profileDir}/records"
+}
+
+# stage - run a gravity_* stage or download, measuring it when profiling
+gravity_stage() {
+	# ${1}: name of the stage, remaining arguments: the command to run
+	local profileStage="${profileStage:+${profileStage}/}${1}" profileDepth=$((profileDepth + 1))
+	local started peak status seq
+	shift
+	if [[ "${profile}" != true ]]; then
+		"$@"
+		return
+	fi
+	# Nested stages are named after the stages they run in (e.g. gravity_advanced/gravity_unique)
+	profileSeq=$((profileSeq + 1))
+	seq=${profileSeq}
+	peak="${profileDir}/${BASHPID}-${profileDepth}.peak"
+	echo 0 > "${peak}"
+	gravity_profileSample
+	started=("${profileSample[@]}")
+	"$@"
+	status=$?
+	profileSeq=${seq} gravity_profileRecord "${profileStage}" "${profileList}" "${peak}" "${started[@]}"
+	return ${status}
+}
+
+# profileReport - append this run to the profile and print where the time went
+gravity_profileReport() {
+	local i
+	profileSeq=0 profileList="" gravity_profileRecord "total" "" "${profileDir}/${BASHPID}-0.peak" "${profileStarted[@]}"
+	# The list number, URL and transport statistics of every download
+	for ((i = 0; i < "${#sources[@]}"; i++)); do
+		printf "%s\t%s\t%s\n" "${i}" "${sources[$i]}" "${transportStats[$i]}"
+	done > "${profileDir}/sources"
+	echo ":::"
+	echo "::: Profile (wall, CPU, peak RSS, read, written):"
+	# Stages in the order they started, downloads by list number
+	LC_ALL=C sort -s -t "$(printf '\t')" -k1,1n -k3,3n "${profileDir}/records" > "${profileDir}/stages"
+	awk -F '\t' -v sources="${profileDir}/sources" -v started="$((profileStarted[0] / 1000))" -v options="${profileOptions}" -v report="${profileDir}/report" '
+		function json(text) {
+			gsub(/\\/, "\\\\", text)
+			gsub(/"/, "\\\"", text)
+			return "\"" text "\""
+		}
+		function measures() {
+			return sprintf("\"wall_seconds\":%.3f,\"cpu_seconds\":%.3f,\"peak_rss_kb\":%d,\"read_bytes\":%d,\"write_bytes\":%d,\"disk_read_bytes\":%d,\"disk_write_bytes\":%d", \
+				$4 / 1000, $5 / 1000, $6, $7, $8, $9, $10)
+		}
+		FILENAME == sources {
+			url[$1] = $2
+			split($3, transport, " ")
+			httpStatus[$1] = transport[1] + 0
+			downloadSeconds[$1] = transport[2] + 0
+			downloadBytes[$1] = transport[3] + 0
+			next
+		}
+		$2 == "total" { total = measures() }
+		$3 != "" {
+			downloads = downloads (downloads == "" ? "" : ",") "{\"list\":" $3 ",\"url\":" json(url[$3]) \
+				",\"http_status\":" httpStatus[$3] ",\"download_seconds\":" downloadSeconds[$3] \
+				",\"download_bytes\":" downloadBytes[$3] "," measures() "}"
+			name = "list " $3
+		}
+		$2 != "total" && $3 == "" {
+			stages = stages (stages == "" ? "" : ",") "{\"stage\":" json($2) "," measures() "}"
+			name = $2
+		}
+		$2 == "total" { name = "total" }
+		{ printf ":::   %-40s %8.2fs %8.2fs %8.1f MB %8.1f MB %8.1f MB\n", name, $4 / 1000, $5 / 1000, $6 / 1024, $7 / 1048576, $8 / 1048576 }
+		END {
+			printf "{\"started\":%d,\"options\":%s,%s,\"stages\":[%s],\"downloads\":[%s]}\n", \
+				started, json(options), total, stages, downloads > report
+		}' "${profileDir}/sources" "${profileDir}/stages"
+	# Keep the reports of the last runs
+	{
+		tail -n $((profileRuns - 1)) "${profileFile}" 2> /dev/null
+		cat "${profileDir}/report"
+	} > "${profileFile}.tmp"
+	mv "${profileFile}.tmp" "${profileFile}"
+	echo "::: Profile appended to ${profileFile}"
+	rm -rf "${profileDir}"
+}
+
+gravity_main() {
+	for var in "$@"; do
+		case "${var}" in
+			"-f" | "--force"     ) forceGrav=true;;
+			"-h" | "--help"      ) helpFunc;;
+			"-sd" | "--skip-download"    ) skipDownload=true;;
+			"-b" | "--blacklist-only"    ) blackListOnly=true;;
+			"-w" | "--whitelist-only"    ) whiteListOnly=true;;
+			"--profile"          ) profile=true;;
+		esac
+	done
+
+	if [[ "${profile}" == true ]]; then
+		gravity_profileStart "$@"
+	fi
+
+	if [[ "${whiteListOnly}" == true ]]; then
+		if gravity_stage gravity_whitelistDelta gravity_whitelistDelta; then
+			blackListOnly=true
+		else
+			echo "::: gravity.list does not match the last whitelist, rebuilding it..."
+			skipDownload=true
+		fi
+	fi
+
+	if [[ "${forceGrav}" == true ]]; then
+		echo -n "::: Deleting exising list cache..."
+		rm /etc/pihole/list.*
+		rm -rf "${horizonCache}"
+		echo " done!"
+	fi
+
+	if [[ ! "${blackListOnly}" == true ]]; then
+	  gravity_stage gravity_collapse gravity_collapse
+	  gravity_stage gravity_spinup gravity_spinup
+	  if [[ "${skipDownload}" == false ]]; then
+	    gravity_stage gravity_Schwarzchild gravity_Schwarzchild
+	    gravity_stage gravity_advanced gravity_advanced
+	  else
+	    echo "::: Using cached Event Horizon list..."
+	    gravity_sortHorizon
+	    numberOf=$(wc -l < ${piholeDir}/${preEventHorizon})
+	    echo "::: $numberOf unique domains trapped in the event horizon."
+	  fi
+	  gravity_stage gravity_Whitelist gravity_Whitelist
+	  if [[ "${horizonUnchanged}" != true ]]; then
+	    gravity_stage gravity_eclipse gravity_eclipse
+	  fi
+	fi
+	gravity_stage gravity_Blacklist gravity_Blacklist
+	gravity_stage gravity_Wildcard gravity_Wildcard
+
+	echo -n "::: Formatting domains into a HOSTS file..."
+	if [[ ! "${blackListOnly}" == true ]]; then
+	  gravity_stage gravity_hostFormatLocal gravity_hostFormatLocal
+	  if [[ "${horizonUnchanged}" != true ]]; then
+	    gravity_stage gravity_hostFormatGravity gravity_hostFormatGravity
+	  fi
+	fi
+	gravity_stage gravity_hostFormatBlack gravity_hostFormatBlack
 	echo " done!"
-fi
 
-if [[ ! "${blackListOnly}" == true ]]; then
-  gravity_collapse
-  gravity_spinup
-  if [[ "${skipDownload}" == false ]]; then
-    gravity_Schwarzchild
-    gravity_advanced
-  else
-    echo "::: Using cached Event Horizon list..."
-    numberOf=$(wc -l < ${piholeDir}/${preEventHorizon})
-    echo "::: $numberOf unique domains trapped in the event horizon."
-  fi
-  gravity_Whitelist
-fi
-gravity_Blacklist
-gravity_Wildcard
+	if [[ ! "${blackListOnly}" == true ]]; then
+	  gravity_stage gravity_blackbody gravity_blackbody
+	fi
 
-echo -n "::: Formatting domains into a HOSTS file..."
-if [[ ! "${blackListOnly}" == true ]]; then
-  gravity_hostFormatLocal
-  gravity_hostFormatGravity
-fi
-gravity_hostFormatBlack
-echo " done!"
+	if [[ ! "${blackListOnly}" == true ]]; then
+	  #Clear no longer needed files...
+	  echo ":::"
+	  echo -n "::: Cleaning up un-needed files..."
+	  rm -f ${piholeDir}/pihole.*.txt
+	  echo " done!"
+	fi
 
-gravity_blackbody
+	gravity_stage gravity_metrics gravity_metrics
+	gravity_stage gravity_reload gravity_reload
+	"${PIHOLE_COMMAND}" status
 
-if [[ ! "${blackListOnly}" == true ]]; then
-  #Clear no longer needed files...
-  echo ":::"
-  echo -n "::: Cleaning up un-needed files..."
-  rm ${piholeDir}/pihole.*.txt
-  echo " done!"
-fi
+	if [[ "${profile}" == true ]]; then
+		gravity_profileReport
+	fi
+}
 
-gravity_reload
-"${PIHOLE_COMMAND}" status
+# Only run when executed, sourcing the script just provides its functions
+if [[ "${BASH_SOURCE[0]}" == "${0}" ]]; then
+	gravity_main "$@"
+fi
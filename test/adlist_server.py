@@ -0,0 +1,134 @@
+''' Offline stand-in for the adlist sources, used by the gravity benchmarks
+
+Generates synthetic adlists and replays them over HTTP the way list hosts do,
+so gravity.sh can be run end to end without a network.
+
+Usage:
+  python adlist_server.py --root DIR --generate DOMAINS
+      write lists holding DOMAINS unique domains in total into DIR:
+        hosts-crlf.txt  half of them as "0.0.0.0 domain" with CRLFs and inline comments
+        plain.txt       three tenths as bare domains, a third of them also in hosts-crlf.txt
+        hosts-tab.txt   a fifth as "127.0.0.1<TAB>domain", some of them in upper case
+      every list also has comment lines and domains listed twice
+  python adlist_server.py --root DIR [--port-file PATH] [--log PATH]
+      serve DIR on a free port on localhost and write the port to the port file.
+      Lists have an ETag and a Last-Modified date, a request with a matching
+      If-None-Match or an If-Modified-Since that is not older gets 304.
+      /status/<code>/<anything> answers with that status, to stand in for broken sources.
+      Every request is logged as "<path> <status>", one per line.
+'''
+import argparse
+import email.utils
+import os
+import socket
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+CHUNK = 100000
+
+
+def domain(i):
+    return 'ads%07d.tracker%d.example.com' % (i, i % 97)
+
+
+def write_list(path, first, count, line, newline='\n'):
+    ''' write count domains starting at number first, formatted by line(i, domain) '''
+    with open(path, 'w') as out:
+        out.write('# Synthetic adlist of %d domains%s' % (count, newline))
+        for start in range(first, first + count, CHUNK):
+            lines = []
+            for i in range(start, min(start + CHUNK, first + count)):
+                lines.append(line(i, domain(i)))
+                # Every 20th domain is listed twice, every 50th is followed by a comment line
+                if i % 20 == 0:
+                    lines.append(line(i, domain(i)))
+                if i % 50 == 0:
+                    lines.append('# section %d' % i)
+            out.write(newline.join(lines) + newline)
+
+
+def generate(root, total):
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    hosts, plain, tab = total // 2, total * 3 // 10, total - total // 2 - total * 3 // 10
+    write_list(os.path.join(root, 'hosts-crlf.txt'), 0, hosts,
+               lambda i, name: '0.0.0.0 %s%s' % (name, ' # inline comment' if i % 10 == 0 else ''),
+               newline='\r\n')
+    # A third of the plain list overlaps the hosts list
+    write_list(os.path.join(root, 'plain.txt'), hosts - plain // 3, plain,
+               lambda i, name: name)
+    write_list(os.path.join(root, 'hosts-tab.txt'), hosts - plain // 3 + plain, tab,
+               lambda i, name: '127.0.0.1\t%s' % (name.upper() if i % 7 == 0 else name))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def answer(self, status, headers=()):
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        if status != 200:
+            self.send_header('Content-Length', '0')
+        self.end_headers()
+        with open(self.server.log, 'a') as log:
+            log.write('%s %d\n' % (self.path, status))
+
+    def do_GET(self):
+        parts = self.path.split('/')
+        if len(parts) > 2 and parts[1] == 'status':
+            return self.answer(int(parts[2]))
+        path = os.path.join(self.server.root, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            return self.answer(404)
+        stat = os.stat(path)
+        mtime = int(stat.st_mtime)
+        etag = '"%x-%x"' % (mtime, stat.st_size)
+        validators = (('ETag', etag), ('Last-Modified', email.utils.formatdate(mtime, usegmt=True)))
+        since = self.headers.get('If-Modified-Since')
+        since = since and email.utils.parsedate_tz(since)
+        if self.headers.get('If-None-Match') == etag or (since and email.utils.mktime_tz(since) >= mtime):
+            return self.answer(304, validators)
+        self.answer(200, validators + (('Content-Length', str(stat.st_size)), ('Content-Type', 'text/plain')))
+        with open(path, 'rb') as source:
+            while True:
+                data = source.read(65536)
+                if not data:
+                    break
+                self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', required=True)
+    parser.add_argument('--generate', type=int)
+    parser.add_argument('--port-file', default='/tmp/adlist_server.port')
+    parser.add_argument('--log', default='/tmp/adlist_server.log')
+    args = parser.parse_args()
+
+    if args.generate:
+        return generate(args.root, args.generate)
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.root = args.root
+    server.log = args.log
+    server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    with open(args.port_file, 'w') as port_file:
+        port_file.write('%d\n' % server.server_address[1])
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
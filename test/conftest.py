@@ -1,14 +1,24 @@
+import threading
 import pytest
 import testinfra
+from .sandbox import Sandbox
 
 check_output = testinfra.get_backend(
     "local://"
 ).get_module("Command").check_output
 
 @pytest.fixture
-def Pihole(Docker):
+def Pihole(request, tag):
     ''' used to contain some script stubbing, now pretty much an alias.
-    Also provides bash as the default run function shell '''
+    Also provides bash as the default run function shell.
+    With --backend=sandbox tests run in a Sandbox, unless they are marked distro '''
+    if tag == 'sandbox':
+        sandbox = Sandbox()
+        request.addfinalizer(sandbox.stop)
+        return sandbox
+
+    Docker = request.getfixturevalue('Docker')
+
     def run_bash(self, command, *args, **kwargs):
         cmd = self.get_command(command, *args)
         if self.user is not None:
@@ -25,15 +35,61 @@ def Pihole(Docker):
     Docker.run = funcType(run_bash, Docker, testinfra.backend.docker.DockerBackend)
     return Docker
 
+class ContainerPool(object):
+    ''' keeps a started container of every image at hand, so a test does not
+    wait for docker run, and removes the used ones in the background '''
+    def __init__(self):
+        self.spares = {}
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def background(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.start()
+        with self.lock:
+            self.threads.append(thread)
+
+    def start_spare(self, docker_run):
+        docker_id = check_output(docker_run)
+        with self.lock:
+            self.spares.setdefault(docker_run, []).append(docker_id)
+
+    def take(self, docker_run):
+        ''' a started container of docker_run, a new spare is started behind it '''
+        with self.lock:
+            spares = self.spares.get(docker_run, [])
+            docker_id = spares.pop() if spares else None
+        if docker_id is None:
+            docker_id = check_output(docker_run)
+        self.background(self.start_spare, docker_run)
+        return docker_id
+
+    def remove(self, docker_id):
+        self.background(check_output, "docker rm -f %s", docker_id)
+
+    def close(self):
+        for thread in self.threads:
+            thread.join()
+        for spares in self.spares.values():
+            for docker_id in spares:
+                check_output("docker rm -f %s", docker_id)
+
+@pytest.fixture(scope='session')
+def container_pool(request):
+    ''' one pool per pytest process, every xdist worker has its own '''
+    pool = ContainerPool()
+    request.addfinalizer(pool.close)
+    return pool
+
 @pytest.fixture
-def Docker(request, args, image, cmd):
+def Docker(request, container_pool, args, image, cmd):
     ''' combine our fixtures into a docker run command and setup finalizer to cleanup '''
     assert 'docker' in check_output('id'), "Are you in the docker group?"
     docker_run = "docker run {} {} {}".format(args, image, cmd)
-    docker_id = check_output(docker_run)
+    docker_id = container_pool.take(docker_run)
 
     def teardown():
-        check_output("docker rm -f %s", docker_id)
+        container_pool.remove(docker_id)
     request.addfinalizer(teardown)
 
     docker_container = testinfra.get_backend("docker://" + docker_id)
@@ -45,9 +101,9 @@ def args(request):
     ''' -t became required when tput began being used '''
     return '-t -d'
 
-@pytest.fixture(params=['debian', 'centos'])
+@pytest.fixture
 def tag(request):
-    ''' consumed by image to make the test matrix '''
+    ''' consumed by image to make the test matrix, see pytest_generate_tests '''
     return request.param
 
 @pytest.fixture()
@@ -59,3 +115,36 @@ def image(request, tag):
 def cmd(request):
     ''' default to doing nothing by tailing null, but don't exit '''
     return 'tail -f /dev/null'
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true', default=False,
+                     help='also run the slow tests marked as benchmark')
+    parser.addoption('--benchmark-save', action='store_true', default=False,
+                     help='store the results of the gravity benchmarks as their baseline')
+    parser.addoption('--backend', choices=['docker', 'sandbox'], default='docker',
+                     help='run tests in a container per distro, or in a sandbox on this host '
+                          '(tests marked distro always get containers)')
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: slow, only run with --benchmark')
+    config.addinivalue_line('markers', 'distro: needs the packages and tools of a real distro, '
+                                       'always runs in the debian and centos containers')
+
+def pytest_generate_tests(metafunc):
+    ''' the debian x centos matrix, or a single sandbox run '''
+    if 'tag' not in metafunc.fixturenames:
+        return
+    tags = ['debian', 'centos']
+    if metafunc.config.getoption('--backend') == 'sandbox' and \
+            not metafunc.definition.get_closest_marker('distro'):
+        tags = ['sandbox']
+    metafunc.parametrize('tag', tags, indirect=True)
+
+def pytest_collection_modifyitems(config, items):
+    ''' benchmarks take minutes, only run them when asked for '''
+    if config.getoption('--benchmark'):
+        return
+    skip_benchmark = pytest.mark.skip(reason='needs --benchmark to run')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
@@ -0,0 +1,84 @@
+''' Stand-in resolver, used by the debug script tests
+
+Answers every A query with --address, AAAA queries with ::1 and the CHAOS TXT
+queries dnsmasq answers (cachesize.bind, servers.bind) with canned records,
+after waiting --latency seconds. Queries are answered in threads of their own,
+so slow answers do not hold up the ones after them.
+Every query is logged as "<name> <type>", one per line, so tests can count them.
+
+Usage: python dns_stub.py [--latency SECONDS] [--listen ADDRESS] [--port PORT]
+                          [--address IPV4] [--log PATH]
+'''
+import argparse
+import socket
+import struct
+import threading
+import time
+
+TYPES = {1: 'A', 16: 'TXT', 28: 'AAAA'}
+CHAOS_TXT = {
+    'cachesize.bind': '10000',
+    'servers.bind': '127.0.0.1#5353 12 0',
+}
+
+
+def question(query):
+    ''' name, type, class and the end offset of the first question of a query '''
+    labels = []
+    offset = 12
+    length = ord(query[offset:offset + 1])
+    while length:
+        labels.append(query[offset + 1:offset + 1 + length].decode('ascii'))
+        offset += length + 1
+        length = ord(query[offset:offset + 1])
+    qtype, qclass = struct.unpack('>HH', query[offset + 1:offset + 5])
+    return '.'.join(labels).lower(), qtype, qclass, offset + 5
+
+
+def answer(args, query):
+    name, qtype, qclass, end = question(query)
+    if qtype == 1:
+        rdata = socket.inet_aton(args.address)
+    elif qtype == 28:
+        rdata = socket.inet_pton(socket.AF_INET6, '::1')
+    elif qtype == 16 and name in CHAOS_TXT:
+        text = CHAOS_TXT[name].encode('ascii')
+        rdata = struct.pack('>B', len(text)) + text
+    else:
+        rdata = None
+    # Same id, a response with recursion available, the question and its answer
+    header = query[:2] + struct.pack('>HHHHH', 0x8180, 1, 1 if rdata else 0, 0, 0)
+    response = header + query[12:end]
+    if rdata:
+        response += struct.pack('>HHHIH', 0xc00c, qtype, qclass, 0, len(rdata)) + rdata
+    return name, TYPES.get(qtype, str(qtype)), response
+
+
+def serve(args, server, query, client):
+    time.sleep(args.latency)
+    name, qtype, response = answer(args, query)
+    with open(args.log, 'a') as log:
+        log.write('%s %s\n' % (name, qtype))
+    server.sendto(response, client)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--listen', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=53)
+    parser.add_argument('--address', default='192.168.1.10')
+    parser.add_argument('--log', default='/tmp/dns_stub.log')
+    args = parser.parse_args()
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind((args.listen, args.port))
+    while True:
+        query, client = server.recvfrom(512)
+        thread = threading.Thread(target=serve, args=(args, server, query, client))
+        thread.daemon = True
+        thread.start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+''' Stand-in for pihole-FTL's telnet API, used by the chronometer tests and benchmarks
+
+Listens on a free port on localhost, writes it to the port file like FTL does and
+answers every >command with a canned reply followed by ---EOM---.
+The replies to the commands that arrived in one read are sent in one write.
+Every connection and command is logged, one per line, so tests can count them.
+
+Usage: python ftl_stub.py [--latency SECONDS] [--no-pipeline] [--port-file PATH] [--log PATH]
+  --latency      wait this long before answering what arrived in one read
+  --no-pipeline  only answer the first command of what arrived in one read,
+                 like an FTL that does not support pipelined commands
+'''
+import argparse
+import socket
+import threading
+import time
+
+REPLIES = {
+    'stats': 'domains_being_blocked 123456\ndns_queries_today 7890\n'
+             'ads_blocked_today 1234\nads_percentage_today 15.6\n',
+    'recentBlocked': 'ads.example.com\n',
+    'top-ads (1)': '0 42 ads.example.com\n',
+    'top-domains (1)': '0 99 www.example.com\n',
+    'top-clients (1)': '0 120 192.168.1.20 laptop.lan\n',
+}
+
+
+def log(args, line):
+    with open(args.log, 'a') as log_file:
+        log_file.write(line + '\n')
+
+
+def serve(args, connection):
+    log(args, 'connect')
+    buffered = b''
+    while True:
+        data = connection.recv(4096)
+        if not data:
+            break
+        buffered += data
+        commands = []
+        while b'\n' in buffered:
+            line, buffered = buffered.split(b'\n', 1)
+            commands.append(line.decode('ascii').strip())
+        if args.no_pipeline:
+            commands = commands[:1]
+        time.sleep(args.latency)
+        replies = ''
+        for command in commands:
+            log(args, 'command ' + command)
+            replies += REPLIES.get(command.lstrip('>'), '') + '---EOM---\n'
+        # Answer everything that arrived together in one write
+        connection.sendall(replies.encode('ascii'))
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--no-pipeline', action='store_true')
+    parser.add_argument('--port-file', default='/var/run/pihole-FTL.port')
+    parser.add_argument('--log', default='/tmp/ftl_stub.log')
+    args = parser.parse_args()
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', 0))
+    server.listen(5)
+    with open(args.port_file, 'w') as port_file:
+        port_file.write('%d\n' % server.getsockname()[1])
+    while True:
+        connection, _ = server.accept()
+        thread = threading.Thread(target=serve, args=(args, connection))
+        thread.daemon = True
+        thread.start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+''' Local HTTP client for the block page tests and load benchmark
+
+Sends GET / with a Host header to a server on localhost, one request after the
+other on a new connection each, like browsers loading blocked frames do.
+
+Usage: python http_load.py --port PORT --host NAME [--requests N] [--print]
+  --requests  how many requests to send, the requests per second are printed
+  --print     print the body of the last response instead
+'''
+import argparse
+import sys
+import time
+
+try:
+    from httplib import HTTPConnection
+except ImportError:
+    from http.client import HTTPConnection
+
+
+def get(port, host):
+    connection = HTTPConnection('127.0.0.1', port)
+    connection.request('GET', '/', headers={'Host': host})
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    if response.status != 200:
+        sys.exit('status %d' % response.status)
+    return body
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--host', required=True)
+    parser.add_argument('--requests', type=int, default=1)
+    parser.add_argument('--print', action='store_true')
+    args = parser.parse_args()
+
+    start = time.time()
+    for _ in range(args.requests):
+        body = get(args.port, args.host)
+    if args.print:
+        sys.stdout.write(body.decode('utf-8'))
+    else:
+        print('%.1f' % (args.requests / (time.time() - start)))
+
+
+if __name__ == '__main__':
+    main()
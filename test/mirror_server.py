@@ -0,0 +1,88 @@
+''' Stand-in for GitHub's FTL releases and for Pi-hole mirrors, used by the install benchmark
+
+Serves the files below --root over HTTP on a free port on localhost and writes
+the port to the port file. Every answer waits --latency seconds first, to stand
+in for a server that is far away. With --latest TAG, HEAD or GET of any path
+ending in /releases/latest is redirected to .../releases/tag/TAG, like GitHub
+does. Every request is logged as "<path> <status>", one per line.
+
+Usage: python mirror_server.py --root DIR [--latest TAG] [--latency SECONDS]
+                               [--port-file PATH] [--log PATH]
+'''
+import argparse
+import os
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def answer(self, status, headers=()):
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        if status != 200:
+            self.send_header('Content-Length', '0')
+        self.end_headers()
+        with open(self.server.log, 'a') as log:
+            log.write('%s %d\n' % (self.path, status))
+
+    def do_HEAD(self, body=False):
+        time.sleep(self.server.latency)
+        path = self.path.split('?')[0]
+        if self.server.latest and path.endswith('/releases/latest'):
+            location = path[:-len('latest')] + 'tag/' + self.server.latest
+            return self.answer(302, (('Location', location),))
+        # Only files below the root are served
+        local = os.path.normpath(os.path.join(self.server.root, path.lstrip('/')))
+        if not local.startswith(self.server.root + os.sep) or not os.path.isfile(local):
+            return self.answer(404)
+        self.answer(200, (('Content-Length', str(os.path.getsize(local))),
+                          ('Content-Type', 'application/octet-stream')))
+        if body:
+            with open(local, 'rb') as source:
+                while True:
+                    data = source.read(65536)
+                    if not data:
+                        break
+                    self.wfile.write(data)
+
+    def do_GET(self):
+        self.do_HEAD(body=True)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', required=True)
+    parser.add_argument('--latest')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--port-file', default='/tmp/mirror_server.port')
+    parser.add_argument('--log', default='/tmp/mirror_server.log')
+    args = parser.parse_args()
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.root = os.path.abspath(args.root)
+    server.latest = args.latest
+    server.latency = args.latency
+    server.log = args.log
+    with open(args.port_file, 'w') as port_file:
+        port_file.write('%d\n' % server.server_address[1])
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+''' Lightweight stand-in for the test containers
+
+A Sandbox gives a test the same view a fresh test container has: the repository
+at /etc/.pihole, the scripts copied to /opt/pihole, empty /etc/pihole and
+/etc/dnsmasq.d, a private /tmp and a PATH where mock_command's stubs in
+/usr/local/bin come first. It is built from the host's own files in a user and
+mount namespace: every top level directory is a copy on write overlay of the
+host's, so tests can write anywhere without touching the host, and nothing is
+left behind once the sandbox stops. Processes a test starts in the background
+live in the sandbox's own pid namespace and go away with it.
+
+Every sandbox has a network namespace of its own with just a loopback interface,
+so tests can run servers on any port, 53 included, and nothing reaches out.
+
+Needs unprivileged user namespaces, util-linux's unshare and nsenter and ip.
+Starting one takes a few milliseconds instead of the seconds docker run takes,
+and sandboxes do not share any state, so they are safe to use from several
+pytest-xdist workers at once.
+'''
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Environment of every command, the same one the Dockerfiles set up
+ENV = {
+    'PATH': '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin:/opt/pihole',
+    'PH_TEST': 'true',
+    'HOME': '/root',
+    'TERM': 'xterm',
+    'LANG': 'C.UTF-8',
+}
+
+# Run as pid 1 of the sandbox by: sh -c SETUP sh ROOT REPO PYTHON
+# Builds the root on a tmpfs at ROOT, says ready and waits until the test
+# closes its stdin, which takes every process of the sandbox down with it.
+SETUP = r'''
+set -e
+root=$1 repo=$2 python=$3
+mount -t tmpfs sandbox "${root}"
+ip link set lo up
+layers="${root}/.layers"
+overlay() {
+  mkdir -p "${layers}/$2/upper" "${layers}/$2/work"
+  mount -t overlay overlay \
+    -o "userxattr,lowerdir=$1,upperdir=${layers}/$2/upper,workdir=${layers}/$2/work" "${root}$3"
+}
+for entry in /*; do
+  name=${entry#/}
+  if [ -L "${entry}" ]; then
+    ln -s "$(readlink "${entry}")" "${root}/${name}"
+    continue
+  fi
+  [ -d "${entry}" ] || continue
+  mkdir "${root}/${name}"
+  case "${name}" in
+    dev|proc|sys) mount --rbind "${entry}" "${root}/${name}" ;;
+    tmp) chmod 1777 "${root}/tmp" ;;
+    # Directories with other filesystems mounted below them can not be a
+    # lower layer in a user namespace, they are left empty
+    *) overlay "${entry}" "${name}" "/${name}" 2> /dev/null || true ;;
+  esac
+done
+
+# What the Dockerfiles do, on top of a host that may have Pi-hole installed
+rm -rf "${root}/etc/.pihole" "${root}/etc/pihole" "${root}/etc/dnsmasq.d" "${root}/opt/pihole" \
+  "${root}/usr/local/bin/pihole" "${root}/var/www/html" "${root}/etc/cron.d/pihole" \
+  "${root}/etc/sudoers.d/pihole" "${root}"/var/log/pihole* "${root}"/run/pihole*
+mkdir -p "${root}/etc/.pihole" "${root}/etc/pihole" "${root}/etc/dnsmasq.d" "${root}/opt/pihole" \
+  "${root}/usr/local/bin"
+overlay "${repo}" repo /etc/.pihole
+cp "${root}"/etc/.pihole/advanced/Scripts/*.sh "${root}/etc/.pihole/gravity.sh" "${root}/etc/.pihole/pihole" \
+  "${root}"/etc/.pihole/automated\ install/*.sh "${root}/opt/pihole/"
+chmod +x "${root}"/opt/pihole/*
+if ! PATH="${root}/usr/local/bin:${root}/usr/bin:${root}/bin" command -v python > /dev/null; then
+  ln -s "${python}" "${root}/usr/local/bin/python"
+fi
+
+cd "${root}"
+exec chroot . /bin/sh -c 'echo ready; read -r _'
+'''
+
+
+class Result(object):
+    ''' what Pihole.run returns: exit status and output of a command '''
+    def __init__(self, command, rc, stdout, stderr):
+        self.command = command
+        self.rc = rc
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def decode(output):
+    if isinstance(output, str):
+        return output
+    return output.decode('utf-8', 'replace')
+
+
+class Sandbox(object):
+    ''' a private root for one test, used like the Pihole fixture's containers '''
+
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix='pihole-sandbox-')
+        self.holder = subprocess.Popen(
+            ['unshare', '--user', '--map-root-user', '--mount', '--pid', '--net', '--fork', '--mount-proc',
+             '/bin/sh', '-c', SETUP, 'sh', self.root, REPO, sys.executable],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if decode(self.holder.stdout.readline()).strip() != 'ready':
+            self.holder.stdin.close()
+            error = decode(self.holder.stderr.read())
+            self.holder.wait()
+            os.rmdir(self.root)
+            raise RuntimeError('could not set up the sandbox: {}'.format(error))
+        # nsenter has to be pointed at pid 1 of the sandbox, the child of unshare
+        with open('/proc/{0}/task/{0}/children'.format(self.holder.pid)) as children:
+            self.pid = children.read().split()[0]
+
+    def get_command(self, command, *args):
+        ''' quotes args into command like testinfra does '''
+        if args:
+            return command % tuple(quote(arg) for arg in args)
+        return command
+
+    def run(self, command, *args):
+        cmd = self.get_command(command, *args)
+        # Output goes to files, so commands can leave processes running in the background
+        with open(os.devnull) as stdin, tempfile.TemporaryFile() as stdout, \
+                tempfile.TemporaryFile() as stderr:
+            rc = subprocess.call(
+                ['nsenter', '--target', self.pid, '--user', '--mount', '--pid', '--net', '--root', '--wd',
+                 '/bin/bash', '-c', cmd],
+                env=ENV, stdin=stdin, stdout=stdout, stderr=stderr)
+            stdout.seek(0)
+            stderr.seek(0)
+            return Result(cmd, rc, decode(stdout.read()), decode(stderr.read()))
+
+    def stop(self):
+        self.holder.stdin.close()
+        self.holder.stdout.close()
+        self.holder.stderr.close()
+        self.holder.wait()
+        # The tmpfs only ever existed in the sandbox's mount namespace
+        shutil.rmtree(self.root, ignore_errors=True)
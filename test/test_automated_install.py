@@ -81,6 +81,7 @@ def test_configureFirewall_firewalld_running_no_errors(Pihole):
     assert 'firewall-cmd --permanent --add-service=http --add-service=dns' in firewall_calls
     assert 'firewall-cmd --reload' in firewall_calls
 
+@pytest.mark.distro
 def test_configureFirewall_firewalld_disabled_no_errors(Pihole):
     ''' confirms firewalld rules are not applied when firewallD is not running '''
     # firewallD returns non-running status
@@ -105,6 +106,7 @@ def test_configureFirewall_firewalld_enabled_declined_no_errors(Pihole):
     expected_stdout = 'Not installing firewall rulesets.'
     assert expected_stdout in configureFirewall.stdout
 
+@pytest.mark.distro
 def test_configureFirewall_no_firewall(Pihole):
     ''' confirms firewall skipped no daemon is running '''
     configureFirewall = Pihole.run('''
@@ -274,6 +276,7 @@ def test_installPiholeWeb_already_populated_no_errors(Pihole):
     assert 'index.js' in web_directory
     assert 'blockingpage.css' in web_directory
 
+@pytest.mark.distro
 def test_update_package_cache_success_no_errors(Pihole):
     ''' confirms package cache was updated without any errors'''
     updateCache = Pihole.run('''
@@ -285,6 +288,7 @@ def test_update_package_cache_success_no_errors(Pihole):
     assert 'ERROR' not in updateCache.stdout
     assert 'done!' in updateCache.stdout
 
+@pytest.mark.distro
 def test_update_package_cache_failure_no_errors(Pihole):
     ''' confirms package cache was not updated'''
     mock_command('apt-get', {'update':('', '1')}, Pihole)
@@ -297,6 +301,7 @@ def test_update_package_cache_failure_no_errors(Pihole):
     assert 'ERROR' in updateCache.stdout
     assert 'done!' not in updateCache.stdout
 
+@pytest.mark.distro
 def test_FTL_detect_aarch64_no_errors(Pihole):
     ''' confirms only aarch64 package is downloaded for FTL engine '''
     # mock uname to return aarch64 platform
@@ -310,6 +315,7 @@ def test_FTL_detect_aarch64_no_errors(Pihole):
     expected_stdout = 'Detected ARM-aarch64 architecture'
     assert expected_stdout in detectPlatform.stdout
 
+@pytest.mark.distro
 def test_FTL_detect_armv6l_no_errors(Pihole):
     ''' confirms only armv6l package is downloaded for FTL engine '''
     # mock uname to return armv6l platform
@@ -323,6 +329,7 @@ def test_FTL_detect_armv6l_no_errors(Pihole):
     expected_stdout = 'Detected ARM-hf architecture (armv6 or lower)'
     assert expected_stdout in detectPlatform.stdout
 
+@pytest.mark.distro
 def test_FTL_detect_armv7l_no_errors(Pihole):
     ''' confirms only armv7l package is downloaded for FTL engine '''
     # mock uname to return armv7l platform
@@ -336,6 +343,7 @@ def test_FTL_detect_armv7l_no_errors(Pihole):
     expected_stdout = 'Detected ARM-hf architecture (armv7+)'
     assert expected_stdout in detectPlatform.stdout
 
+@pytest.mark.distro
 def test_FTL_detect_x86_64_no_errors(Pihole):
     ''' confirms only x86_64 package is downloaded for FTL engine '''
     detectPlatform = Pihole.run('''
@@ -345,6 +353,7 @@ def test_FTL_detect_x86_64_no_errors(Pihole):
     expected_stdout = 'Detected x86_64 architecture'
     assert expected_stdout in detectPlatform.stdout
 
+@pytest.mark.distro
 def test_FTL_detect_unknown_no_errors(Pihole):
     ''' confirms only generic package is downloaded for FTL engine '''
     # mock uname to return generic platform
@@ -356,6 +365,7 @@ def test_FTL_detect_unknown_no_errors(Pihole):
     expected_stdout = 'Not able to detect architecture (unknown: mips)'
     assert expected_stdout in detectPlatform.stdout
 
+@pytest.mark.distro
 def test_FTL_download_aarch64_no_errors(Pihole):
     ''' confirms only aarch64 package is downloaded for FTL engine '''
     # mock uname to return generic platform
@@ -367,6 +377,7 @@ def test_FTL_download_aarch64_no_errors(Pihole):
     assert expected_stdout in download_binary.stdout
     assert 'failed' not in download_binary.stdout
 
+@pytest.mark.distro
 def test_FTL_download_unknown_fails_no_errors(Pihole):
     ''' confirms unknown binary is not downloaded for FTL engine '''
     # mock uname to return generic platform
@@ -378,6 +389,7 @@ def test_FTL_download_unknown_fails_no_errors(Pihole):
     assert expected_stdout in download_binary.stdout
     assert 'done' not in download_binary.stdout
 
+@pytest.mark.distro
 def test_FTL_binary_installed_and_responsive_no_errors(Pihole):
     ''' confirms FTL binary is copied and functional in installed location '''
     installed_binary = Pihole.run('''
@@ -388,6 +400,145 @@ def test_FTL_binary_installed_and_responsive_no_errors(Pihole):
     expected_stdout = 'v'
     assert expected_stdout in installed_binary.stdout
 
+# A release of a stand-in FTL binary, laid out like the artifact cache
+FTL_RELEASE = '''
+mkdir -p {root}/FTL/v9.9.9
+echo 'echo stand-in FTL' > {root}/FTL/v9.9.9/pihole-FTL-linux-x86_64
+(cd {root}/FTL/v9.9.9 && sha1sum pihole-FTL-linux-x86_64 > pihole-FTL-linux-x86_64.sha1)
+echo v9.9.9 > {root}/FTL/latest
+'''
+
+MIRROR_SERVER = '/etc/.pihole/test/mirror_server.py'
+
+# The checksum of the stand-in release, where GitHub publishes it
+GITHUB_RELEASE = '''
+mkdir -p /tmp/github/FTL/releases/download/v9.9.9
+cp {root}/FTL/v9.9.9/pihole-FTL-linux-x86_64.sha1 /tmp/github/FTL/releases/download/v9.9.9/
+'''
+
+def start_mirror_server(Pihole, name, root, options=''):
+    ''' serve root in the background and return its URL '''
+    return run_script(Pihole, '''
+    rm -f /tmp/{name}.port
+    python {server} --root {root} --port-file /tmp/{name}.port --log /tmp/{name}.log {options} > /dev/null 2>&1 &
+    until [ -s /tmp/{name}.port ]; do sleep 0.1; done
+    echo "http://127.0.0.1:$(cat /tmp/{name}.port)"
+    '''.format(name=name, server=MIRROR_SERVER, root=root, options=options)).stdout.strip()
+
+def test_FTL_install_from_artifact_cache_without_network(Pihole):
+    ''' confirms a binary downloaded by an earlier install is installed again '''
+    run_script(Pihole, FTL_RELEASE.format(root='/var/cache/pihole'))
+    installed_binary = Pihole.run('''
+    source /opt/pihole/basic-install.sh
+    FTLreleasesUrl=http://127.0.0.1:9/FTL/releases
+    FTLinstall pihole-FTL-linux-x86_64
+    cat /usr/bin/pihole-FTL
+    ''')
+    assert 'done' in installed_binary.stdout
+    assert 'echo stand-in FTL' in installed_binary.stdout
+
+def test_FTL_install_from_mirror_fills_artifact_cache(Pihole):
+    ''' confirms the binary is taken from the mirror and cached, and the
+    release and its checksum from GitHub '''
+    run_script(Pihole, FTL_RELEASE.format(root='/tmp/mirror') + GITHUB_RELEASE.format(root='/tmp/mirror')
+               + 'echo v0.0.1 > /tmp/mirror/FTL/latest')
+    github = start_mirror_server(Pihole, 'github', '/tmp/github', '--latest v9.9.9')
+    installed_binary = Pihole.run('''
+    source /opt/pihole/basic-install.sh
+    FTLreleasesUrl={}/FTL/releases
+    mirrorUrl=file:///tmp/mirror
+    FTLinstall pihole-FTL-linux-x86_64
+    '''.format(github))
+    assert 'done' in installed_binary.stdout
+    assert Pihole.run('cat /tmp/github.log').stdout.splitlines() == [
+        '/FTL/releases/latest 302', '/FTL/releases/download/v9.9.9/pihole-FTL-linux-x86_64.sha1 200']
+    assert Pihole.run('cmp /tmp/mirror/FTL/v9.9.9/pihole-FTL-linux-x86_64 /usr/bin/pihole-FTL').rc == 0
+    cached = Pihole.run('cat /var/cache/pihole/FTL/latest /var/cache/pihole/FTL/v9.9.9/*.sha1').stdout
+    assert 'v9.9.9\n' in cached
+    assert 'pihole-FTL-linux-x86_64' in cached
+
+def test_FTL_install_rejects_corrupt_mirror_download(Pihole):
+    ''' confirms a binary that does not match the checksum on GitHub is not
+    installed, even with a checksum of the mirror that matches it '''
+    run_script(Pihole, FTL_RELEASE.format(root='/tmp/mirror') + GITHUB_RELEASE.format(root='/tmp/mirror') + '''
+    cd /tmp/mirror/FTL/v9.9.9
+    echo corrupt >> pihole-FTL-linux-x86_64
+    sha1sum pihole-FTL-linux-x86_64 > pihole-FTL-linux-x86_64.sha1
+    ''')
+    github = start_mirror_server(Pihole, 'github', '/tmp/github', '--latest v9.9.9')
+    installed_binary = Pihole.run('''
+    source /opt/pihole/basic-install.sh
+    FTLreleasesUrl={}/FTL/releases
+    mirrorUrl=file:///tmp/mirror
+    FTLinstall pihole-FTL-linux-x86_64
+    '''.format(github))
+    assert 'failed' in installed_binary.stdout
+    assert Pihole.run('ls /usr/bin/pihole-FTL /var/cache/pihole/FTL/v9.9.9').rc != 0
+
+# Stand-ins for the core and web repositories, cloned from the one under test
+UPSTREAM_REPOS = '''
+git clone -q --bare /etc/.pihole /tmp/upstream/pi-hole.git
+git clone -q --bare /etc/.pihole /tmp/upstream/AdminLTE.git
+'''
+
+CLONE_REPOS = '''
+source /opt/pihole/basic-install.sh
+piholeGitUrl=file:///tmp/upstream/pi-hole.git
+webInterfaceGitUrl=file:///tmp/upstream/AdminLTE.git
+PI_HOLE_LOCAL_REPO=/tmp/core
+webInterfaceDir=/tmp/admin
+clone_or_update_repos
+'''
+
+def test_clone_or_update_repos_keeps_snapshots_for_later_installs(Pihole):
+    ''' confirms both repos are cloned, and later installs start from their
+    snapshots and only pull what changed since '''
+    run_script(Pihole, UPSTREAM_REPOS)
+    first = run_script(Pihole, CLONE_REPOS).stdout
+    assert first.index('Cloning file:///tmp/upstream/pi-hole.git') < first.index('Cloning file:///tmp/upstream/AdminLTE.git')
+    assert Pihole.run('ls /var/cache/pihole/repos').stdout.split() == ['AdminLTE.tar.gz', 'pi-hole.tar.gz']
+    run_script(Pihole, '''
+    git clone -q /tmp/upstream/pi-hole.git /tmp/work
+    cd /tmp/work
+    git -c user.name=test -c user.email=test@example.com commit -q --allow-empty -m 'After the snapshot'
+    git push -q origin HEAD
+    rm -rf /tmp/core /tmp/admin
+    ''')
+    second = run_script(Pihole, CLONE_REPOS).stdout
+    assert 'Restoring /tmp/core from a snapshot... done!' in second
+    assert 'Restoring /tmp/admin from a snapshot... done!' in second
+    assert 'Cloning' not in second
+    assert Pihole.run('git -C /tmp/core log -1 --format=%s').stdout.strip() == 'After the snapshot'
+
+def test_clone_or_update_repos_leaves_out_hooks_and_config_of_snapshots(Pihole):
+    ''' confirms a snapshot from a mirror can not have git run anything, and
+    the restored repo pulls from the repository it is meant to '''
+    run_script(Pihole, UPSTREAM_REPOS)
+    run_script(Pihole, CLONE_REPOS + '''
+    mkdir -p /tmp/snapshot /tmp/mirror/repos
+    tar -xzf /var/cache/pihole/repos/pi-hole.tar.gz -C /tmp/snapshot
+    printf '#!/bin/sh\\ntouch /tmp/hooked\\n' > /tmp/snapshot/.git/hooks/post-merge
+    chmod +x /tmp/snapshot/.git/hooks/post-merge
+    git -C /tmp/snapshot config core.fsmonitor 'touch /tmp/configured; false'
+    git -C /tmp/snapshot config remote.origin.url file:///tmp/elsewhere.git
+    tar -czf /tmp/mirror/repos/pi-hole.tar.gz -C /tmp/snapshot .
+    rm -rf /tmp/core /var/cache/pihole
+    ''')
+    restored = run_script(Pihole, CLONE_REPOS.replace('clone_or_update_repos', '''
+    artifactCache=/tmp/cache
+    mirrorUrl=file:///tmp/mirror
+    clone_or_update_repos''')).stdout
+    assert 'Restoring /tmp/core from a snapshot... done!' in restored
+    assert Pihole.run('ls /tmp/hooked /tmp/configured /tmp/core/.git/hooks/post-merge').rc != 0
+    assert Pihole.run('git -C /tmp/core config remote.origin.url').stdout.strip() == 'file:///tmp/upstream/pi-hole.git'
+
+def test_clone_or_update_repos_fails_when_a_repo_can_not_be_cloned(Pihole):
+    ''' confirms the install stops when one of the repos fetched at the same time fails '''
+    run_script(Pihole, 'git clone -q --bare /etc/.pihole /tmp/upstream/pi-hole.git')
+    clone = Pihole.run(CLONE_REPOS)
+    assert clone.rc == 1
+    assert 'Unable to clone file:///tmp/upstream/AdminLTE.git into /tmp/admin' in clone.stdout
+
 # def test_FTL_support_files_installed(Pihole):
 #     ''' confirms FTL support files are installed '''
 #     support_files = Pihole.run('''
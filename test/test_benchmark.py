@@ -0,0 +1,533 @@
+''' Benchmarks, run with: py.test --benchmark -s test/test_benchmark.py
+Add --benchmark-save to store the results of the gravity runs as the new baseline '''
+import json
+import os
+import pytest
+from textwrap import dedent
+from .test_automated_install import run_script, mock_command, start_mirror_server, UPSTREAM_REPOS
+from .test_gravity import SETUPVARS
+from .test_chronometer import start_ftl_stub, stop_ftl_stub
+from .test_blockpage import BLOCKLISTS, HTTP_LOAD, start_blockpage
+from .test_webpage import SETTINGS, BATCH
+
+# Runs /tmp/benchmark.sh and reports its wall time and the peak RSS of the
+# biggest process it started (kB, as reported by getrusage)
+MEASURE = dedent('''\
+    python -c "
+    import resource, subprocess, time
+    start = time.time()
+    rc = subprocess.call(['/bin/bash', '/tmp/benchmark.sh'])
+    print('%.3f %d %d' % (time.time() - start, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss, rc))
+    "''')
+
+
+def measure(Pihole, script):
+    ''' returns (wall seconds, peak RSS in kB) of script run by bash in the container '''
+    Pihole.run("cat <<'EOF'> /tmp/benchmark.sh\n{}\nEOF".format(dedent(script)))
+    result = run_script(Pihole, MEASURE)
+    seconds, rss, rc = result.stdout.split()[-3:]
+    assert rc == '0'
+    return float(seconds), int(rss)
+
+
+def report(name, **values):
+    print('{}: {}'.format(name, ', '.join(
+        '{}={}'.format(k, values[k]) for k in sorted(values))))
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('whitelist_size', [10, 100, 1000, 10000, 100000])
+def test_benchmark_whitelist(Pihole, whitelist_size):
+    ''' time and peak RSS of removing whitelisted domains from a 1M domain event horizon '''
+    run_script(Pihole, '''
+    cat <<EOF> /etc/pihole/setupVars.conf\n{}EOF
+    awk 'BEGIN {{ for (i = 0; i < 1000000; i++) printf "ads%07d.tracker%d.example.com\\n", i, i % 97 }}' | \\
+        LC_ALL=C sort -u > /tmp/preEventHorizon
+    # Half of the whitelist is blocked, the other half never was
+    awk -v n={} 'BEGIN {{ for (i = 0; i < n; i++) if (i % 2) printf "ads%07d.tracker%d.example.com\\n", i * 7, (i * 7) % 97; else printf "allowed%d.example.net\\n", i }}' \\
+        > /tmp/whitelist.txt
+    '''.format(SETUPVARS, whitelist_size))
+    grep_time, grep_rss = measure(Pihole, '''
+    grep -F -x -v -f /tmp/whitelist.txt /tmp/preEventHorizon > /tmp/legacy.eventHorizon
+    ''')
+    merge_time, merge_rss = measure(Pihole, '''
+    source /opt/pihole/gravity.sh > /dev/null
+    gravity_doWhitelist /tmp/preEventHorizon /tmp/whitelist.txt /tmp/new.eventHorizon
+    ''')
+    report('whitelist of {}'.format(whitelist_size),
+           grep_seconds=grep_time, grep_peak_rss_kb=grep_rss,
+           merge_seconds=merge_time, merge_peak_rss_kb=merge_rss)
+    assert Pihole.run('cmp /tmp/legacy.eventHorizon /tmp/new.eventHorizon').rc == 0
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('edit_size', [1, 10, 100, 1000])
+def test_benchmark_whitelist_edit(Pihole, edit_size):
+    ''' time of applying a whitelist edit to a 1M domain gravity.list
+    incrementally, against rebuilding gravity.list from the event horizon '''
+    run_script(Pihole, '''
+    cat <<EOF> /etc/pihole/setupVars.conf\n{}EOF
+    awk 'BEGIN {{ for (i = 0; i < 1000000; i++) printf "ads%07d.tracker%d.example.com\\n", i, i % 97 }}' | \\
+        LC_ALL=C sort -u > /etc/pihole/list.preEventHorizon
+    touch /etc/pihole/whitelist.txt
+    awk -v n={} 'BEGIN {{ for (i = 0; i < n; i++) printf "ads%07d.tracker%d.example.com\\n", i * 13, (i * 13) % 97 }}' \\
+        > /tmp/edit.txt
+    source /opt/pihole/gravity.sh > /dev/null
+    mkdir -p "${{horizonCache}}"
+    gravity_doWhitelist "${{piholeDir}}/${{preEventHorizon}}" "${{whitelistFile}}" "${{piholeDir}}/${{eventHorizon}}"
+    gravity_hostFormatGravity
+    '''.format(SETUPVARS, edit_size))
+    incremental_time, _ = measure(Pihole, '''
+    cat /tmp/edit.txt >> /etc/pihole/whitelist.txt
+    source /opt/pihole/gravity.sh > /dev/null
+    gravity_whitelistDelta > /dev/null
+    ''')
+    run_script(Pihole, 'sort /etc/pihole/gravity.list > /tmp/incremental.list')
+    rebuild_time, _ = measure(Pihole, '''
+    source /opt/pihole/gravity.sh > /dev/null
+    gravity_doWhitelist "${piholeDir}/${preEventHorizon}" "${whitelistFile}" "${piholeDir}/${eventHorizon}"
+    gravity_hostFormatGravity
+    ''')
+    report('whitelist edit of {}'.format(edit_size),
+           incremental_seconds=incremental_time, rebuild_seconds=rebuild_time)
+    compare = Pihole.run('sort /etc/pihole/gravity.list | cmp - /tmp/incremental.list')
+    assert compare.rc == 0
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('compact', ['false', 'true'])
+def test_benchmark_gravity_format(Pihole, compact):
+    ''' size of gravity.list for 2M domains, the time to write it and, when
+    dnsmasq is installed, the time dnsmasq takes to load it '''
+    run_script(Pihole, '''
+    cat <<EOF> /etc/pihole/setupVars.conf\n{}GRAVITY_COMPACT={}\nEOF
+    awk 'BEGIN {{ for (i = 0; i < 2000000; i++) printf "ads%07d.tracker%d.example.com\\n", i, i % 97 }}' | \\
+        LC_ALL=C sort -u > /etc/pihole/pihole.2.supernova.txt
+    '''.format(SETUPVARS, compact))
+    format_time, format_rss = measure(Pihole, '''
+    source /opt/pihole/gravity.sh > /dev/null
+    mkdir -p "${horizonCache}"
+    gravity_hostFormatGravity
+    ''')
+    size = int(Pihole.run('stat -c %s /etc/pihole/gravity.list').stdout)
+    load_time = None
+    if Pihole.run('command -v dnsmasq').rc == 0:
+        # dnsmasq logs how many addresses it read once gravity.list is loaded
+        load_time, _ = measure(Pihole, '''
+        rm -f /tmp/dnsmasq.log
+        dnsmasq --conf-file=/dev/null --port=5353 --listen-address=127.0.0.1 --bind-interfaces \\
+            --no-resolv --no-hosts --addn-hosts=/etc/pihole/gravity.list \\
+            --log-facility=/tmp/dnsmasq.log --pid-file=/tmp/dnsmasq.pid --user=root
+        until grep -q 'read /etc/pihole/gravity.list' /tmp/dnsmasq.log 2> /dev/null; do sleep 0.01; done
+        kill "$(cat /tmp/dnsmasq.pid)"
+        ''')
+    report('gravity.list of 2M domains, compact={}'.format(compact),
+           size_bytes=size, format_seconds=format_time, format_peak_rss_kb=format_rss,
+           dnsmasq_load_seconds=load_time)
+
+
+# Loads gravity.list into a dnsmasq of its own, with the wildcards, and waits until it is read
+DNSMASQ_LOAD = '''
+rm -f /tmp/dnsmasq.log
+dnsmasq --conf-file=/dev/null --port=5353 --listen-address=127.0.0.1 --bind-interfaces \\
+    --no-resolv --no-hosts --addn-hosts=/etc/pihole/gravity.list \\
+    --conf-file=/etc/dnsmasq.d/03-pihole-wildcard.conf --conf-file=/etc/dnsmasq.d/05-pihole-gravity-wildcard.conf \\
+    --log-facility=/tmp/dnsmasq.log --pid-file=/tmp/dnsmasq.pid --user=root
+until grep -q 'read /etc/pihole/gravity.list' /tmp/dnsmasq.log 2> /dev/null; do sleep 0.01; done
+kill "$(cat /tmp/dnsmasq.pid)"
+'''
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('wildcards', ['none', 'listed', 'promoted'])
+def test_benchmark_gravity_wildcards(Pihole, wildcards):
+    ''' size of gravity.list for 2M domains below 97 trackers, the time to
+    leave out what wildcards block and, when dnsmasq is installed, the time
+    dnsmasq takes to load it: without wildcards, with 20 of the trackers
+    blocked as wildcards and with the trackers themselves listed, so all of
+    them are promoted to wildcards '''
+    run_script(Pihole, '''
+    cat <<EOF> /etc/pihole/setupVars.conf\n{}GRAVITY_WILDCARD_FANOUT={}\nEOF
+    awk -v listed={} 'BEGIN {{
+        for (i = 0; i < 2000000; i++) printf "ads%07d.tracker%d.example.com\\n", i, i % 97
+        if (listed) for (i = 0; i < 97; i++) printf "tracker%d.example.com\\n", i
+    }}' | LC_ALL=C sort -u > /etc/pihole/list.preEventHorizon
+    touch /etc/pihole/whitelist.txt /etc/dnsmasq.d/03-pihole-wildcard.conf
+    if [ {} = listed ]; then
+        for i in $(seq 0 19); do
+            printf 'address=/tracker%d.example.com/192.168.1.10\\naddress=/tracker%d.example.com/fd00::10\\n' $i $i
+        done > /etc/dnsmasq.d/03-pihole-wildcard.conf
+    fi
+    source /opt/pihole/gravity.sh > /dev/null
+    mkdir -p "${{horizonCache}}"
+    gravity_doWhitelist "${{piholeDir}}/${{preEventHorizon}}" "${{whitelistFile}}" "${{piholeDir}}/${{eventHorizon}}"
+    cp "${{piholeDir}}/${{eventHorizon}}" /tmp/eventHorizon
+    '''.format(SETUPVARS, 1000 if wildcards == 'promoted' else 0, 1 if wildcards == 'promoted' else '', wildcards))
+    eclipse_time, eclipse_rss = measure(Pihole, '''
+    source /opt/pihole/gravity.sh > /dev/null
+    cp /tmp/eventHorizon "${piholeDir}/${eventHorizon}"
+    gravity_eclipse > /dev/null
+    ''')
+    run_script(Pihole, '''
+    source /opt/pihole/gravity.sh > /dev/null
+    touch /etc/dnsmasq.d/05-pihole-gravity-wildcard.conf
+    gravity_hostFormatGravity
+    ''')
+    size = int(Pihole.run('stat -c %s /etc/pihole/gravity.list').stdout)
+    load_time = None
+    if Pihole.run('command -v dnsmasq').rc == 0:
+        load_time, _ = measure(Pihole, DNSMASQ_LOAD)
+    report('gravity.list of 2M domains, wildcards={}'.format(wildcards),
+           size_bytes=size, eclipse_seconds=eclipse_time, eclipse_peak_rss_kb=eclipse_rss,
+           dnsmasq_load_seconds=load_time)
+
+
+# What get_ftl_stats did before: a new connection and a round trip for every command
+LEGACY_FTL_REFRESH = '''
+for refresh in $(seq 100); do
+    for command in "stats" "recentBlocked" "top-ads (1)" "top-domains (1)" "top-clients (1)"; do
+        exec 3<>"/dev/tcp/localhost/$(cat /var/run/pihole-FTL.port)"
+        echo -e ">${command}" >&3
+        until read -r -t 1 LINE <&3 && [[ "$LINE" == *"EOM"* ]]; do :; done
+        exec 3>&-
+    done
+done
+'''
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('latency', [0, 0.002, 0.01])
+def test_benchmark_chronometer_refresh(Pihole, latency):
+    ''' time of 100 chronometer refreshes of the FTL stats, with a new connection
+    per command against one kept open connection with pipelined commands '''
+    start_ftl_stub(Pihole, '--latency {}'.format(latency))
+    legacy_time, _ = measure(Pihole, LEGACY_FTL_REFRESH)
+    persistent_time, _ = measure(Pihole, '''
+    source /opt/pihole/chronometer.sh
+    for refresh in $(seq 100); do
+        get_ftl_stats
+    done
+    ''')
+    stop_ftl_stub(Pihole)
+    report('100 refreshes with {}s FTL latency'.format(latency),
+           legacy_seconds=legacy_time, persistent_seconds=persistent_time)
+
+
+ADLIST_SERVER = '/etc/.pihole/test/adlist_server.py'
+# Results of the end to end gravity runs, by container and run
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# A run taking longer than this many times its baseline fails the benchmark
+BASELINE_TOLERANCE = 1.5
+
+
+def start_adlist_server(Pihole, domains):
+    ''' generate lists of domains in total and serve them, with two broken sources '''
+    run_script(Pihole, '''
+    python {server} --root /tmp/adlists --generate {domains}
+    rm -f /tmp/adlist_server.port /tmp/adlist_server.log
+    python {server} --root /tmp/adlists > /dev/null 2>&1 &
+    echo $! > /tmp/adlist_server.pid
+    until [ -s /tmp/adlist_server.port ]; do sleep 0.1; done
+    url="http://127.0.0.1:$(cat /tmp/adlist_server.port)"
+    for list in hosts-crlf.txt plain.txt hosts-tab.txt status/404/gone.txt status/500/broken.txt; do
+        echo "${{url}}/${{list}}"
+    done > /etc/pihole/adlists.list
+    '''.format(server=ADLIST_SERVER, domains=domains))
+
+
+def stop_adlist_server(Pihole):
+    run_script(Pihole, 'kill $(cat /tmp/adlist_server.pid)')
+
+
+def gravity_profile(Pihole, options):
+    ''' run gravity.sh end to end and return the report it appended to the profile '''
+    run_script(Pihole, '/opt/pihole/gravity.sh {} > /dev/null'.format(options))
+    return json.loads(Pihole.run('tail -n 1 /etc/pihole/gravity.profile.jsonl').stdout)
+
+
+def summarise(profile, domains):
+    ''' wall time, peak RSS and throughput of every stage and of the whole run '''
+    stages = {}
+    for stage in [dict(profile, stage='total')] + profile['stages']:
+        stages[stage['stage']] = {
+            'wall_seconds': stage['wall_seconds'],
+            'peak_rss_kb': stage['peak_rss_kb'],
+            'domains_per_second': int(domains / max(stage['wall_seconds'], 0.001)),
+        }
+    return stages
+
+
+def compare_baseline(request, tag, name, results):
+    ''' print how every stage compares to the baseline, save the results when asked to '''
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as baseline_file:
+            baseline = json.load(baseline_file)
+    if request.config.getoption('--benchmark-save'):
+        baseline.setdefault(tag, {})[name] = results
+        with open(BASELINE, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        return
+    previous = baseline.get(tag, {}).get(name)
+    if previous is None:
+        print('{}: no baseline'.format(name))
+        return
+    slower = []
+    for run in sorted(results):
+        for stage in sorted(results[run]):
+            if stage not in previous.get(run, {}):
+                continue
+            now = results[run][stage]['wall_seconds']
+            before = previous[run][stage]['wall_seconds']
+            report('{} {} {}'.format(name, run, stage), seconds=now, baseline_seconds=before,
+                   ratio=round(now / max(before, 0.001), 2))
+            if stage == 'total' and now > before * BASELINE_TOLERANCE:
+                slower.append(run)
+    assert slower == []
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('domains', [10000, 100000, 1000000, 5000000])
+def test_benchmark_gravity(Pihole, request, tag, domains):
+    ''' end to end gravity runs over synthetic lists served locally: a cold run
+    downloading and processing every list, then a warm run where every list
+    answers 304 and is taken from the cache '''
+    mock_command('pihole', {'*': ('', '0')}, Pihole)
+    run_script(Pihole, 'cat <<EOF> /etc/pihole/setupVars.conf\n{}EOF'.format(SETUPVARS))
+    start_adlist_server(Pihole, domains)
+    cold = gravity_profile(Pihole, '--profile --force')
+    warm = gravity_profile(Pihole, '--profile')
+    requests = Pihole.run('cat /tmp/adlist_server.log').stdout.split()
+    stop_adlist_server(Pihole)
+    # Both runs asked for every list, the second one only got 304s for the working ones
+    assert requests[1::2].count('200') == 3
+    assert requests[1::2].count('304') == 3
+    assert cold['downloads'][0]['http_status'] == 200
+    assert cold['downloads'][3]['http_status'] == 404
+    assert cold['downloads'][4]['http_status'] == 500
+    results = {'cold': summarise(cold, domains), 'warm': summarise(warm, domains)}
+    for run in sorted(results):
+        for stage in sorted(results[run], key=lambda stage: -results[run][stage]['wall_seconds']):
+            report('gravity of {} domains, {} run, {}'.format(domains, run, stage), **results[run][stage])
+    compare_baseline(request, tag, 'gravity of {} domains'.format(domains), results)
+
+
+# Yesterday's queries to 5000 domains from 40 clients, as much of the day as fits in size bytes
+QUERY_LOG = '''
+awk -v size={size} -v day="$(date -d yesterday '+%b %e')" 'BEGIN {{
+    for (i = 0; written < size; i++) {{
+        t = sprintf("%s %02d:%02d:%02d", day, int(i / 180000) % 24, int(i / 3000) % 60, int(i / 50) % 60)
+        d = sprintf("host%d.domain%d.example.com", i % 5000, i % 300)
+        c = sprintf("192.168.1.%d", i % 40 + 2)
+        lines = sprintf("%s dnsmasq[123]: query[A] %s from %s\\n", t, d, c)
+        if (i % 10 == 0) lines = lines sprintf("%s dnsmasq[123]: /etc/pihole/gravity.list %s is 192.168.1.10\\n", t, d)
+        else if (i % 3 == 0) lines = lines sprintf("%s dnsmasq[123]: cached %s is 93.184.216.34\\n", t, d)
+        else lines = lines sprintf("%s dnsmasq[123]: forwarded %s to 8.8.8.8\\n%s dnsmasq[123]: reply %s is 93.184.216.34\\n", t, d, t, d)
+        printf "%s", lines
+        written += length(lines)
+    }}
+}}' > /var/log/pihole.log
+'''
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('megabytes', [100, 1000])
+def test_benchmark_querylog(Pihole, megabytes):
+    ''' throughput of rolling up a synthetic pihole.log in one go, and the time
+    reports on an hour and on the whole day take from the rollups '''
+    run_script(Pihole, QUERY_LOG.format(size=megabytes * 1000000))
+    ingest_time, ingest_rss = measure(Pihole, '/opt/pihole/queryLog.sh --ingest')
+    results = {'ingest_seconds': ingest_time, 'ingest_peak_rss_kb': ingest_rss,
+               'megabytes_per_second': round(megabytes / ingest_time, 1),
+               'rollup_bytes': int(Pihole.run('du -sb /etc/pihole/querylog | cut -f 1').stdout)}
+    for name, times in [('hour', '12:00 12:59'), ('day', '00:00 23:59')]:
+        results[name + '_report_seconds'], _ = measure(Pihole, '''
+        yesterday=$(date -d yesterday +%F)
+        /opt/pihole/queryLog.sh "$yesterday {}" "$yesterday {}" > /dev/null
+        '''.format(*times.split()))
+    report('query log of {}MB'.format(megabytes), **results)
+
+
+@pytest.mark.benchmark
+def test_benchmark_blockpage(Pihole):
+    ''' requests per second the block page answers with a million indexed
+    domains, compared to the page before it cached anything '''
+    if Pihole.run('command -v php').rc != 0:
+        pytest.skip('php is not installed')
+    run_script(Pihole, BLOCKLISTS + '''
+    awk 'BEGIN { for (i = 0; i < 1000000; i++) printf "ads%07d.tracker%d.example.com\\t%d\\n", i, i % 97, i % 2 + 1 }' \\
+        | LC_ALL=C sort -t "$(printf '\\t')" -k1,1 > /etc/pihole/gravity.index
+    # The page as it was before it cached its render context
+    cd /etc/.pihole
+    git show "$(git log -S blockPageContext --format=%H -- advanced/index.php | tail -n 1)^:advanced/index.php" \\
+        > /tmp/legacy.php
+    ''')
+    results = {}
+    for name, page in [('legacy', '/tmp/legacy.php'), ('cached', '/etc/.pihole/advanced/index.php')]:
+        port = start_blockpage(Pihole, page, name)
+        results[name + '_requests_per_second'] = float(run_script(Pihole, 'python {} --port {} --host {} --requests 500'.format(
+            HTTP_LOAD, port, 'ads0500000.tracker62.example.com')).stdout)
+    report('block page', **results)
+
+
+@pytest.mark.benchmark
+def test_benchmark_webpage_settings(Pihole):
+    ''' time to apply the settings of a provisioning run with pihole -a, one
+    by one as before and as a batch, with a dnsmasq restart taking half a second '''
+    run_script(Pihole, '''
+    printf '#!/bin/bash\\necho "$0 $@" >> /var/log/systemctl\\nsleep 0.5\\n' > /usr/local/bin/systemctl
+    chmod +x /usr/local/bin/systemctl
+    cat <<'EOF' > /tmp/batch\n{}EOF
+    # webpage.sh as it was before settings were changed in memory
+    cd /etc/.pihole
+    git show "$(git log -S LoadSettings --format=%H -- advanced/Scripts/webpage.sh | tail -n 1)^:advanced/Scripts/webpage.sh" \\
+        > /tmp/legacy_webpage.sh
+    '''.format(BATCH))
+    results = {}
+    for name, script in [('legacy', '/tmp/legacy_webpage.sh'), ('single', '/opt/pihole/webpage.sh')]:
+        run_script(Pihole, SETTINGS + 'rm -f /var/log/systemctl')
+        results[name + '_seconds'], _ = measure(Pihole, '''
+        while read -r line; do
+            bash -c "source {}; main -a ${{line}}" > /dev/null
+        done < /tmp/batch
+        '''.format(script))
+        results[name + '_restarts'] = len(Pihole.run('cat /var/log/systemctl').stdout.splitlines())
+    run_script(Pihole, SETTINGS + 'rm -f /var/log/systemctl')
+    results['batch_seconds'], _ = measure(Pihole, '''
+    bash -c "source /opt/pihole/webpage.sh; main -a batch" < /tmp/batch > /dev/null
+    ''')
+    results['batch_restarts'] = len(Pihole.run('cat /var/log/systemctl').stdout.splitlines())
+    report('pihole -a settings', **results)
+
+
+# What the installer fetches, with the repos and FTL fetched from stand-ins
+INSTALL_FETCHES = '''
+source /opt/pihole/basic-install.sh
+piholeGitUrl=file:///tmp/upstream/pi-hole.git
+webInterfaceGitUrl=file:///tmp/upstream/AdminLTE.git
+PI_HOLE_LOCAL_REPO=/tmp/core
+webInterfaceDir=/tmp/admin
+FTLreleasesUrl="http://127.0.0.1:$(cat /tmp/github.port)/FTL/releases"
+artifactCache={cache}
+mirrorUrl={mirror}
+rm -rf /tmp/core /tmp/admin /usr/bin/pihole-FTL
+'''
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize('latency', [0.1, 0.5])
+def test_benchmark_install_fetches(Pihole, latency):
+    ''' time to get the repos and a 10MB FTL binary while packages install,
+    the way installs did it before, with nothing cached, with the artifact
+    cache of an earlier install and from the cache of another node serving as
+    a mirror. The package install is a sleep, GitHub is a stand-in answering
+    after latency seconds. '''
+    run_script(Pihole, UPSTREAM_REPOS + '''
+    mkdir -p /tmp/github/FTL/releases/download/v9.9.9
+    cd /tmp/github/FTL/releases/download/v9.9.9
+    head -c 10000000 /dev/urandom > pihole-FTL-linux-x86_64
+    sha1sum pihole-FTL-linux-x86_64 > pihole-FTL-linux-x86_64.sha1
+    ''')
+    start_mirror_server(Pihole, 'github', '/tmp/github', '--latest v9.9.9 --latency {}'.format(latency))
+    packages = 'sleep 2'
+    results = {}
+    # One step after the other, as installs did before
+    results['serial_seconds'], _ = measure(Pihole, INSTALL_FETCHES.format(cache='/tmp/none', mirror='') + '''
+    {}
+    getGitFiles "${{PI_HOLE_LOCAL_REPO}}" "${{piholeGitUrl}}" > /dev/null
+    getGitFiles "${{webInterfaceDir}}" "${{webInterfaceGitUrl}}" > /dev/null
+    artifactCache=/tmp/none-ftl
+    FTLdetect > /dev/null
+    '''.format(packages))
+    overlapped = '''
+    fetch_start
+    {}
+    fetch_finish > /dev/null
+    FTLdetect > /dev/null
+    '''.format(packages)
+    results['cold_seconds'], _ = measure(Pihole, INSTALL_FETCHES.format(cache='/var/cache/pihole', mirror='') + overlapped)
+    results['cached_seconds'], _ = measure(Pihole, INSTALL_FETCHES.format(cache='/var/cache/pihole', mirror='') + overlapped)
+    mirror = start_mirror_server(Pihole, 'mirror', '/var/cache/pihole')
+    results['mirror_seconds'], _ = measure(Pihole, INSTALL_FETCHES.format(cache='/tmp/node2', mirror=mirror) + overlapped)
+    report('install fetches with {}s latency'.format(latency), **results)
+    assert Pihole.run('cmp /tmp/github/FTL/releases/download/v9.9.9/pihole-FTL-linux-x86_64 /usr/bin/pihole-FTL').rc == 0
+    # The node using the mirror got the binary there, and only its release and checksum from GitHub
+    assert '/FTL/v9.9.9/pihole-FTL-linux-x86_64 200' in Pihole.run('cat /tmp/mirror.log').stdout
+
+
+# A dnsmasq answering on 127.0.0.1:5353 from the lists, restarted by systemctl
+LOCAL_DNSMASQ = '''
+mkdir -p /var/run/dnsmasq
+cat <<'EOF' > /etc/dnsmasq.d/01-pihole.conf
+addn-hosts=/etc/pihole/gravity.list
+addn-hosts=/etc/pihole/black.list
+port=5353
+listen-address=127.0.0.1
+bind-interfaces
+no-resolv
+no-hosts
+user=root
+pid-file=/var/run/dnsmasq/dnsmasq.pid
+EOF
+cat <<'EOF' > /usr/local/bin/systemctl
+#!/bin/bash
+pid=$(cat /var/run/dnsmasq/dnsmasq.pid 2> /dev/null)
+if [[ -n "${pid}" ]]; then
+    kill "${pid}"
+    while [[ -d "/proc/${pid}" ]]; do sleep 0.01; done
+fi
+dnsmasq --conf-file=/dev/null --conf-dir=/etc/dnsmasq.d
+EOF
+chmod +x /usr/local/bin/systemctl
+'''
+
+# Asks 127.0.0.1:5353 for a name until it is answered blocked, or not, as the argument says
+DNS_WAIT = dedent('''\
+    import random, socket, struct, sys
+    name, blocked = sys.argv[1], sys.argv[2] == 'blocked'
+    query = struct.pack('>HHHHHH', random.randint(0, 65535), 0x0100, 1, 0, 0, 0)
+    query += b''.join(struct.pack('B', len(label)) + label.encode('ascii') for label in name.split('.'))
+    query += b'\\x00' + struct.pack('>HH', 1, 1)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(0.05)
+    while True:
+        try:
+            client.sendto(query, ('127.0.0.1', 5353))
+            response = client.recv(512)
+        except socket.error:
+            continue
+        if (socket.inet_aton('192.168.1.10') in response) == blocked:
+            break
+    ''')
+
+
+@pytest.mark.benchmark
+def test_benchmark_blocking_toggle(Pihole):
+    ''' time from pihole disable and pihole enable until a local dnsmasq with a
+    million blocked domains answers the other way, as blocking was toggled
+    before and with the state file '''
+    if Pihole.run('command -v dnsmasq').rc != 0:
+        pytest.skip('dnsmasq is not installed')
+    run_script(Pihole, LOCAL_DNSMASQ + '''
+    awk 'BEGIN { for (i = 0; i < 1000000; i++) printf "192.168.1.10 ads%07d.tracker%d.example.com\\n", i, i % 97 }' \\
+        > /etc/pihole/gravity.list
+    touch /etc/pihole/black.list
+    cat <<'EOF' > /tmp/dns_wait.py\n{}EOF
+    # pihole as it was before blocking was switched with the state file
+    cd /etc/.pihole
+    git show "$(git log -S blockingState --format=%H -- pihole | tail -n 1)^:pihole" > /tmp/legacy_pihole
+    pihole restartdns
+    '''.format(DNS_WAIT))
+    domain = 'ads0500000.tracker62.example.com'
+    results = {}
+    for name, script in [('legacy', 'bash /tmp/legacy_pihole'), ('state_file', 'pihole')]:
+        results[name + '_disable_seconds'], _ = measure(Pihole, '''
+        {} disable > /dev/null
+        python /tmp/dns_wait.py {} unblocked
+        '''.format(script, domain))
+        results[name + '_enable_seconds'], _ = measure(Pihole, '''
+        {} enable > /dev/null
+        python /tmp/dns_wait.py {} blocked
+        '''.format(script, domain))
+    report('blocking toggle with 1M domains', **results)
@@ -0,0 +1,123 @@
+from .test_automated_install import run_script, mock_command
+
+# An installed Pi-hole with its lists, and a dnsmasq that notes every SIGHUP
+BLOCKLISTS = '''
+sed -e 's/@DNS1@/8.8.8.8/' -e 's/@DNS2@/8.8.4.4/' -e 's/@INT@/eth0/' \\
+    /etc/.pihole/advanced/01-pihole.conf > /etc/dnsmasq.d/01-pihole.conf
+printf '192.168.1.10 ads.example.com\\n192.168.1.10 tracker.example.com\\n' > /etc/pihole/gravity.list
+echo '192.168.1.10 black.example.com' > /etc/pihole/black.list
+cat <<'EOF' > /tmp/dnsmasq.sh
+mkdir -p /var/run/dnsmasq
+echo $$ > /var/run/dnsmasq/dnsmasq.pid
+trap 'echo HUP >> /tmp/dnsmasq.log' HUP
+while true; do sleep 0.1 & wait $!; done
+EOF
+# A shell by the name of dnsmasq, pidof does not look for scripts
+cp /bin/bash /usr/local/bin/dnsmasq
+dnsmasq /tmp/dnsmasq.sh > /dev/null 2>&1 &
+until [[ -s /var/run/dnsmasq/dnsmasq.pid ]]; do sleep 0.1; done
+# dnsmasq was started with this configuration
+cat /etc/dnsmasq.conf /etc/dnsmasq.d/* 2> /dev/null | sha1sum > /etc/pihole/dnsmasq.stamp
+'''
+
+
+def blocking(Pihole):
+    return Pihole.run('pihole status web').stdout.strip()
+
+
+def running(Pihole, pid):
+    ''' whether pid runs, the sandbox leaves the processes it does not wait for as zombies '''
+    return Pihole.run('grep -q -a . /proc/{}/cmdline'.format(pid)).rc == 0
+
+
+def timer(Pihole):
+    ''' the pid of the timer the state file names, if it is still running '''
+    pid = Pihole.run('sed -n "s/^BLOCKING_TIMER=//p" /etc/pihole/blocking.state').stdout.strip()
+    return pid if pid and running(Pihole, pid) else ''
+
+
+def test_blocking_toggle_swaps_the_lists_and_reloads_dnsmasq(Pihole):
+    ''' disable and enable keep the lists aside and back, leave the configuration
+    as it is and only have dnsmasq re-read its hosts files '''
+    mock_command('systemctl', {}, Pihole)
+    run_script(Pihole, BLOCKLISTS + 'cp /etc/dnsmasq.d/01-pihole.conf /tmp')
+    assert blocking(Pihole) == '1'
+    run_script(Pihole, 'pihole disable')
+    assert blocking(Pihole) == '0'
+    assert Pihole.run('cat /etc/pihole/blocking.state').stdout == 'BLOCKING=disabled\n'
+    assert Pihole.run('stat -c %s /etc/pihole/gravity.list /etc/pihole/black.list').stdout == '0\n0\n'
+    assert 'ads.example.com' in Pihole.run('cat /etc/pihole/gravity.list.disabled').stdout
+    assert Pihole.run('cmp /etc/dnsmasq.d/01-pihole.conf /tmp/01-pihole.conf').rc == 0
+    run_script(Pihole, 'pihole enable')
+    assert blocking(Pihole) == '1'
+    assert 'ads.example.com' in Pihole.run('cat /etc/pihole/gravity.list').stdout
+    assert 'black.example.com' in Pihole.run('cat /etc/pihole/black.list').stdout
+    assert Pihole.run('ls /etc/pihole/gravity.list.disabled /etc/pihole/black.list.disabled').rc != 0
+    assert Pihole.run('cat /tmp/dnsmasq.log').stdout == 'HUP\nHUP\n'
+    assert Pihole.run('cat /var/log/systemctl').stdout == ''
+    # Blocking disabled by commenting the lists out is still disabled, and enabled the same way
+    run_script(Pihole, '''
+    rm /etc/pihole/blocking.state
+    sed -i "s/^addn-hosts/#addn-hosts/" /etc/dnsmasq.d/01-pihole.conf
+    cat /etc/dnsmasq.conf /etc/dnsmasq.d/* 2> /dev/null | sha1sum > /etc/pihole/dnsmasq.stamp
+    ''')
+    assert blocking(Pihole) == '0'
+    run_script(Pihole, 'pihole enable')
+    assert Pihole.run('cmp /etc/dnsmasq.d/01-pihole.conf /tmp/01-pihole.conf').rc == 0
+    assert Pihole.run('cat /var/log/systemctl').stdout == '/usr/local/bin/systemctl restart dnsmasq\n'
+
+
+def test_restartdns_notes_the_configuration_only_once_dnsmasq_runs_it(Pihole):
+    ''' a failed restart leaves the stamp as it was, so the next reload restarts
+    dnsmasq again rather than only having it re-read its hosts files '''
+    mock_command('systemctl', {'restart': ('', 1)}, Pihole)
+    run_script(Pihole, BLOCKLISTS + '''
+    cp /etc/pihole/dnsmasq.stamp /tmp/dnsmasq.stamp
+    echo "cache-size=1000" >> /etc/dnsmasq.d/01-pihole.conf
+    ''')
+    assert Pihole.run('pihole restartdns reload').rc != 0
+    assert Pihole.run('cmp /etc/pihole/dnsmasq.stamp /tmp/dnsmasq.stamp').rc == 0
+    assert Pihole.run('pihole restartdns reload').rc != 0
+    assert Pihole.run('cat /var/log/systemctl').stdout == '/usr/local/bin/systemctl restart dnsmasq\n' * 2
+    assert Pihole.run('cat /tmp/dnsmasq.log').stdout == ''
+    mock_command('systemctl', {}, Pihole)
+    run_script(Pihole, 'pihole restartdns reload')
+    assert Pihole.run('cmp /etc/pihole/dnsmasq.stamp /tmp/dnsmasq.stamp').rc != 0
+    run_script(Pihole, 'pihole restartdns reload')
+    assert Pihole.run('cat /var/log/systemctl').stdout == '/usr/local/bin/systemctl restart dnsmasq\n'
+    assert Pihole.run('cat /tmp/dnsmasq.log').stdout == 'HUP\n'
+
+
+def test_blocking_timer_is_one_and_survives_restarts(Pihole):
+    ''' a disable replaces the timer of the last one, enable cancels it, it
+    re-enables blocking when it is due and is started again when it is gone '''
+    mock_command('systemctl', {}, Pihole)
+    run_script(Pihole, BLOCKLISTS)
+    run_script(Pihole, 'pihole disable 5m')
+    first = timer(Pihole)
+    assert first
+    run_script(Pihole, 'pihole disable 10m')
+    second = timer(Pihole)
+    assert second and second != first
+    assert not running(Pihole, first)
+    assert '::: Blocking will be re-enabled in ' in Pihole.run('pihole status').stdout
+    run_script(Pihole, 'pihole enable')
+    assert not running(Pihole, second)
+    assert Pihole.run('cat /etc/pihole/blocking.state').stdout == 'BLOCKING=enabled\n'
+    run_script(Pihole, 'pihole disable 1s')
+    run_script(Pihole, 'for try in $(seq 50); do [[ -s /etc/pihole/gravity.list ]] && break; sleep 0.1; done')
+    assert blocking(Pihole) == '1'
+    assert 'ads.example.com' in Pihole.run('cat /etc/pihole/gravity.list').stdout
+    # After a reboot the pid of the timer may belong to anything else
+    other = run_script(Pihole, 'setsid sleep 30 > /dev/null 2>&1 & echo $!').stdout.strip()
+    run_script(Pihole, '''
+    printf 'BLOCKING=disabled\\nBLOCKING_UNTIL=9999999999\\nBLOCKING_TIMER={}\\n' > /etc/pihole/blocking.state
+    pihole disable --resume
+    '''.format(other))
+    assert timer(Pihole) not in ('', other)
+    run_script(Pihole, '''
+    printf 'BLOCKING=disabled\\nBLOCKING_UNTIL=1\\nBLOCKING_TIMER={}\\n' > /etc/pihole/blocking.state
+    pihole disable --resume
+    '''.format(other))
+    assert blocking(Pihole) == '1'
+    assert running(Pihole, other)
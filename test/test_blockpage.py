@@ -0,0 +1,71 @@
+import pytest
+from .test_automated_install import run_script, mock_command
+
+HTTP_LOAD = '/etc/.pihole/test/http_load.py'
+
+# Two adlists and a wildcard, as gravity.sh indexes them
+BLOCKLISTS = '''
+echo 'IPV4_ADDRESS=192.168.1.10/24' > /etc/pihole/setupVars.conf
+touch /etc/pihole/list.0.ads.example.com.domains /etc/pihole/list.1.hosts.example.net.domains
+printf '/etc/pihole/list.0.ads.example.com.domains\\t0\\n/etc/pihole/list.1.hosts.example.net.domains\\t1\\n' \\
+    > /etc/pihole/gravity.index.sources
+printf 'ads.example.org\\t1,2\\ntracker.example.org\\t2\\n' > /etc/pihole/gravity.index
+echo 'address=/wild.example.org/192.168.1.10' > /etc/dnsmasq.d/03-pihole-wildcard.conf
+printf 'org.example.wild\\taddress=/wild.example.org/192.168.1.10\\n' > /etc/pihole/gravity.index.wildcards
+touch -d '-1 minute' /etc/dnsmasq.d/03-pihole-wildcard.conf
+'''
+
+
+def start_blockpage(Pihole, page, name='blockpage'):
+    ''' serve page with PHP's own web server, for every host name, and return its port '''
+    return run_script(Pihole, '''
+    cat <<'PHP' > /tmp/{name}.php
+<?php
+$_SERVER['SERVER_NAME'] = explode(':', $_SERVER['HTTP_HOST'])[0];
+$_SERVER['SERVER_ADDR'] = '127.0.0.1';
+require '{page}';
+PHP
+    port=$(python -c 'import socket; s = socket.socket(); s.bind(("127.0.0.1", 0)); print(s.getsockname()[1])')
+    php -S 127.0.0.1:${{port}} /tmp/{name}.php > /dev/null 2>&1 &
+    for try in $(seq 50); do
+        python {load} --port ${{port}} --host ready.example.org > /dev/null 2>&1 && break
+        sleep 0.1
+    done
+    echo ${{port}}
+    '''.format(name=name, page=page, load=HTTP_LOAD)).stdout.strip()
+
+
+def blockpage(Pihole, port, host):
+    return run_script(Pihole, 'python {} --port {} --host {} --print'.format(HTTP_LOAD, port, host)).stdout
+
+
+def test_blockpage_names_the_lists_from_the_index(Pihole):
+    ''' the page says which lists block a domain itself, and only asks git for
+    the version once '''
+    if Pihole.run('command -v php').rc != 0:
+        pytest.skip('php is not installed')
+    mock_command('git', {'describe': ('v3.0.1', '0')}, Pihole)
+    run_script(Pihole, BLOCKLISTS)
+    port = start_blockpage(Pihole, '/etc/.pihole/advanced/index.php')
+    page = blockpage(Pihole, port, 'ads.example.org')
+    assert '/etc/pihole/list.0.ads.example.com.domains\n/etc/pihole/list.1.hosts.example.net.domains\n' in page
+    assert 'Pi-hole v3.0.1' in page
+    assert 'queryads.js' not in page
+    assert 'id="whitelisting"' in page
+    page = blockpage(Pihole, port, 'cdn.wild.example.org')
+    assert 'Wildcard blocking wild.example.org' in page
+    assert 'None of the block lists contains this domain' in blockpage(Pihole, port, 'other.example.org')
+    # The request that waited for the server to come up was the first one
+    assert Pihole.run('grep -c describe /var/log/git').stdout.strip() == '1'
+
+
+def test_blockpage_searches_the_lists_without_an_index(Pihole):
+    ''' the adlist search in the browser is left to do it when the index was
+    built from other lists '''
+    if Pihole.run('command -v php').rc != 0:
+        pytest.skip('php is not installed')
+    run_script(Pihole, BLOCKLISTS + 'touch /etc/pihole/list.2.new.example.com.domains')
+    port = start_blockpage(Pihole, '/etc/.pihole/advanced/index.php')
+    page = blockpage(Pihole, port, 'ads.example.org')
+    assert 'queryads.js' in page
+    assert '<pre id="output" style="width: 100%; height: 100%;" hidden="true"></pre>' in page
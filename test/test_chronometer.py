@@ -0,0 +1,172 @@
+from .test_automated_install import run_script, mock_command
+from .test_blocking import BLOCKLISTS, running
+
+FTL_STUB = '/etc/.pihole/test/ftl_stub.py'
+
+# Two refreshes of the stats shown by chronometer, in the same shell
+REFRESH_TWICE = '''
+source /opt/pihole/chronometer.sh
+for refresh in 1 2; do
+    get_ftl_stats
+    echo "${domains_being_blocked_raw} ${ads_percentage_today_raw} ${recent_blocked} ${top_ad} ${top_domain} ${top_client}"
+done
+'''
+EXPECTED_STATS = ('123456 15.6 ads.example.com ads.example.com '
+                  'www.example.com laptop.lan')
+
+
+def start_ftl_stub(Pihole, options=''):
+    ''' start the stub FTL in the background and wait for its port file '''
+    run_script(Pihole, '''
+    rm -f /var/run/pihole-FTL.port
+    python {} {} > /dev/null 2>&1 &
+    echo $! > /tmp/ftl_stub.pid
+    until [ -s /var/run/pihole-FTL.port ]; do sleep 0.1; done
+    '''.format(FTL_STUB, options))
+
+
+def stop_ftl_stub(Pihole):
+    run_script(Pihole, 'kill $(cat /tmp/ftl_stub.pid)')
+
+
+def test_chronometer_keeps_one_ftl_connection(Pihole):
+    ''' confirms all stats of both refreshes are pipelined over one connection '''
+    run_script(Pihole, 'rm -f /tmp/ftl_stub.log')
+    start_ftl_stub(Pihole)
+    stats = run_script(Pihole, REFRESH_TWICE).stdout.splitlines()
+    stop_ftl_stub(Pihole)
+    assert stats == [EXPECTED_STATS, EXPECTED_STATS]
+    ftl_log = Pihole.run('cat /tmp/ftl_stub.log').stdout.splitlines()
+    assert ftl_log.count('connect') == 1
+    assert ftl_log.count('command >stats') == 2
+    assert len(ftl_log) == 11
+
+
+def test_chronometer_reconnects_after_ftl_restart(Pihole):
+    ''' confirms the next refresh reconnects when FTL restarted in between '''
+    run_script(Pihole, 'rm -f /tmp/ftl_stub.log')
+    start_ftl_stub(Pihole)
+    stats = run_script(Pihole, '''
+    source /opt/pihole/chronometer.sh
+    get_ftl_stats
+    echo "${{domains_being_blocked_raw}} ${{top_client}}"
+    kill $(cat /tmp/ftl_stub.pid)
+    rm -f /var/run/pihole-FTL.port
+    python {} > /dev/null 2>&1 &
+    echo $! > /tmp/ftl_stub.pid
+    until [ -s /var/run/pihole-FTL.port ]; do sleep 0.1; done
+    get_ftl_stats
+    echo "${{domains_being_blocked_raw}} ${{top_client}}"
+    '''.format(FTL_STUB)).stdout
+    stop_ftl_stub(Pihole)
+    assert stats.splitlines() == ['123456 laptop.lan', '123456 laptop.lan']
+    ftl_log = Pihole.run('cat /tmp/ftl_stub.log').stdout.splitlines()
+    assert ftl_log.count('connect') == 2
+
+
+def test_chronometer_without_ftl_pipelining(Pihole):
+    ''' confirms an FTL only answering one command at a time is asked one by one '''
+    start_ftl_stub(Pihole, '--no-pipeline')
+    stats = run_script(Pihole, REFRESH_TWICE).stdout.splitlines()
+    stop_ftl_stub(Pihole)
+    assert stats == [EXPECTED_STATS, EXPECTED_STATS]
+
+
+def test_chronometer_sys_stats_without_forking(Pihole):
+    ''' confirms refreshing the system stats runs no external command '''
+    stats = run_script(Pihole, '''
+    source /opt/pihole/chronometer.sh
+    get_init_stats
+    get_sys_stats
+    rm -f /tmp/forked
+    command_not_found_handle() { echo "$1" >> /tmp/forked; return 127; }
+    PATH=/nonexistent
+    TIMEFORMAT=%R
+    time for ((refresh = 0; refresh < 10; refresh++)); do get_sys_stats; done
+    echo "${sys_loadavg}|${cpu_tasks}|${ram_total}|${sys_uptime}"
+    ''')
+    forked = Pihole.run('cat /tmp/forked 2> /dev/null').stdout
+    assert forked == ''
+    loadavg, tasks, ram_total, uptime = stats.stdout.splitlines()[-1].split('|')
+    assert len(loadavg.split()) == 3
+    assert int(tasks) > 0
+    assert int(ram_total) > 0
+    assert uptime
+    # Ten refreshes used to fork well over a hundred processes
+    assert float(stats.stderr.splitlines()[-1]) < 1
+
+
+def test_chronometer_metrics_snapshot(Pihole):
+    ''' confirms the collector keeps a Prometheus snapshot of the FTL, system
+    and gravity stats, and that reading it does not query FTL '''
+    run_script(Pihole, 'rm -f /tmp/ftl_stub.log /var/run/pihole/metrics.*')
+    start_ftl_stub(Pihole)
+    run_script(Pihole, '''
+    printf '# TYPE pihole_gravity_unique_domains gauge\\npihole_gravity_unique_domains 42\\n' > /etc/pihole/gravity.metrics
+    /opt/pihole/chronometer.sh --metrics 1 > /dev/null 2>&1 &
+    until [ -s /var/run/pihole/metrics.txt ]; do sleep 0.1; done
+    for scrape in $(seq 50); do cat /var/run/pihole/metrics.txt > /dev/null; done
+    ''')
+    metrics = Pihole.run('cat /var/run/pihole/metrics.txt').stdout
+    second = Pihole.run('/opt/pihole/chronometer.sh --metrics')
+    run_script(Pihole, 'kill $(cat /var/run/pihole/metrics.pid)')
+    stop_ftl_stub(Pihole)
+    assert 'pihole_up 1\n' in metrics
+    assert 'pihole_domains_being_blocked 123456\n' in metrics
+    assert 'pihole_ads_percentage_today 15.6\n' in metrics
+    assert 'pihole_load_average{period="15m"} ' in metrics
+    assert 'pihole_memory_total_bytes ' in metrics
+    assert 'pihole_gravity_unique_domains 42\n' in metrics
+    # Only one collector runs at a time
+    assert second.rc == 1
+    assert 'already being collected' in second.stdout
+    # FTL is asked once per refresh, not once per scrape
+    ftl_log = Pihole.run('cat /tmp/ftl_stub.log').stdout.splitlines()
+    assert ftl_log.count('command >stats') <= 3
+
+
+def test_chronometer_metrics_follow_the_blocking_state(Pihole):
+    ''' the status metric reads blocking.state, pihole disable leaves the
+    lists in 01-pihole.conf as they are '''
+    mock_command('systemctl', {}, Pihole)
+    run_script(Pihole, BLOCKLISTS + 'rm -f /var/run/pihole/metrics.*')
+    start_ftl_stub(Pihole)
+    run_script(Pihole, '''
+    /opt/pihole/chronometer.sh --metrics 1 > /dev/null 2>&1 &
+    until [ -s /var/run/pihole/metrics.txt ]; do sleep 0.1; done
+    ''')
+    enabled = Pihole.run('cat /var/run/pihole/metrics.txt').stdout
+    run_script(Pihole, '''
+    pihole disable > /dev/null
+    for try in $(seq 50); do grep -q "^pihole_status 0$" /var/run/pihole/metrics.txt && break; sleep 0.1; done
+    ''')
+    disabled = Pihole.run('cat /var/run/pihole/metrics.txt').stdout
+    run_script(Pihole, 'kill $(cat /var/run/pihole/metrics.pid)')
+    stop_ftl_stub(Pihole)
+    assert 'pihole_status 1\n' in enabled
+    assert 'pihole_status 0\n' in disabled
+    assert Pihole.run('grep -c "^#addn-hosts" /etc/dnsmasq.d/01-pihole.conf').stdout.strip() == '0'
+
+
+def test_install_replaces_the_metrics_collector(Pihole):
+    ''' an install or update stops the collector of the version it replaces,
+    which keeps the pid file, before it starts its own '''
+    run_script(Pihole, 'rm -f /var/run/pihole/metrics.*')
+    start_ftl_stub(Pihole)
+    old = run_script(Pihole, '''
+    /opt/pihole/chronometer.sh --metrics 60 > /dev/null 2>&1 &
+    until [ -s /var/run/pihole/metrics.pid ]; do sleep 0.1; done
+    cat /var/run/pihole/metrics.pid
+    ''').stdout.strip()
+    run_script(Pihole, '''
+    source /opt/pihole/basic-install.sh
+    restart_metrics
+    for try in $(seq 50); do [ "$(cat /var/run/pihole/metrics.pid)" != "{}" ] && break; sleep 0.1; done
+    '''.format(old))
+    new = Pihole.run('cat /var/run/pihole/metrics.pid').stdout.strip()
+    collecting = running(Pihole, new)
+    run_script(Pihole, 'kill {}'.format(new))
+    stop_ftl_stub(Pihole)
+    assert new != old
+    assert collecting
+    assert not running(Pihole, old)
@@ -0,0 +1,60 @@
+import pytest
+from .test_automated_install import run_script
+
+DNS_STUB = '/etc/.pihole/test/dns_stub.py'
+
+# The resolver checks of piholeDebug.sh, timed, with the log they wrote on fd 3
+RUN_CHECKS = '''
+echo 'IPV4_ADDRESS=127.0.0.1/8' > /etc/pihole/setupVars.conf
+echo 'nameserver 127.0.0.1' > /etc/resolv.conf
+source /opt/pihole/piholeDebug.sh
+CHECK_TIMEOUT={timeout}
+exec 3> /tmp/debug.log
+start=$(date +%s.%N)
+run_checks 'testResolver 4 "${{IPV4_ADDRESS%/*}}"' 'testChaos' 'echo "::: last check"'
+awk -v start="${{start}}" -v end="$(date +%s.%N)" 'BEGIN {{ print "seconds", end - start }}'
+'''
+
+
+def start_dns_stub(Pihole, latency):
+    ''' start the stand-in resolver on 127.0.0.1:53 and wait until it listens '''
+    run_script(Pihole, '''
+    python {} --latency {} > /dev/null 2>&1 &
+    # Port 53 is 0035 in /proc/net/udp
+    until grep -q ' 0100007F:0035 ' /proc/net/udp; do sleep 0.1; done
+    rm -f /tmp/dns_stub.log
+    '''.format(DNS_STUB, latency))
+
+
+def run_checks(Pihole, timeout):
+    output = run_script(Pihole, RUN_CHECKS.format(timeout=timeout)).stdout
+    return output, float(output.split('seconds ')[-1]), Pihole.run('cat /tmp/debug.log').stdout
+
+
+def test_debug_checks_run_at_the_same_time(Pihole):
+    ''' five lookups of a second each take about a second, and the log has the
+    sections in the order of the checks '''
+    if Pihole.run('command -v dig').rc != 0:
+        pytest.skip('dig is not installed')
+    start_dns_stub(Pihole, 1)
+    output, seconds, log = run_checks(Pihole, 10)
+    assert seconds < 2.5
+    assert log.index('Resolver Functions Check (IPv4)') < log.index('Cache Size:')
+    assert 'Resolution of doubleclick.com from Pi-hole (127.0.0.1):\n192.168.1.10\n' in log
+    assert 'Cache Size:\n"10000"\nUpstream Servers:\n"127.0.0.1#5353 12 0"\n' in log
+    assert output.index('Resolver Functions Check (IPv4)') < output.index('::: last check')
+    # Both Pi-hole lookups went to the stub, and both CHAOS ones
+    assert len(Pihole.run('cat /tmp/dns_stub.log').stdout.splitlines()) == 4
+
+
+def test_debug_checks_are_cut_short_after_their_deadline(Pihole):
+    ''' a resolver that does not answer in time holds up the debug log only
+    until CHECK_TIMEOUT, and the other checks are still logged '''
+    if Pihole.run('command -v dig').rc != 0:
+        pytest.skip('dig is not installed')
+    start_dns_stub(Pihole, 4)
+    output, seconds, log = run_checks(Pihole, 1)
+    assert seconds < 3
+    assert 'Check did not finish within 1 seconds: testResolver 4' in log
+    assert 'Check did not finish within 1 seconds: testChaos' in output
+    assert '::: last check' in output
@@ -0,0 +1,523 @@
+import json
+import pytest
+from textwrap import dedent
+from .test_automated_install import run_script, mock_command
+
+SETUPVARS = dedent('''\
+    IPV4_ADDRESS=192.168.1.10/24
+    IPV6_ADDRESS=fd00::10
+    ''')
+
+# Written with printf, so escape sequences are kept as text here
+HOSTS_LIST = (
+    r'# Hosts file style list\r\n'
+    r'127.0.0.1 localhost\r\n'
+    r'::1 ip6-localhost\r\n'
+    r'0.0.0.0\r\n'
+    r'0.0.0.0 ads.example.com\r\n'
+    r'0.0.0.0 tracker.example.com # inline comment\r\n'
+    r'127.0.0.1\tTabbed.Example.com\r\n'
+    r'0.0.0.0 first.example.com second.example.com\r\n'
+    r'\r\n'
+    r'0.0.0.0 ads.example.com\r\n'
+)
+
+DOMAIN_LIST = (
+    r'# Plain domain list\n'
+    r'#commented.example.com\n'
+    r'plain.example.org\n'
+    r'   spaced.example.org   \n'
+    r'plain.example.org\n'
+    r'path.example.org/some/path.html\n'
+    r'dots..example...org\n'
+    r'nodots\n'
+    r'\n'
+    r'ads.example.com\n'
+)
+
+LEGACY_PIPELINE = '''\
+cat /tmp/list.0.hosts.domains /tmp/list.1.plain.domains | tr -d '\\r' | \\
+    awk -F '#' '{print $1}' | \\
+    awk -F '/' '{print $1}' | \\
+    awk '($1 !~ /^#/) { if (NF>1) {print $2} else {print $1}}' | \\
+    sed -nr -e 's/\\.{2,}/./g' -e '/\\./p' | LC_ALL=C sort -u > /tmp/legacy.preEventHorizon
+'''
+
+
+def write_gravity_fixtures(Pihole):
+    ''' write setupVars and the list corpus used by the gravity tests '''
+    Pihole.run('''
+    cat <<EOF> /etc/pihole/setupVars.conf\n{}EOF
+    printf '{}' > /tmp/list.0.hosts.domains
+    printf '{}' > /tmp/list.1.plain.domains
+    '''.format(SETUPVARS, HOSTS_LIST, DOMAIN_LIST))
+
+
+def test_gravity_normalize_matches_legacy_pipeline(Pihole):
+    ''' confirms the streaming normaliser writes exactly what the former
+    cat | tr | awk | awk | awk | sed | sort -u chain produced '''
+    write_gravity_fixtures(Pihole)
+    run_script(Pihole, LEGACY_PIPELINE)
+    normalize = run_script(Pihole, '''
+    source /opt/pihole/gravity.sh
+    gravity_normalize /tmp/new.preEventHorizon /tmp/list.0.hosts.domains /tmp/list.1.plain.domains
+    ''')
+    legacy_count = Pihole.run('''
+    cat /tmp/list.0.hosts.domains /tmp/list.1.plain.domains | tr -d '\\r' | \\
+        awk -F '#' '{print $1}' | awk -F '/' '{print $1}' | \\
+        awk '{ if (NF>1) {print $2} else {print $1}}' | grep -c '\\.'
+    ''').stdout.strip()
+    assert normalize.stdout.strip().endswith(legacy_count)
+    compare = Pihole.run('cmp /tmp/legacy.preEventHorizon /tmp/new.preEventHorizon')
+    assert compare.rc == 0
+    event_horizon = Pihole.run('cat /tmp/new.preEventHorizon').stdout
+    assert 'ads.example.com' in event_horizon
+    assert 'dots.example.org' in event_horizon
+    assert 'localhost' not in event_horizon
+    assert 'nodots' not in event_horizon
+
+
+def test_gravity_normalize_without_lists(Pihole):
+    ''' confirms an empty event horizon is written when no list is available '''
+    write_gravity_fixtures(Pihole)
+    normalize = run_script(Pihole, '''
+    source /opt/pihole/gravity.sh
+    gravity_normalize /tmp/new.preEventHorizon
+    ''')
+    assert normalize.stdout.strip().endswith('0')
+    size = Pihole.run('stat -c %s /tmp/new.preEventHorizon').stdout.strip()
+    assert size == '0'
+
+
+def test_gravity_advanced_only_normalizes_changed_lists(Pihole):
+    ''' confirms unchanged lists are taken from the horizon cache and the
+    event horizon is only merged again when a list changed '''
+    write_gravity_fixtures(Pihole)
+    script = '''
+    source /opt/pihole/gravity.sh
+    matter=(/tmp/list.0.hosts.domains /tmp/list.1.plain.domains)
+    gravity_advanced
+    echo "changed: ${numChanged}"
+    '''
+    cold = run_script(Pihole, script)
+    assert 'changed: 2' in cold.stdout
+    assert 'Removing duplicate domains' in cold.stdout
+    # ads.example.com is on both lists and is counted once
+    unique = Pihole.run('wc -l < /etc/pihole/list.preEventHorizon').stdout.strip()
+    assert '::: {} unique domains trapped in the event horizon.'.format(unique) in cold.stdout
+    assert 'being pulled in by gravity' not in cold.stdout
+    warm = run_script(Pihole, script)
+    assert 'changed: 0' in warm.stdout
+    assert 'No list has changed, keeping the event horizon' in warm.stdout
+    run_script(Pihole, 'echo "0.0.0.0 new.example.net" >> /tmp/list.1.plain.domains')
+    changed = run_script(Pihole, script)
+    assert 'changed: 1' in changed.stdout
+    assert 'Removing duplicate domains' in changed.stdout
+    event_horizon = Pihole.run('cat /etc/pihole/list.preEventHorizon').stdout
+    assert 'new.example.net' in event_horizon
+    assert 'ads.example.com' in event_horizon
+
+
+def test_gravity_doWhitelist_matches_grep(Pihole):
+    ''' confirms the sorted merge removes exactly what grep -F -x -v -f removed '''
+    write_gravity_fixtures(Pihole)
+    run_script(Pihole, '''
+    printf 'plain.example.org\\nads.example.com\\nnot.in.horizon.com\\nads.example.com\\nADS.example.com\\n' > /tmp/whitelist.txt
+    source /opt/pihole/gravity.sh
+    gravity_normalize /tmp/preEventHorizon /tmp/list.0.hosts.domains /tmp/list.1.plain.domains
+    grep -F -x -v -f /tmp/whitelist.txt /tmp/preEventHorizon > /tmp/legacy.eventHorizon
+    gravity_doWhitelist /tmp/preEventHorizon /tmp/whitelist.txt /tmp/new.eventHorizon
+    ''')
+    compare = Pihole.run('cmp /tmp/legacy.eventHorizon /tmp/new.eventHorizon')
+    assert compare.rc == 0
+    event_horizon = Pihole.run('cat /tmp/new.eventHorizon').stdout
+    assert 'plain.example.org' not in event_horizon
+    assert 'ads.example.com' not in event_horizon
+    assert 'tracker.example.com' in event_horizon
+
+
+def test_pihole_query_answers_from_gravity_index(Pihole):
+    ''' confirms pihole -q looks domains and wildcards up in the index
+    gravity builds, for exact and partial matches '''
+    write_gravity_fixtures(Pihole)
+    run_script(Pihole, '''
+    cp /tmp/list.0.hosts.domains /etc/pihole/list.0.hosts.domains
+    cp /tmp/list.1.plain.domains /etc/pihole/list.1.plain.domains
+    touch /etc/pihole/blacklist.txt
+    printf 'address=/doubleclick.net/192.168.1.10\\n' > /etc/dnsmasq.d/03-pihole-wildcard.conf
+    source /opt/pihole/gravity.sh
+    matter=(/etc/pihole/list.0.hosts.domains /etc/pihole/list.1.plain.domains)
+    gravity_advanced
+    gravity_Wildcard
+    ''')
+    index = Pihole.run('cat /etc/pihole/gravity.index').stdout
+    assert 'ads.example.com\t1,2\t' in index
+    assert 'tabbed.example.com\t1\t' in index
+    # Offsets of the lines: the first of the event horizon, the '0.0.0.0' line of the hosts list
+    assert '0.0.0.0\t1\t0:0 1:65\n' in index
+    exact = run_script(Pihole, 'pihole -q Ads.Example.com -exact').stdout
+    expected_exact = [
+        '::: /etc/pihole/list.0.hosts.domains (2 results)\n0.0.0.0 ads.example.com\r\n0.0.0.0 ads.example.com\r\n',
+        '::: /etc/pihole/list.1.plain.domains (1 results)\nads.example.com\n',
+        '::: /etc/pihole/list.preEventHorizon (1 results)\nads.example.com\n',
+        '::: /etc/pihole/blacklist.txt (0 results)\n'
+    ]
+    for part in expected_exact:
+        assert part in exact
+    partial = run_script(Pihole, 'pihole -q EXAMPLE.org').stdout
+    assert '::: /etc/pihole/list.0.hosts.domains (0 results)\n' in partial
+    # Domains are matched, dots..example...org is in the event horizon as dots.example.org
+    assert '::: /etc/pihole/list.1.plain.domains (5 results)\n' in partial
+    assert 'path.example.org/some/path.html\ndots..example...org\n' in partial
+    assert '::: /etc/pihole/list.preEventHorizon (4 results)\n' in partial
+    same = run_script(Pihole, 'pihole -q Plain.Example').stdout
+    wildcard = run_script(Pihole, 'pihole -q ads.doubleclick.net').stdout
+    expected_wildcard = ('::: Wildcard blocking doubleclick.net (1 results)\n'
+                         'address=/doubleclick.net/192.168.1.10\n')
+    assert expected_wildcard in wildcard
+    # The lines printed are the ones scanning every list prints
+    run_script(Pihole, 'mkdir /tmp/index && mv /etc/pihole/gravity.index* /tmp/index')
+    assert run_script(Pihole, 'pihole -q Ads.Example.com -exact').stdout == exact
+    assert run_script(Pihole, 'pihole -q Plain.Example').stdout == same
+    assert run_script(Pihole, 'pihole -q ads.doubleclick.net').stdout == wildcard
+    # Wildcards do not block while blocking is disabled
+    run_script(Pihole, '''
+    mv /tmp/index/* /etc/pihole
+    echo BLOCKING=disabled > /etc/pihole/blocking.state
+    mv /etc/dnsmasq.d/03-pihole-wildcard.conf /etc/pihole/wildcard.list
+    ''')
+    assert 'Wildcard blocking' not in run_script(Pihole, 'pihole -q ads.doubleclick.net').stdout
+
+
+
+def test_gravity_whitelistDelta_matches_rebuild(Pihole):
+    ''' confirms applying whitelist changes to gravity.list gives the same
+    domains as rebuilding it, and is refused when gravity.list is stale '''
+    write_gravity_fixtures(Pihole)
+    script = '''
+    source /opt/pihole/gravity.sh
+    mkdir -p "${horizonCache}"
+    gravity_doWhitelist "${piholeDir}/${preEventHorizon}" "${whitelistFile}" "${piholeDir}/${eventHorizon}"
+    gravity_hostFormatGravity
+    '''
+    run_script(Pihole, '''
+    source /opt/pihole/gravity.sh
+    gravity_normalize "${piholeDir}/${preEventHorizon}" /tmp/list.0.hosts.domains /tmp/list.1.plain.domains
+    printf 'plain.example.org\\ntracker.example.com\\n' > "${whitelistFile}"
+    ''' + script)
+    run_script(Pihole, '''
+    printf 'ads.example.com\\ntracker.example.com\\nnot.in.horizon.com\\n' > /etc/pihole/whitelist.txt
+    source /opt/pihole/gravity.sh
+    gravity_whitelistDelta
+    sort /etc/pihole/gravity.list > /tmp/incremental.list
+    ''')
+    gravity_list = Pihole.run('cat /tmp/incremental.list').stdout
+    assert '192.168.1.10 plain.example.org\n' in gravity_list
+    assert 'fd00::10 plain.example.org\n' in gravity_list
+    assert 'ads.example.com' not in gravity_list
+    assert 'tracker.example.com' not in gravity_list
+    run_script(Pihole, script)
+    compare = Pihole.run('sort /etc/pihole/gravity.list | cmp - /tmp/incremental.list')
+    assert compare.rc == 0
+    stale = Pihole.run('''
+    echo 'IPV4_ADDRESS=10.0.0.1' >> /etc/pihole/setupVars.conf
+    source /opt/pihole/gravity.sh
+    gravity_whitelistDelta
+    ''')
+    assert stale.rc != 0
+
+
+
+def test_gravity_whitelist_only_after_upgrade(Pihole):
+    ''' an event horizon left by an older gravity.sh is sorted in the locale,
+    which puts punctuation elsewhere than LC_ALL=C does; gravity -w sorts it
+    again rather than have comm miss whitelisted domains '''
+    mock_command('systemctl', {}, Pihole)
+    run_script(Pihole, '''
+    ln -s /opt/pihole/pihole /usr/local/bin/pihole
+    echo 'IPV4_ADDRESS=192.168.1.10/24' > /etc/pihole/setupVars.conf
+    printf 'ads-1.example.com\\nadsb.example.com\\nads.example.com\\nbeta.example.com\\n' > /etc/pihole/list.preEventHorizon
+    printf '192.168.1.10 ads.example.com\\n' > /etc/pihole/gravity.list
+    echo 'ads.example.com' > /etc/pihole/whitelist.txt
+    bash /opt/pihole/gravity.sh -w > /dev/null
+    ''')
+    assert Pihole.run('grep . /etc/pihole/gravity.list').stdout == (
+        '192.168.1.10 ads-1.example.com\n192.168.1.10 adsb.example.com\n192.168.1.10 beta.example.com\n')
+    # The next change of the whitelist is applied to gravity.list as it is
+    run_script(Pihole, 'echo beta.example.com >> /etc/pihole/whitelist.txt')
+    delta = run_script(Pihole, 'bash /opt/pihole/gravity.sh -w').stdout
+    assert 'Applying whitelist changes to gravity.list... done!' in delta
+    assert 'beta.example.com' not in Pihole.run('cat /etc/pihole/gravity.list').stdout
+
+
+def test_gravity_compact_format(Pihole):
+    ''' confirms compact mode lists many domains after each address and
+    whitelist changes are applied to it like a rebuild would '''
+    write_gravity_fixtures(Pihole)
+    script = '''
+    source /opt/pihole/gravity.sh
+    compactWidth=3
+    mkdir -p "${horizonCache}"
+    gravity_doWhitelist "${piholeDir}/${preEventHorizon}" "${whitelistFile}" "${piholeDir}/${eventHorizon}"
+    gravity_hostFormatGravity
+    '''
+    run_script(Pihole, '''
+    echo 'GRAVITY_COMPACT=true' >> /etc/pihole/setupVars.conf
+    source /opt/pihole/gravity.sh
+    gravity_normalize "${piholeDir}/${preEventHorizon}" /tmp/list.0.hosts.domains /tmp/list.1.plain.domains
+    touch "${whitelistFile}"
+    ''' + script)
+    gravity_list = Pihole.run('cat /etc/pihole/gravity.list').stdout
+    expected_start = ('192.168.1.10 0.0.0.0 Tabbed.Example.com ads.example.com\n'
+                      'fd00::10 0.0.0.0 Tabbed.Example.com ads.example.com\n'
+                      '192.168.1.10 dots.example.org first.example.com path.example.org\n')
+    assert expected_start in gravity_list
+    assert len(gravity_list.strip().splitlines()) == 6
+    run_script(Pihole, '''
+    printf 'ads.example.com\\nplain.example.org\\nfirst.example.com\\npath.example.org\\n' > /etc/pihole/whitelist.txt
+    source /opt/pihole/gravity.sh
+    gravity_whitelistDelta
+    ''')
+    # One "address domain" pair per line, no matter how the names were spread over the lines
+    expand = 'awk \'{ for (i = 2; i <= NF; i++) print $1, $i }\' /etc/pihole/gravity.list | sort'
+    incremental = Pihole.run(expand).stdout
+    assert 'ads.example.com' not in incremental
+    assert 'plain.example.org' not in incremental
+    run_script(Pihole, script)
+    rebuilt = Pihole.run(expand).stdout
+    assert incremental == rebuilt
+
+
+# The steps of a gravity run from the event horizon to gravity.list
+ECLIPSE = '''
+source /opt/pihole/gravity.sh
+mkdir -p "${horizonCache}"
+touch "${whitelistFile}"
+gravity_doWhitelist "${piholeDir}/${preEventHorizon}" "${whitelistFile}" "${piholeDir}/${eventHorizon}"
+gravity_eclipse
+gravity_Wildcard
+gravity_hostFormatGravity
+gravity_metrics
+'''
+
+
+def test_gravity_leaves_out_domains_wildcards_block(Pihole):
+    ''' confirms domains below a wildcard are left out of gravity.list, by
+    as many bytes as reported, and wildcard lines another wildcard covers
+    are only left out of the wildcard index '''
+    write_gravity_fixtures(Pihole)
+    run_script(Pihole, '''
+    source /opt/pihole/gravity.sh
+    gravity_normalize "${piholeDir}/${preEventHorizon}" /tmp/list.0.hosts.domains /tmp/list.1.plain.domains
+    ''' + ECLIPSE + '''
+    stat -c %s /etc/pihole/gravity.list > /tmp/size
+    ''')
+    output = run_script(Pihole, '''
+    printf 'address=/example.org/192.168.1.10\\naddress=/example.org/fd00::10\\n' > /etc/dnsmasq.d/03-pihole-wildcard.conf
+    printf 'address=/path.example.org/192.168.1.10\\naddress=/example.org/192.168.1.10\\n' >> /etc/dnsmasq.d/03-pihole-wildcard.conf
+    ''' + ECLIPSE).stdout
+    assert '::: 4 domains blocked by wildcards left out of gravity.list' in output
+    # The wildcard file is the user's, the covered lines are only left out of the index
+    assert Pihole.run('cat /etc/dnsmasq.d/03-pihole-wildcard.conf').stdout == \
+        'address=/example.org/192.168.1.10\naddress=/example.org/fd00::10\n' \
+        'address=/path.example.org/192.168.1.10\naddress=/example.org/192.168.1.10\n'
+    assert Pihole.run('cat /etc/pihole/gravity.index.wildcards').stdout == \
+        'org.example\taddress=/example.org/192.168.1.10\norg.example\taddress=/example.org/fd00::10\n'
+    gravity_list = Pihole.run('cat /etc/pihole/gravity.list').stdout
+    assert 'example.org' not in gravity_list
+    assert '192.168.1.10 Tabbed.Example.com\n' in gravity_list
+    metrics = Pihole.run('cat /etc/pihole/gravity.metrics').stdout
+    assert 'pihole_gravity_eclipsed_domains 4\n' in metrics
+    smaller = int(Pihole.run('echo $(( $(cat /tmp/size) - $(stat -c %s /etc/pihole/gravity.list) ))').stdout)
+    assert 'pihole_gravity_eclipsed_bytes {}\n'.format(smaller) in metrics
+    # Without the parent the wildcard below it blocks again
+    run_script(Pihole, 'sed -i "/\\/example.org\\//d" /etc/dnsmasq.d/03-pihole-wildcard.conf' + ECLIPSE)
+    assert Pihole.run('cat /etc/pihole/gravity.index.wildcards').stdout == \
+        'org.example.path\taddress=/path.example.org/192.168.1.10\n'
+    rebuilt = Pihole.run('cat /etc/pihole/gravity.list').stdout
+    assert 'path.example.org' not in rebuilt
+    assert 'plain.example.org' in rebuilt
+
+
+def test_gravity_promotes_parents_of_many_listed_domains(Pihole):
+    ''' confirms only listed domains with enough listed subdomains become
+    wildcards, never above a whitelisted domain or below another wildcard,
+    and whitelisting below one needs gravity.list to be rebuilt '''
+    write_gravity_fixtures(Pihole)
+    output = run_script(Pihole, '''
+    echo 'GRAVITY_WILDCARD_FANOUT=3' >> /etc/pihole/setupVars.conf
+    printf 'address=/ads.example.org/192.168.1.10\\naddress=/ads.example.org/fd00::10\\n' > /etc/dnsmasq.d/03-pihole-wildcard.conf
+    for parent in tracker.net cdn.tracker.net ads.example.com ads.example.org; do
+        echo "${parent}"
+        for sub in a b c d; do echo "${sub}.${parent}"; done
+    done | LC_ALL=C sort > /etc/pihole/list.preEventHorizon
+    # Listed subdomains only, example.com itself is not listed
+    printf 'one.example.com\\ntwo.example.com\\nthree.example.com\\n' >> /etc/pihole/list.preEventHorizon
+    LC_ALL=C sort -o /etc/pihole/list.preEventHorizon /etc/pihole/list.preEventHorizon
+    echo 'b.ads.example.com' > /etc/pihole/whitelist.txt
+    ''' + ECLIPSE).stdout
+    assert '::: Blocking 1 domain with at least 3 listed subdomains as wildcard' in output
+    assert Pihole.run('cat /etc/dnsmasq.d/05-pihole-gravity-wildcard.conf').stdout == \
+        'address=/tracker.net/192.168.1.10\naddress=/tracker.net/fd00::10\n'
+    gravity_list = Pihole.run('cat /etc/pihole/gravity.list').stdout
+    assert 'tracker.net' not in gravity_list
+    assert 'ads.example.org' not in gravity_list
+    assert '192.168.1.10 a.ads.example.com\n' in gravity_list
+    assert '192.168.1.10 one.example.com\n' in gravity_list
+    assert 'net.tracker\taddress=/tracker.net/fd00::10\n' in Pihole.run('cat /etc/pihole/gravity.index.wildcards').stdout
+    delta = Pihole.run('''
+    echo 'a.tracker.net' >> /etc/pihole/whitelist.txt
+    source /opt/pihole/gravity.sh
+    gravity_whitelistDelta
+    ''')
+    assert delta.rc != 0
+    run_script(Pihole, ECLIPSE)
+    # tracker.net is no wildcard any more, its listed subdomain with subdomains of its own is
+    assert Pihole.run('cat /etc/dnsmasq.d/05-pihole-gravity-wildcard.conf').stdout == \
+        'address=/cdn.tracker.net/192.168.1.10\naddress=/cdn.tracker.net/fd00::10\n'
+    assert '192.168.1.10 b.tracker.net\n' in Pihole.run('cat /etc/pihole/gravity.list').stdout
+
+
+DNS_PROBE = '''\
+import socket, struct, sys, time
+# Ask the test dnsmasq for a blocked domain every 10ms and report the longest
+# time without an answer, how many queries went unanswered and the last answer
+def query(sock, name):
+    packet = struct.pack('>HHHHHH', 1, 0x0100, 1, 0, 0, 0)
+    for label in name.split('.'):
+        packet += struct.pack('B', len(label)) + label.encode('ascii')
+    packet += b'\\\\0' + struct.pack('>HH', 1, 1)
+    sock.sendto(packet, ('127.0.0.1', 5353))
+    return struct.unpack('>HHHHHH', sock.recv(512)[:12])[3]
+sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+sock.settimeout(0.25)
+start = last = time.time()
+gap = failures = answers = 0
+while time.time() - start < float(sys.argv[2]):
+    try:
+        answers = query(sock, sys.argv[1])
+        gap = max(gap, time.time() - last)
+        last = time.time()
+    except socket.timeout:
+        failures += 1
+    time.sleep(0.01)
+print('%d %d %d' % (gap * 1000, failures, answers))
+'''
+
+
+def test_gravity_reload_keeps_answering_queries(Pihole):
+    ''' measures the resolution gap of a local dnsmasq while gravity swaps
+    its lists in, which should be reloaded without a restart '''
+    if Pihole.run('command -v dnsmasq').rc != 0:
+        pytest.skip('dnsmasq is not installed')
+    write_gravity_fixtures(Pihole)
+    run_script(Pihole, '''
+    printf '192.168.1.10 ads.example.com\\n' > /etc/pihole/gravity.list
+    dnsmasq --conf-file=/dev/null --port=5353 --listen-address=127.0.0.1 \\
+        --bind-interfaces --no-resolv --no-hosts --cache-size=10000 \\
+        --addn-hosts=/etc/pihole/gravity.list --user=root
+    cat /etc/dnsmasq.conf /etc/dnsmasq.d/* 2> /dev/null | sha1sum > /etc/pihole/dnsmasq.stamp
+    cat <<EOF > /tmp/probe.py\n{}EOF
+    '''.format(DNS_PROBE))
+    probe = run_script(Pihole, '''
+    python /tmp/probe.py ads.example.com 3 > /tmp/probe.out &
+    sleep 0.5
+    for i in 1 2 3 4 5; do
+        printf '192.168.1.10 ads.example.com\\n192.168.1.10 new.example.com\\n' > /etc/pihole/gravity.list.new
+        mv /etc/pihole/gravity.list.new /etc/pihole/gravity.list
+        pihole restartdns reload
+        sleep 0.3
+    done
+    wait
+    python /tmp/probe.py new.example.com 0.1
+    cat /tmp/probe.out
+    ''')
+    new_domain, during_reload = probe.stdout.strip().splitlines()[-2:]
+    gap, failures, answers = [int(value) for value in during_reload.split()]
+    assert failures == 0
+    assert gap < 250
+    assert answers == 1
+    assert new_domain.split()[1:] == ['0', '1']
+
+
+def test_gravity_metrics(Pihole):
+    ''' confirms the statistics of every list are written for the metrics
+    collector, and kept when gravity runs without downloading the lists '''
+    write_gravity_fixtures(Pihole)
+    script = '''
+    source /opt/pihole/gravity.sh
+    printf 'ads.example.com\\n' > /etc/pihole/blacklist.txt
+    printf 'plain.example.org\\nspaced.example.org\\n' > /etc/pihole/whitelist.txt
+    sources=(http://hosts.example.net/list.txt 'http://plain.example.net/"quoted"')
+    matter=(/tmp/list.0.hosts.domains /tmp/list.1.plain.domains)
+    gravity_advanced > /dev/null
+    transportStats=("200 0.250 1024" "404 0.010 0")
+    gravity_metrics
+    '''
+    run_script(Pihole, script)
+    metrics = Pihole.run('cat /etc/pihole/gravity.metrics').stdout
+    hosts = '{list="0",url="http://hosts.example.net/list.txt"}'
+    plain = '{list="1",url="http://plain.example.net/\\"quoted\\""}'
+    assert 'pihole_gravity_source_domains{} 5\n'.format(hosts) in metrics
+    assert 'pihole_gravity_source_domains{} 5\n'.format(plain) in metrics
+    assert 'pihole_gravity_source_http_status{} 404\n'.format(plain) in metrics
+    assert 'pihole_gravity_source_download_seconds{} 0.250\n'.format(hosts) in metrics
+    assert 'pihole_gravity_source_download_bytes{} 1024\n'.format(hosts) in metrics
+    assert 'pihole_gravity_unique_domains 9\n' in metrics
+    assert 'pihole_gravity_whitelisted_domains 2\n' in metrics
+    assert 'pihole_gravity_blacklisted_domains 1\n' in metrics
+    assert metrics.count('# TYPE ') == 9
+    # A run that did not download the lists keeps their last statistics
+    run_script(Pihole, '''
+    source /opt/pihole/gravity.sh
+    gravity_metrics
+    ''')
+    kept = Pihole.run('cat /etc/pihole/gravity.metrics').stdout
+    assert [line for line in kept.splitlines() if 'source_' in line] == \
+        [line for line in metrics.splitlines() if 'source_' in line]
+
+
+def test_gravity_profile_report(Pihole):
+    ''' confirms --profile appends a JSON report of every stage, nested
+    stages included, and keeps the reports of earlier runs. A download only
+    counts the CPU time of its own subshell '''
+    write_gravity_fixtures(Pihole)
+    script = '''
+    source /opt/pihole/gravity.sh
+    profile=true
+    gravity_profileStart --profile
+    sources=(http://hosts.example.net/list.txt)
+    transportStats=("200 0.250 1024")
+    busy() {
+        local i
+        for ((i = 0; i < 200000; i++)); do :; done
+    }
+    gravity_stage busy busy
+    ( profileList=0; gravity_stage download sleep 0.2 )
+    outer() {
+        gravity_stage inner gravity_normalize /tmp/profiled /tmp/list.0.hosts.domains /tmp/list.1.plain.domains
+    }
+    gravity_stage outer outer > /dev/null
+    gravity_profileReport
+    '''
+    run_script(Pihole, 'rm -f /etc/pihole/gravity.profile.jsonl')
+    first = run_script(Pihole, script)
+    assert 'Profile appended to /etc/pihole/gravity.profile.jsonl' in first.stdout
+    run_script(Pihole, script)
+    reports = Pihole.run('cat /etc/pihole/gravity.profile.jsonl').stdout.splitlines()
+    assert len(reports) == 2
+    report = json.loads(reports[-1])
+    assert report['options'] == '--profile'
+    assert report['wall_seconds'] >= 0.2
+    assert [stage['stage'] for stage in report['stages']] == ['busy', 'outer', 'outer/inner']
+    assert report['stages'][0]['cpu_seconds'] > 0.1
+    inner = report['stages'][2]
+    written = int(Pihole.run('stat -c %s /tmp/profiled').stdout)
+    assert inner['write_bytes'] >= written
+    assert inner['peak_rss_kb'] > 0
+    download, = report['downloads']
+    assert download['url'] == 'http://hosts.example.net/list.txt'
+    assert download['http_status'] == 200
+    assert download['download_bytes'] == 1024
+    assert download['wall_seconds'] >= 0.2
+    assert download['cpu_seconds'] < 0.1
@@ -0,0 +1,62 @@
+from textwrap import dedent
+from .test_automated_install import mock_command, run_script
+
+SETUPVARS = dedent('''\
+    IPV4_ADDRESS=192.168.1.10/24
+    IPV6_ADDRESS=fd00::10
+    ''')
+
+WILDCARDLIST = '/etc/dnsmasq.d/03-pihole-wildcard.conf'
+
+
+def write_list_fixtures(Pihole):
+    ''' write setupVars, a blacklist and a wildcard list to edit '''
+    mock_command('pihole', {'-g': ('', '0')}, Pihole)
+    Pihole.run('''
+    mkdir -p /etc/dnsmasq.d
+    cat <<EOF> /etc/pihole/setupVars.conf\n{}EOF
+    printf 'ads.example.com\\nkeep.example.com\\n' > /etc/pihole/blacklist.txt
+    printf 'address=/tracker.example.com/192.168.1.10\\n' > {}
+    printf 'address=/tracker.example.com/fd00::10\\n' >> {}
+    '''.format(SETUPVARS, WILDCARDLIST, WILDCARDLIST))
+
+
+def test_list_bulk_whitelist_from_stdin(Pihole):
+    ''' confirms domains piped in are validated, added once and removed
+    from the blacklist and wildcards with a single reload '''
+    write_list_fixtures(Pihole)
+    output = run_script(Pihole, '''
+    printf 'Ads.Example.com\\nnew.example.com # comment\\n\\nnot_valid\\ntracker.example.com new.example.com\\n' \\
+        | /opt/pihole/list.sh -w -
+    ''').stdout
+    assert '::: not_valid is not a valid argument or domain name' in output
+    whitelist = Pihole.run('cat /etc/pihole/whitelist.txt').stdout
+    assert whitelist == 'ads.example.com\nnew.example.com\ntracker.example.com\n'
+    blacklist = Pihole.run('cat /etc/pihole/blacklist.txt').stdout
+    assert blacklist == 'keep.example.com\n'
+    wildcards = Pihole.run('cat {}'.format(WILDCARDLIST)).stdout
+    assert wildcards == ''
+    reloads = Pihole.run('cat /var/log/pihole').stdout
+    assert reloads.count('-g -sd') == 1
+
+
+def test_list_bulk_wildcards_from_file(Pihole):
+    ''' confirms wildcards are added for both addresses and removed again
+    when read from a file, without touching the list when nothing changed '''
+    write_list_fixtures(Pihole)
+    run_script(Pihole, '''
+    printf 'doubleclick.net\\ntracker.example.com\\n' > /tmp/wildcards.txt
+    /opt/pihole/list.sh -wild --input=/tmp/wildcards.txt
+    ''')
+    wildcards = Pihole.run('cat {}'.format(WILDCARDLIST)).stdout
+    expected_wildcards = ('address=/tracker.example.com/192.168.1.10\n'
+                          'address=/tracker.example.com/fd00::10\n'
+                          'address=/doubleclick.net/192.168.1.10\n'
+                          'address=/doubleclick.net/fd00::10\n')
+    assert wildcards == expected_wildcards
+    run_script(Pihole, 'rm /var/log/pihole')
+    run_script(Pihole, '/opt/pihole/list.sh -wild --input=/tmp/wildcards.txt')
+    assert Pihole.run('cat /var/log/pihole').rc != 0
+    run_script(Pihole, '/opt/pihole/list.sh -wild -d --input=/tmp/wildcards.txt')
+    wildcards = Pihole.run('cat {}'.format(WILDCARDLIST)).stdout
+    assert wildcards == ''
@@ -0,0 +1,206 @@
+from .test_automated_install import run_script
+
+# Queries of the current hour, which is rolled up by the minute, with the date and hour filled in by the shell
+LOG_LINES = '''\
+${day} ${hour}:00:01 dnsmasq[123]: query[A] ads.example.com from 192.168.1.20
+${day} ${hour}:00:01 dnsmasq[123]: /etc/pihole/gravity.list ads.example.com is 192.168.1.10
+${day} ${hour}:00:02 dnsmasq[123]: query[A] WWW.example.org from 192.168.1.21
+${day} ${hour}:00:02 dnsmasq[123]: forwarded www.example.org to 8.8.8.8
+${day} ${hour}:00:02 dnsmasq[123]: reply www.example.org is 93.184.216.34
+${day} ${hour}:01:05 dnsmasq[123]: query[AAAA] www.example.org from 192.168.1.20
+${day} ${hour}:01:05 dnsmasq[123]: cached www.example.org is ::1
+'''
+
+# Domains the Pi-hole blocks are answered with its own address
+SETUPVARS = '''
+printf 'IPV4_ADDRESS=192.168.1.10/24\\nIPV6_ADDRESS=\\n' > /etc/pihole/setupVars.conf
+'''
+
+
+def write_log(Pihole, lines, log='/var/log/pihole.log', append=True):
+    run_script(Pihole, SETUPVARS + '''
+    day=$(date '+%b %e')
+    hour=$(date +%H)
+    cat <<EOF{} {}\n{}EOF
+    '''.format('>>' if append else '>', log, lines))
+
+
+def report(Pihole, *minutes):
+    ''' the summary of the given minutes of the current hour '''
+    return run_script(Pihole, 'today=$(date +%F); hour=$(date +%H); pihole querylog {}'.format(' '.join(
+        '"$today $hour:{}"'.format(minute) for minute in minutes))).stdout
+
+
+def test_querylog_rolls_up_queries_per_minute(Pihole):
+    ''' counts of every minute, client and domain, blocked and allowed '''
+    write_log(Pihole, LOG_LINES, append=False)
+    run_script(Pihole, 'pihole querylog --ingest')
+    rollup = Pihole.run('cat /etc/pihole/querylog/$(date +%Y%m%d%H)').stdout
+    minute = Pihole.run('date +%Y%m%d%H').stdout.strip() + '00'
+    assert '{}\tt\t-\t2\t1\t1\t0'.format(minute) in rollup
+    assert '{}\tc\t192.168.1.20\t1\t1'.format(minute) in rollup
+    assert '{}\td\twww.example.org\t1\t0'.format(minute) in rollup
+    summary = report(Pihole, '00', '01')
+    assert ':::     Total queries: 3' in summary
+    assert ':::     Blocked:       1 (33.3%)' in summary
+    assert ':::            2 www.example.org' in summary
+    # The range ends before the query of minute 01
+    assert ':::     Total queries: 2' in report(Pihole, '00', '00')
+
+
+def test_querylog_follows_the_log_across_rotations(Pihole):
+    ''' every line is counted once: lines still being written are left for
+    the next run, and what was logged before a copytruncate rotation is read
+    from pihole.log.1 '''
+    write_log(Pihole, LOG_LINES, append=False)
+    run_script(Pihole, '''
+    day=$(date '+%b %e')
+    hour=$(date +%H)
+    printf "${day} ${hour}:02:00 dnsmasq[123]: query[A] partial.example.com from 192.168" >> /var/log/pihole.log
+    pihole querylog --ingest
+    printf ".1.22\\n${day} ${hour}:02:00 dnsmasq[123]: config partial.example.com is 192.168.1.10\\n" >> /var/log/pihole.log
+    pihole querylog --ingest
+    ''')
+    write_log(Pihole, '${day} ${hour}:03:00 dnsmasq[123]: query[A] before.example.com from 192.168.1.22\n')
+    # What logrotate's copytruncate does
+    run_script(Pihole, 'cp /var/log/pihole.log /var/log/pihole.log.1; : > /var/log/pihole.log')
+    write_log(Pihole, '${day} ${hour}:04:00 dnsmasq[123]: query[A] after.example.com from 192.168.1.22\n')
+    summary = report(Pihole, '00', '59')
+    assert ':::     Total queries: 6' in summary
+    assert ':::     Blocked:       2 (33.3%)' in summary
+    assert ':::            3 192.168.1.22' in summary
+    for domain in ['partial.example.com', 'before.example.com', 'after.example.com']:
+        assert ':::            1 {}'.format(domain) in summary
+
+
+def test_querylog_offsets_count_bytes(Pihole):
+    ''' a line with characters of more than one byte does not throw the
+    offset the next run starts at off '''
+    write_log(Pihole, LOG_LINES.replace('WWW.example.org', 'WWW.ex\xc3\xa4mple.org'), append=False)
+    run_script(Pihole, 'LC_ALL=C.UTF-8 pihole querylog --ingest')
+    write_log(Pihole, '${day} ${hour}:04:00 dnsmasq[123]: query[A] after.example.com from 192.168.1.22\n')
+    run_script(Pihole, 'LC_ALL=C.UTF-8 pihole querylog --ingest')
+    assert Pihole.run('cut -d " " -f 2 /etc/pihole/querylog/ingest.state').stdout.strip() == \
+        Pihole.run('stat -c %s /var/log/pihole.log').stdout.strip()
+    summary = report(Pihole, '00', '59')
+    assert ':::     Total queries: 4' in summary
+    assert ':::            1 after.example.com' in summary
+
+
+
+def test_querylog_credits_answers_to_the_client_that_asked(Pihole):
+    ''' an answer logged in the minute after its query is still the client's,
+    and only answers with the address of the Pi-hole count as blocked '''
+    write_log(Pihole, '''\
+${day} ${hour}:00:59 dnsmasq[123]: query[A] late.example.com from 192.168.1.30
+${day} ${hour}:01:00 dnsmasq[123]: /etc/pihole/gravity.list late.example.com is 192.168.1.10
+${day} ${hour}:01:01 dnsmasq[123]: query[A] router.lan from 192.168.1.30
+${day} ${hour}:01:01 dnsmasq[123]: config router.lan is 192.168.1.1
+${day} ${hour}:01:02 dnsmasq[123]: query[A] wild.example.com from 192.168.1.30
+${day} ${hour}:01:02 dnsmasq[123]: config wild.example.com is 192.168.1.10
+''', append=False)
+    run_script(Pihole, 'pihole querylog --ingest')
+    minute = Pihole.run('date +%Y%m%d%H').stdout.strip() + '01'
+    rollup = Pihole.run('cat /etc/pihole/querylog/$(date +%Y%m%d%H)').stdout
+    assert '{}\tt\t-\t2\t2\t0\t0\n'.format(minute) in rollup
+    assert '{}\tc\t192.168.1.30\t2\t2\n'.format(minute) in rollup
+    assert '{}\td\trouter.lan\t1\t0\n'.format(minute) in rollup
+
+
+def test_querylog_sums_up_hours_and_days_that_are_over(Pihole):
+    ''' the minutes of a day that is over are kept as one sum of the day, to
+    which lines ingested late are added '''
+    run_script(Pihole, SETUPVARS + '''
+    day=$(date -d '-3 days' '+%b %e')
+    for hour in 05 06; do
+        echo "${day} ${hour}:00:00 dnsmasq[123]: query[A] old.example.com from 10.0.0.1"
+        echo "${day} ${hour}:30:00 dnsmasq[123]: query[A] old.example.com from 10.0.0.2"
+    done > /var/log/pihole.log
+    pihole querylog --ingest
+    ''')
+    day = Pihole.run("date -d '-3 days' +%Y%m%d").stdout.strip()
+    assert Pihole.run('ls /etc/pihole/querylog | grep "^[0-9]"').stdout == '{}.day\n'.format(day)
+    assert '{}\td\told.example.com\t4\t0\n'.format(day) in \
+        Pihole.run('cat /etc/pihole/querylog/{}.day'.format(day)).stdout
+    run_script(Pihole, '''
+    echo "$(date -d '-3 days' '+%b %e') 07:00:00 dnsmasq[123]: query[A] late.example.com from 10.0.0.1" >> /var/log/pihole.log
+    pihole querylog --ingest
+    ''')
+    assert Pihole.run('ls /etc/pihole/querylog | grep "^[0-9]"').stdout == '{}.day\n'.format(day)
+    # A range within the day counts the whole day
+    summary = run_script(Pihole, 'pihole querylog "$(date -d \'-3 days\' +%F) 05:00" "$(date -d \'-3 days\' +%F) 05:59"').stdout
+    assert ':::     Total queries: 5' in summary
+    assert ':::            3 10.0.0.1' in summary
+
+
+# Three hours of queries from 50 clients for 700 domains, three days ago
+OLD_LOG = '''
+day=$(date -d '-3 days' '+%b %e')
+awk -v day="${day}" 'BEGIN {
+    for (i = 0; i < 30000; i++) {
+        t = sprintf("%s %02d:%02d:%02d", day, int(i / 3600) % 24, int(i / 60) % 60, i % 60)
+        printf "%s dnsmasq[123]: query[A] host%d.example.com from 10.0.0.%d\\n", t, i % 700, i % 50
+        printf "%s dnsmasq[123]: forwarded host%d.example.com to 8.8.8.8\\n", t, i % 700
+    }
+}' > /tmp/old.log
+'''
+
+
+def test_querylog_archive_search_reads_only_matching_blocks(Pihole):
+    ''' archives are valid gzip files, and a search decompresses only the
+    blocks its index says can hold the time range and client asked for '''
+    run_script(Pihole, OLD_LOG + '''
+    source /opt/pihole/queryLog.sh
+    blockLines=1000
+    archiveFunc /tmp/old.log /var/log/pihole.log.2.gz
+    ''')
+    assert Pihole.run('gzip -dc /var/log/pihole.log.2.gz | cmp - /tmp/old.log').rc == 0
+    assert Pihole.run('grep -c "^b" /var/log/pihole.log.2.gz.idx').stdout.strip() == '60'
+    search = run_script(Pihole, '''
+    day=$(date -d '-3 days' +%F)
+    pihole querylog --client 10.0.0.7 "${day} 04:00" "${day} 04:05"
+    ''')
+    assert '::: pihole.log.2.gz: 2 of 60 blocks read' in search.stderr
+    expected = Pihole.run('''
+    grep ' 04:0[0-5]:' /tmp/old.log | grep -A 1 ' from 10.0.0.7$' | grep -v '^--'
+    ''').stdout
+    # Both ends are whole minutes, like the reports
+    assert search.stdout == expected
+    assert search.stdout.count('query[A]') == 8
+
+
+def test_flush_hands_off_log_without_copying(Pihole):
+    ''' the log is moved to pihole.log.1 instead of copied, and the one
+    before it is archived '''
+    run_script(Pihole, '''
+    day=$(date '+%b %e')
+    echo "${day} 10:00:00 dnsmasq[123]: query[A] first.example.com from 10.0.0.1" > /var/log/pihole.log
+    stat -c %i /var/log/pihole.log > /tmp/inode
+    pihole flush once quiet
+    echo "${day} 11:00:00 dnsmasq[123]: query[A] second.example.com from 10.0.0.1" >> /var/log/pihole.log
+    ''')
+    assert Pihole.run('stat -c %i /var/log/pihole.log.1').stdout == Pihole.run('cat /tmp/inode').stdout
+    run_script(Pihole, 'pihole flush once quiet')
+    archived = Pihole.run('gzip -dc /var/log/pihole.log.2.gz').stdout
+    assert 'first.example.com' in archived
+    assert 'second.example.com' in Pihole.run('cat /var/log/pihole.log.1').stdout
+    assert Pihole.run('stat -c %s /var/log/pihole.log').stdout.strip() == '0'
+    search = run_script(Pihole, 'pihole querylog --domain first.example.com "$(date +%F)"').stdout
+    assert 'query[A] first.example.com from 10.0.0.1' in search
+
+
+def test_flush_rolls_up_what_is_logged_between_rotations(Pihole):
+    ''' a manual flush rotates twice, what dnsmasq logs in between is
+    rolled up before it goes out of sight as well '''
+    write_log(Pihole, LOG_LINES, append=False)
+    run_script(Pihole, '''
+    day=$(date '+%b %e')
+    hour=$(date +%H)
+    pihole flush quiet &
+    until [ -s /var/log/pihole.log.1 ]; do sleep 0.1; done
+    echo "${day} ${hour}:05:00 dnsmasq[123]: query[A] between.example.com from 10.0.0.1" >> /var/log/pihole.log
+    wait
+    ''')
+    summary = report(Pihole, '00', '59')
+    assert ':::     Total queries: 4' in summary
+    assert ':::            1 between.example.com' in summary
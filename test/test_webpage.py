@@ -0,0 +1,106 @@
+from .test_automated_install import run_script, mock_command
+
+# An installed Pi-hole, as far as the settings of pihole -a are concerned
+SETTINGS = '''
+cat <<EOF > /etc/pihole/setupVars.conf
+PIHOLE_INTERFACE=eth0
+IPV4_ADDRESS=192.168.1.10/24
+IPV6_ADDRESS=
+PIHOLE_DNS_1=8.8.8.8
+PIHOLE_DNS_2=8.8.4.4
+QUERY_LOGGING=true
+INSTALL_WEB=true
+EOF
+sed -e 's/@DNS1@/8.8.8.8/' -e 's/@DNS2@/8.8.4.4/' -e 's/@INT@/eth0/' \\
+    /etc/.pihole/advanced/01-pihole.conf > /etc/dnsmasq.d/01-pihole.conf
+rm -f /etc/dnsmasq.d/02-pihole-dhcp.conf /etc/dnsmasq.d/04-pihole-static-dhcp.conf
+'''
+
+# What the admin console changes when it is provisioned
+BATCH = '''\
+-i local -web
+setdns 1.1.1.1,1.0.0.1 domain-needed bogus-priv dnssec
+hostrecord router.lan 192.168.1.1
+enabledhcp 192.168.1.100 192.168.1.200 192.168.1.1 24 lan false
+addstaticdhcp aa:bb:cc:dd:ee:ff 192.168.1.50 printer
+privacymode true
+-c
+'''
+
+FILES = ('/etc/pihole/setupVars.conf /etc/dnsmasq.d/01-pihole.conf '
+         '/etc/dnsmasq.d/02-pihole-dhcp.conf /etc/dnsmasq.d/04-pihole-static-dhcp.conf')
+
+
+def test_webpage_batch_matches_single_settings(Pihole):
+    ''' a batch leaves the files as the same settings one by one do, with
+    dnsmasq restarted once, and nothing at all happens when it changes nothing '''
+    mock_command('systemctl', {}, Pihole)
+    run_script(Pihole, SETTINGS + '''
+    cat <<'EOF' > /tmp/batch\n{}EOF
+    while read -r line; do pihole -a ${{line}} > /dev/null; done < /tmp/batch
+    mkdir -p /tmp/single
+    cp {} /tmp/single
+    '''.format(BATCH, FILES))
+    assert Pihole.run('grep -c restart /var/log/systemctl').stdout.strip() == '3'
+    mock_command('systemctl', {}, Pihole)
+    run_script(Pihole, SETTINGS + 'pihole -a batch < /tmp/batch')
+    for name in FILES.split():
+        assert Pihole.run('cmp {} /tmp/single/{}'.format(name, name.split('/')[-1])).rc == 0
+    assert 'PIHOLE_DNS_1=1.1.1.1\n' in Pihole.run('cat /etc/pihole/setupVars.conf').stdout
+    assert 'dhcp-host=aa:bb:cc:dd:ee:ff,192.168.1.50,printer\n' in \
+        Pihole.run('cat /etc/dnsmasq.d/04-pihole-static-dhcp.conf').stdout
+    assert Pihole.run('cat /var/log/systemctl').stdout == '/usr/local/bin/systemctl restart dnsmasq\n'
+    inodes = Pihole.run('stat -c %i ' + FILES).stdout
+    # Adding a static lease again would add it twice
+    run_script(Pihole, 'grep -v addstaticdhcp /tmp/batch | pihole -a batch')
+    assert Pihole.run('stat -c %i ' + FILES).stdout == inodes
+    assert len(Pihole.run('cat /var/log/systemctl').stdout.splitlines()) == 1
+
+
+def test_webpage_batch_changes_nothing_when_a_setting_fails(Pihole):
+    ''' settings that can not be batched, or fail, leave every file as it was '''
+    mock_command('systemctl', {}, Pihole)
+    run_script(Pihole, SETTINGS + 'cp /etc/pihole/setupVars.conf /etc/dnsmasq.d/01-pihole.conf /tmp')
+    refused = Pihole.run("printf 'setdns 9.9.9.9\\npassword secret\\n' | pihole -a batch")
+    assert refused.rc == 1
+    assert '::: password can not be used in a batch, nothing was changed' in refused.stdout
+    failed = Pihole.run("printf 'setdns 9.9.9.9\\nadlist rename http://example.com\\n' | pihole -a batch")
+    assert failed.rc == 1
+    assert "::: 'adlist rename http://example.com' failed, nothing was changed" in failed.stdout
+    assert Pihole.run('cmp /etc/pihole/setupVars.conf /tmp/setupVars.conf').rc == 0
+    assert Pihole.run('cmp /etc/dnsmasq.d/01-pihole.conf /tmp/01-pihole.conf').rc == 0
+    assert Pihole.run('cat /var/log/systemctl').stdout == ''
+    quoted = Pihole.run("printf 'setdns 9.9.9.9\\nhostrecord \"my router.lan\" 192.168.1.1\\n' | pihole -a batch")
+    assert quoted.rc == 1
+    assert 'arguments with spaces can not be used in a batch, nothing was changed' in quoted.stdout
+    assert Pihole.run('cmp /etc/pihole/setupVars.conf /tmp/setupVars.conf').rc == 0
+
+
+def test_webpage_deletes_only_the_settings_it_changes(Pihole):
+    ''' settings are deleted by their key, keys that merely contain it are kept '''
+    mock_command('systemctl', {}, Pihole)
+    run_script(Pihole, SETTINGS + '''
+    echo 'MY_PIHOLE_DNS_NOTE=x' >> /etc/pihole/setupVars.conf
+    echo 'no-resolv-interface' >> /etc/dnsmasq.d/01-pihole.conf
+    pihole -a setdns 9.9.9.9
+    pihole -a -i all
+    pihole -a -i local
+    ''')
+    assert 'MY_PIHOLE_DNS_NOTE=x\n' in Pihole.run('cat /etc/pihole/setupVars.conf').stdout
+    conf = Pihole.run('cat /etc/dnsmasq.d/01-pihole.conf').stdout
+    assert 'no-resolv-interface\n' in conf
+    assert 'except-interface' not in conf
+    assert 'local-service\n' in conf
+
+
+def test_webpage_batch_forgets_removed_settings(Pihole):
+    ''' a later action of a batch does not see what an earlier one removed '''
+    mock_command('systemctl', {}, Pihole)
+    run_script(Pihole, SETTINGS + '''
+    printf 'setdns 8.8.8.8,8.8.4.4,1.1.1.1 domain-needed\\nsetdns 9.9.9.9\\n' | pihole -a batch
+    ''')
+    assert Pihole.run('grep ^server= /etc/dnsmasq.d/01-pihole.conf').stdout == 'server=9.9.9.9\n'
+    assert Pihole.run('grep -c ^domain-needed /etc/dnsmasq.d/01-pihole.conf').stdout.strip() == '0'
+    setup_vars = Pihole.run('cat /etc/pihole/setupVars.conf').stdout
+    assert 'PIHOLE_DNS_1=9.9.9.9\n' in setup_vars
+    assert 'PIHOLE_DNS_2' not in setup_vars